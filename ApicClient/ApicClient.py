@@ -0,0 +1,687 @@
+# Shared APIC REST client with a pooled keep-alive session and cached login tokens
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+import fcntl
+import hashlib
+import json
+import os
+import re
+import stat
+import threading
+import time
+import requests
+
+
+class ApicError(Exception):
+    pass
+
+
+class ApicLoginError(ApicError):
+    pass
+
+
+class ApicTokenStoreError(ApicError):
+    pass
+
+
+class MemoryTokenStore():
+    """
+    Token store for a single process
+    """
+    def __init__(self):
+        self._tokens = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def locked(self, key):
+        with self._lock:
+            lock = self._locks.setdefault(key, threading.Lock())
+        with lock:
+            yield
+
+    def load(self, key):
+        return self._tokens.get(key)
+
+    def save(self, key, token):
+        self._tokens[key] = token
+
+    def generation(self, key):
+        # Nothing to share with, this process's query caches are invalidated directly
+        return None
+
+    def bump_generation(self, key):
+        pass
+
+
+class FileTokenStore():
+    """
+    Token store shared by every worker process on the host, one small file per APIC and user
+
+    The lock file makes sure only one process logs in while the others wait and reuse its token.  The directory
+    must belong to this user and be closed to everyone else, and no file in it is opened through a symlink, so
+    another local user can neither read the tokens nor plant links that make us overwrite their targets.
+
+    The store also keeps a query cache generation per APIC, a file that is replaced on every change so each
+    worker notices the change with one stat.
+    """
+    def __init__(self, directory):
+        self.directory = Path(directory)
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        self._check_directory()
+        self._memory = MemoryTokenStore()
+
+    def _check_directory(self):
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode):
+            raise ApicTokenStoreError(f"The APIC token directory {self.directory} is not a directory")
+        if info.st_uid != os.getuid():
+            raise ApicTokenStoreError(f"The APIC token directory {self.directory} belongs to another user")
+        if info.st_mode & 0o077:
+            raise ApicTokenStoreError(f"The APIC token directory {self.directory} must have mode 0700, "
+                                      f"it has {oct(stat.S_IMODE(info.st_mode))}")
+
+    @contextmanager
+    def locked(self, key):
+        # Threads are serialized in process first, flock only coordinates between processes
+        with self._memory.locked(key):
+            fd = os.open(self.directory / f"{key}.lock", os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+            with os.fdopen(fd, 'w') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def load(self, key):
+        try:
+            fd = os.open(self.directory / f"{key}.json", os.O_RDONLY | os.O_NOFOLLOW)
+            with os.fdopen(fd) as token_file:
+                return json.load(token_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, name, data):
+        tmp_file = self.directory / f"{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | os.O_NOFOLLOW
+        try:
+            fd = os.open(tmp_file, flags, 0o600)
+        except FileExistsError:
+            # Left by a crashed process that had the same pid
+            tmp_file.unlink()
+            fd = os.open(tmp_file, flags, 0o600)
+        with os.fdopen(fd, 'w') as data_file:
+            json.dump(data, data_file)
+        os.replace(tmp_file, self.directory / name)
+
+    def save(self, key, token):
+        self._write(f"{key}.json", token)
+
+    def generation(self, key):
+        """
+        Identity of the current generation file, a new file with every bump, or None before the first one
+        """
+        try:
+            info = os.stat(self.directory / f"{key}.generation", follow_symlinks=False)
+        except FileNotFoundError:
+            return None
+        return info.st_ino, info.st_mtime_ns
+
+    def bump_generation(self, key):
+        self._write(f"{key}.generation", {'bumped': time.time(), 'pid': os.getpid()})
+
+
+QUERY_PATH = re.compile(r"^/?api/(?:node/)?(class|mo)/(.+)\.json$")
+
+
+def payload_classes(payload):
+    """
+    Every class name in a REST payload, including the children
+    """
+    classes = set()
+    for cls, body in payload.items():
+        classes.add(cls)
+        for child in body.get('children', []):
+            classes |= payload_classes(child)
+    return classes
+
+
+def payload_deletes(payload):
+    """
+    True when a REST payload deletes any object, at any depth
+    """
+    for body in payload.values():
+        if 'deleted' in str(body.get('attributes', {}).get('status', '')):
+            return True
+        if any(payload_deletes(child) for child in body.get('children', [])):
+            return True
+    return False
+
+
+# Classes of the common containers under uni, so a batch can nest objects below parents it does not create
+RN_CLASSES = {
+    'tn': 'fvTenant',
+    'ap': 'fvAp',
+    'epg': 'fvAEPg',
+    'BD': 'fvBD',
+    'ctx': 'fvCtx',
+    'brc': 'vzBrCP',
+    'subj': 'vzSubj',
+    'flt': 'vzFilter',
+    'out': 'l3extOut',
+    'lnodep': 'l3extLNodeP',
+    'lifp': 'l3extLIfP',
+    'instP': 'l3extInstP',
+    'infra': 'infraInfra',
+    'attentp': 'infraAttEntityP',
+    'vlanns': 'fvnsVlanInstP',
+    'phys': 'physDomP',
+}
+
+
+def split_dn(dn):
+    """
+    Split a DN into its RNs, keeping the slashes inside [] with their RN
+    """
+    rns = []
+    current = ''
+    depth = 0
+    for char in dn:
+        if char == '[':
+            depth += 1
+        elif char == ']':
+            depth -= 1
+
+        if char == '/' and depth == 0:
+            rns.append(current)
+            current = ''
+        else:
+            current += char
+    rns.append(current)
+
+    return rns
+
+
+def rn_class(rn):
+    return RN_CLASSES.get(rn.split('-', 1)[0] if '-' in rn else rn)
+
+
+class QueryCache():
+    """
+    TTL cache of class and MO query responses with a memory cap and least recently used eviction
+
+    Responses are kept as text and parsed on every hit so callers can never change the cached copy.  With a
+    shared token store every change bumps the APIC's generation there, and every worker drops its whole cache
+    when it sees a generation it has not cached under.
+    """
+    def __init__(self, default_ttl=60, ttls=None, max_bytes=32 * 1024 * 1024, generations=None, generation_key=None):
+        self.default_ttl = default_ttl
+        self.ttls = ttls or {}
+        self.max_bytes = max_bytes
+        self.generations = generations if generations is not None else MemoryTokenStore()
+        self.generation_key = generation_key
+        self._generation = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def ttl(self, kind, target):
+        cls = target if kind == 'class' else None
+        return self.ttls.get(cls, self.default_ttl)
+
+    def generation(self):
+        """
+        The current shared generation, dropping every entry cached under an older one
+        """
+        current = self.generations.generation(self.generation_key)
+        with self._lock:
+            if current != self._generation:
+                self._entries.clear()
+                self.size = 0
+                self._generation = current
+        return current
+
+    def get(self, key):
+        self.generation()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry['expires'] < time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry['text']
+
+    def put(self, key, kind, target, subtree, text, generation=None):
+        """
+        Cache a response, unless a change was made anywhere since generation, read before the request
+        """
+        ttl = self.ttl(kind, target)
+        if ttl <= 0 or len(text) > self.max_bytes or self.generation() != generation:
+            return
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = {'kind': kind, 'target': target, 'subtree': subtree, 'text': text,
+                                  'expires': time.monotonic() + ttl}
+            self.size += len(text)
+
+            while self.size > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        self.size -= len(entry['text'])
+
+    def invalidate(self, dn, classes, deletes=False):
+        """
+        Drop every cached query that could include the changed subtree
+
+        Deleting an object also deletes everything below it, whatever their classes, so a change that deletes
+        anything drops every class query.
+        """
+        with self._lock:
+            stale = []
+            for key, entry in self._entries.items():
+                if entry['kind'] == 'mo':
+                    target = entry['target']
+                    if target == dn or target.startswith(dn + '/') or dn.startswith(target + '/'):
+                        stale.append(key)
+                elif deletes or entry['target'] in classes or entry['subtree']:
+                    stale.append(key)
+
+            for key in stale:
+                self._remove(key)
+
+        self.generations.bump_generation(self.generation_key)
+        return len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits,
+                    'misses': self.misses, 'evictions': self.evictions}
+
+
+class ApicClient():
+    def __init__(self, url=None, username=None, password=None, token_store=None, pool_size=10, verify=False,
+                 timeout=30, refresh_margin=0.25, cache=None, batch_max_bytes=1024 * 1024):
+        if not url or not username or not password:
+            raise TypeError("An APIC url, username and password are required")
+
+        self.url = url.rstrip('/')
+        self.username = username
+        self.password = password
+        self.verify = verify
+        self.timeout = timeout
+        self.refresh_margin = refresh_margin
+        self.token_store = token_store if token_store is not None else MemoryTokenStore()
+        self.cache = cache if cache is not None else QueryCache()
+        self.batch_max_bytes = batch_max_bytes
+        self.token_key = hashlib.sha256(f"{self.url}|{self.username}".encode()).hexdigest()[:32]
+        self.logins = 0
+        self._token = None
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def _fresh(self, token):
+        """
+        A token is fresh until the last part of its lifetime, then it gets refreshed ahead of expiry
+        """
+        if not token:
+            return False
+        lifetime = token['expires'] - token['issued']
+        return time.time() < token['expires'] - lifetime * self.refresh_margin
+
+    def _usable(self, token):
+        return bool(token) and time.time() < token['expires'] - 1
+
+    def _token_from_response(self, response, action):
+        if response.status_code != 200:
+            raise ApicLoginError(f"{action} failed on {self.url}.  status: {response.status_code}  text: {response.text[:200]}")
+
+        attributes = response.json()['imdata'][0]['aaaLogin']['attributes']
+        now = time.time()
+        return {
+            'token': attributes['token'],
+            'issued': now,
+            'expires': now + int(attributes.get('refreshTimeoutSeconds', 600)),
+        }
+
+    def _login(self):
+        payload = {'aaaUser': {'attributes': {'name': self.username, 'pwd': self.password}}}
+        response = self.session.post(f"{self.url}/api/aaaLogin.json", json=payload, verify=self.verify, timeout=self.timeout)
+        self.logins += 1
+        return self._token_from_response(response, "Login")
+
+    def _refresh(self, token):
+        response = self.session.get(f"{self.url}/api/aaaRefresh.json", cookies={'APIC-cookie': token['token']},
+                                    verify=self.verify, timeout=self.timeout)
+        return self._token_from_response(response, "Token refresh")
+
+    def token(self, force_login=False):
+        """
+        Return a valid login token, shared with the other workers through the token store
+        """
+        if not force_login and self._fresh(self._token):
+            return self._token['token']
+
+        with self._lock:
+            if not force_login and self._fresh(self._token):
+                return self._token['token']
+
+            with self.token_store.locked(self.token_key):
+                stored = self.token_store.load(self.token_key)
+                if force_login and stored and self._token and stored['token'] == self._token['token']:
+                    stored = None
+
+                if not force_login and self._fresh(stored):
+                    token = stored
+                elif stored and self._usable(stored):
+                    try:
+                        token = self._refresh(stored)
+                    except ApicLoginError:
+                        token = self._login()
+                else:
+                    token = self._login()
+
+                if token is not stored:
+                    self.token_store.save(self.token_key, token)
+                self._token = token
+
+        return self._token['token']
+
+    def _request(self, method, path, **kwargs):
+        url = f"{self.url}/{path.lstrip('/')}"
+        response = self.session.request(method, url, cookies={'APIC-cookie': self.token()},
+                                        verify=self.verify, timeout=self.timeout, **kwargs)
+
+        # The token can be dropped by the APIC before it expires, log in again once
+        if response.status_code in (401, 403):
+            response = self.session.request(method, url, cookies={'APIC-cookie': self.token(force_login=True)},
+                                            verify=self.verify, timeout=self.timeout, **kwargs)
+
+        if response.status_code != 200:
+            raise ApicError(f"{method} {path} failed.  status: {response.status_code}  text: {response.text[:200]}")
+
+        return response
+
+    def get(self, path, params=None, cache=True):
+        """
+        GET a path, class and MO queries are answered from the query cache while they are fresh
+        """
+        query = QUERY_PATH.match(path)
+        if not cache or query is None:
+            return self._request('GET', path, params=params).json()
+
+        kind, target = query.groups()
+        key = (kind, target, tuple(sorted((params or {}).items())))
+        text = self.cache.get(key)
+        if text is None:
+            generation = self.cache.generation()
+            text = self._request('GET', path, params=params).text
+            subtree = any(k.startswith(('rsp-subtree', 'query-target')) for k in (params or {}))
+            self.cache.put(key, kind, target, subtree, text, generation)
+
+        return json.loads(text)
+
+    def get_class(self, cls, cache=True, **filters):
+        return self.get(f"/api/class/{cls}.json", params=filters or None, cache=cache)
+
+    def get_mo(self, dn, cache=True, **filters):
+        return self.get(f"/api/mo/{dn}.json", params=filters or None, cache=cache)
+
+    def post(self, path, payload):
+        """
+        POST a change and drop the cached queries for the subtree it touches
+        """
+        try:
+            return self._request('POST', path, json=payload).json()
+        finally:
+            # Invalidate even when the POST failed, the APIC may have applied part of it
+            query = QUERY_PATH.match(path)
+            dn = query.group(2) if query and query.group(1) == 'mo' else 'uni'
+            self.cache.invalidate(dn, payload_classes(payload), payload_deletes(payload))
+
+    def batch(self, max_payload_bytes=None):
+        """
+        Collect MO changes and send them as a few hierarchical POSTs
+        """
+        return ApicBatch(self, max_payload_bytes or self.batch_max_bytes)
+
+
+class ApicBatch():
+    """
+    MO changes collected during a script run and merged into as few polUni POSTs as fit the payload limit
+
+        with apic.batch() as batch:
+            batch.add('uni/tn-prod/ap-web/epg-web1', 'fvAEPg', {'name': 'web1'})
+        batch.results
+    """
+    def __init__(self, client, max_payload_bytes):
+        self.client = client
+        self.max_payload_bytes = max_payload_bytes
+        self.items = []
+        self.results = []
+        self.requests = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.submit()
+
+    def add(self, dn, cls, attributes=None, children=None):
+        """
+        Queue an MO to create or modify, returns its index in the results
+        """
+        self.items.append({'dn': dn, 'class': cls, 'attributes': dict(attributes or {}), 'children': list(children or [])})
+        return len(self.items) - 1
+
+    def delete(self, dn, cls):
+        return self.add(dn, cls, {'status': 'deleted'})
+
+    def _tree(self, indices):
+        """
+        Nest the queued MOs under uni, returning the payload and the items that cannot be nested
+        """
+        root = {'children': {}}
+        standalone = []
+
+        # Parents first, so a queued parent is never replaced by a placeholder for it
+        for index in sorted(indices, key=lambda i: len(split_dn(self.items[i]['dn']))):
+            item = self.items[index]
+            rns = split_dn(item['dn'])
+            if rns[0] != 'uni' or len(rns) < 2:
+                standalone.append(index)
+                continue
+
+            node = root
+            path = 'uni'
+            for rn in rns[1:-1]:
+                path = f"{path}/{rn}"
+                child = node['children'].get(rn)
+                if child is None:
+                    cls = rn_class(rn)
+                    if cls is None:
+                        node = None
+                        break
+                    # Placeholders only modify, they must never create a parent by accident
+                    child = {'class': cls, 'attributes': {'dn': path, 'status': 'modified'}, 'children': {}, 'extra': []}
+                    node['children'][rn] = child
+                node = child
+
+            if node is None:
+                standalone.append(index)
+                continue
+
+            attributes = dict(item['attributes'], dn=item['dn'])
+            existing = node['children'].get(rns[-1])
+            if existing is None:
+                node['children'][rns[-1]] = {'class': item['class'], 'attributes': attributes, 'children': {}, 'extra': list(item['children'])}
+            else:
+                existing['class'] = item['class']
+                existing['attributes'].update(attributes)
+                existing['extra'].extend(item['children'])
+
+        def serialize(node):
+            children = [serialize(child) for child in node['children'].values()] + node['extra']
+            body = {'attributes': node['attributes']}
+            if children:
+                body['children'] = children
+            return {node['class']: body}
+
+        children = [serialize(child) for child in root['children'].values()]
+        payload = {'polUni': {'attributes': {}, 'children': children}} if children else None
+
+        return payload, standalone
+
+    def _size(self, indices):
+        payload, _ = self._tree(indices)
+        return len(json.dumps(payload)) if payload else 0
+
+    def _chunks(self, indices):
+        """
+        Split items into groups whose merged payload fits, halving any group that is too big
+        """
+        if len(indices) <= 1 or self._size(indices) <= self.max_payload_bytes:
+            return [indices]
+
+        ordered = sorted(indices, key=lambda i: len(split_dn(self.items[i]['dn'])))
+        middle = len(ordered) // 2
+        return self._chunks(ordered[:middle]) + self._chunks(ordered[middle:])
+
+    def plan(self):
+        """
+        The groups of items that will be sent together, in the order they are sent
+        """
+        standalone = set(self._tree(range(len(self.items)))[1])
+        nested = [index for index in range(len(self.items)) if index not in standalone]
+
+        # Keep each top level object (usually a tenant) together and pack as many as fit into one POST
+        groups = {}
+        for index in nested:
+            groups.setdefault(split_dn(self.items[index]['dn'])[1], []).append(index)
+
+        chunks = []
+        current = []
+        for group in groups.values():
+            for chunk in self._chunks(group):
+                if current and self._size(current + chunk) > self.max_payload_bytes:
+                    chunks.append(current)
+                    current = []
+                current = current + chunk
+        if current:
+            chunks.append(current)
+
+        return chunks + [[index] for index in sorted(standalone)]
+
+    def _post(self, indices):
+        payload, standalone = self._tree(indices)
+        self.requests += 1
+        if payload:
+            self.client.post('/api/mo/uni.json', payload)
+        else:
+            item = self.items[standalone[0]]
+            body = {'attributes': dict(item['attributes'], dn=item['dn'])}
+            if item['children']:
+                body['children'] = item['children']
+            self.client.post(f"/api/mo/{item['dn']}.json", {item['class']: body})
+
+    def _result(self, index, error=None):
+        item = self.items[index]
+        self.results[index] = {'dn': item['dn'], 'class': item['class'], 'status': 'failed' if error else 'ok',
+                               'error': str(error) if error else None}
+
+    def submit(self, retry_failed=True):
+        """
+        Send everything queued and report a result per object
+
+        When a merged POST is rejected its objects are retried one by one, so the results point
+        at the objects the APIC refused instead of failing the whole group.
+        """
+        self.results = [None] * len(self.items)
+
+        for chunk in self.plan():
+            try:
+                self._post(chunk)
+                error = None
+            except ApicError as e:
+                error = e
+
+            if error is not None and retry_failed and len(chunk) > 1:
+                for index in sorted(chunk, key=lambda i: len(split_dn(self.items[i]['dn']))):
+                    try:
+                        self._post([index])
+                        self._result(index)
+                    except ApicError as e:
+                        self._result(index, e)
+            else:
+                for index in chunk:
+                    self._result(index, error)
+
+        self.items = []
+        return self.results
+
+
+class ApicClientRegistry():
+    """
+    One shared client per APIC, built from the credentials in Settings
+    """
+    def __init__(self, settings):
+        self.settings = settings
+        self.clients = {}
+        self._lock = threading.Lock()
+        self._token_store = None
+
+    def token_store(self):
+        if self._token_store is None:
+            if self.settings.apic_token_dir:
+                self._token_store = FileTokenStore(self.settings.apic_token_dir)
+            else:
+                self._token_store = MemoryTokenStore()
+        return self._token_store
+
+    def configured(self):
+        return bool(self.settings.apic_creds.get('url'))
+
+    def client(self, url=None):
+        url = url or self.settings.apic_creds.get('url')
+
+        with self._lock:
+            client = self.clients.get(url)
+            if client is None:
+                client = ApicClient(url=url,
+                                    username=self.settings.apic_creds.get('username'),
+                                    password=self.settings.apic_creds.get('password'),
+                                    token_store=self.token_store(),
+                                    pool_size=self.settings.apic_pool_size,
+                                    verify=self.settings.apic_verify_ssl,
+                                    cache=QueryCache(default_ttl=self.settings.apic_cache_ttl,
+                                                     ttls=self.settings.apic_cache_ttls,
+                                                     max_bytes=self.settings.apic_cache_max_bytes,
+                                                     generations=self.token_store(),
+                                                     generation_key=hashlib.sha256(url.encode()).hexdigest()[:32]),
+                                    batch_max_bytes=self.settings.apic_batch_max_bytes)
+                self.clients[url] = client
+
+        return client
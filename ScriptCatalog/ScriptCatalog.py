@@ -0,0 +1,247 @@
+# Catalog of the GUI scripts that have been cloned into the repos directory
+from pathlib import Path
+from jinja2 import FileSystemLoader, Environment
+import hashlib
+import importlib.util
+import inspect
+import re
+import sys
+import threading
+import yaml
+
+from Tracing.Tracing import span
+
+
+class ScriptCatalogError(Exception):
+    pass
+
+
+def module_name(script):
+    """
+    Unique module name for a script, so scripts never share or replace each other's module
+    """
+    return "gui_scripts." + re.sub(r"\W", "_", script) + ".main"
+
+
+def call_script(func, services=None, **kwargs):
+    """
+    Call a script function, adding the framework services it asks for by parameter name
+
+    Services are factories so nothing is built for scripts that do not use them.  A service always replaces a
+    submitted form field of the same name, so a form can never pass its own string as the APIC client.
+    """
+    parameters = inspect.signature(func).parameters
+    for name, factory in (services or {}).items():
+        if name in parameters:
+            kwargs[name] = factory()
+
+    return func(**kwargs)
+
+
+def accepts(func, *names):
+    """
+    True when a script function declares any of the named parameters
+    """
+    parameters = inspect.signature(func).parameters
+    return any(name in parameters for name in names)
+
+
+def bind_spec(spec, variables):
+    """
+    Fill a static ui spec from the pre() output, each field's bind mapping names the variable for a key
+
+        epg:
+          type: dropdown
+          bind:
+            options: epgs
+    """
+    bound = {}
+    for name, field in spec.items():
+        field = dict(field)
+        for key, variable in (field.pop('bind', None) or {}).items():
+            field[key] = variables.get(variable)
+        bound[name] = field
+
+    return bound
+
+
+class ScriptCatalog():
+    def __init__(self, repos_dir=None):
+        if repos_dir is None:
+            self.repos_dir = Path("./repos")
+        else:
+            self.repos_dir = Path(repos_dir)
+
+        self.version = None
+        self._signature = None
+        self._scripts = []
+        self._ui_environments = {}
+        self._ui_specs = {}
+        self._modules = {}
+        self._module_locks = {}
+        self._lock = threading.Lock()
+
+    def _scan_signature(self):
+        """
+        Cheap fingerprint of the repos directory, one stat per script config file
+        """
+        signature = [str(self.repos_dir.resolve())]
+        for path in sorted(x for x in self.repos_dir.iterdir() if x.is_dir()):
+            config_file = path / "gui" / "config.yml"
+            try:
+                mtime = config_file.stat().st_mtime_ns
+            except FileNotFoundError:
+                mtime = None
+            signature.append((path.parts[-1], mtime))
+
+        return tuple(signature)
+
+    def _load_scripts(self):
+        script_data = [
+            {"name": x.parts[-1],
+             "id": x.parts[-1],
+             "path": x} for x in sorted(self.repos_dir.iterdir()) if x.is_dir()]
+
+        for repo in script_data:
+            config_file = repo['path'] / "gui" / "config.yml"
+            config = {}
+            if config_file.exists():
+                with open(config_file) as cf:
+                    try:
+                        config = yaml.safe_load(cf)
+                    except yaml.YAMLError as e:
+                        raise ScriptCatalogError(f"The config file for '{repo['id']}' is malformed: {e}")
+
+            if config and config.get('display_name'):
+                repo['name'] = config['display_name']
+            if config and config.get('description'):
+                repo['description'] = config['description']
+            repo['config'] = config or {}
+
+        return script_data
+
+    def refresh(self):
+        """
+        Rescan the repos directory if anything changed since the last scan
+        """
+        signature = self._scan_signature()
+        if signature == self._signature:
+            return False
+
+        with self._lock:
+            if signature == self._signature:
+                return False
+
+            self._scripts = self._load_scripts()
+            self._signature = signature
+            self.version = hashlib.sha1(repr(signature).encode()).hexdigest()[:16]
+
+            # Scripts that went away should not keep their template environments
+            known = {str(repo['path'] / "gui") for repo in self._scripts}
+            for search_path in list(self._ui_environments):
+                if search_path not in known:
+                    del self._ui_environments[search_path]
+
+        return True
+
+    def scripts(self, as_dict=False):
+        """
+        Return the scripts in the catalog, as a list or keyed by script id
+        """
+        self.refresh()
+        script_data = [dict(repo) for repo in self._scripts]
+
+        if as_dict:
+            script_data = {repo['id']: repo for repo in script_data}
+
+        return script_data
+
+    def ui_environment(self, script):
+        """
+        Jinja environment for a script's gui directory, so compiled ui templates are reused
+        """
+        search_path = str(self.repos_dir / script / "gui")
+        env = self._ui_environments.get(search_path)
+        if env is None:
+            with self._lock:
+                env = self._ui_environments.get(search_path)
+                if env is None:
+                    templateLoader = FileSystemLoader(searchpath=search_path)
+                    env = Environment(loader=templateLoader)
+                    self._ui_environments[search_path] = env
+
+        return env
+
+    def precompile_ui(self, ui_name="ui.yml"):
+        """
+        Compile the ui template of every script in the catalog ahead of the first request
+        """
+        compiled = []
+        for repo in self.scripts():
+            if (repo['path'] / "gui" / ui_name).exists():
+                self.ui_environment(repo['id']).get_template(ui_name)
+                compiled.append(repo['id'])
+
+        return compiled
+
+    def static_ui_spec(self, script, spec_name="ui_spec.yml"):
+        """
+        Parsed static ui spec of a script, read again only when the file changes, or None if it has none
+        """
+        spec_file = self.repos_dir / script / "gui" / spec_name
+        try:
+            mtime = spec_file.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+        cached = self._ui_specs.get(str(spec_file))
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        try:
+            spec = yaml.safe_load(spec_file.read_text())
+        except yaml.YAMLError as e:
+            raise ScriptCatalogError(f"The ui spec for '{script}' is malformed: {e}")
+        if not isinstance(spec, dict) or not all(isinstance(field, dict) for field in spec.values()):
+            raise ScriptCatalogError(f"The ui spec for '{script}' must be a mapping of field names to fields")
+
+        self._ui_specs[str(spec_file)] = (mtime, spec)
+        return spec
+
+    def load_module(self, script):
+        """
+        Import a script's gui/main.py, reusing the loaded module until the file changes
+        """
+        file_path = (self.repos_dir / script / "gui" / "main.py").resolve()
+        mtime = file_path.stat().st_mtime_ns
+
+        cached = self._modules.get(str(file_path))
+        if cached and cached[0] == mtime:
+            return cached[1]
+
+        with span('load module', script=script):
+            return self._import_module(script, file_path, mtime)
+
+    def _import_module(self, script, file_path, mtime):
+        with self._lock:
+            module_lock = self._module_locks.setdefault(str(file_path), threading.Lock())
+
+        # Only one thread imports a given script, the others wait for and reuse its module
+        with module_lock:
+            cached = self._modules.get(str(file_path))
+            if cached and cached[0] == mtime:
+                return cached[1]
+
+            name = module_name(script)
+            spec = importlib.util.spec_from_file_location(name, file_path)
+            module = importlib.util.module_from_spec(spec)
+            sys.modules[name] = module
+            try:
+                spec.loader.exec_module(module)
+            except BaseException:
+                sys.modules.pop(name, None)
+                raise
+
+            self._modules[str(file_path)] = (mtime, module)
+
+        return module
@@ -21,12 +21,52 @@ class Settings():
         self.log_file_name = "/var/log/pge-aci-web.log"
         self.log_file_enable = True
 
+        # JSON lines log: size in bytes the file rotates at, rotated files kept, lowest level written and the most
+        # records waiting for the writer before new ones are dropped
+        self.log_file_max_bytes = 10 * 1024 * 1024
+        self.log_file_backups = 5
+        self.log_level = "INFO"
+        self.log_queue_size = 10000
+
+        # Git implementation SourceControlMgmt uses: "subprocess" runs the git command line, "dulwich" runs in-process
+        self.git_backend = "subprocess"
+
+        # Directory the workers share each GitHub token's API budget through: requests in flight, rate limit state
+        # and pauses (empty keeps a budget per worker)
+        self.github_budget_dir = "/tmp/aci-gui-github-budget"
+
+        # Background workspace deletion: cloned repos are moved into the trash directory (keep it on the same
+        # filesystem as the clones) and deleted by a thread.  Directories under workspace_dirs older than
+        # workspace_orphan_age seconds are treated as left by crashed runs and discarded at startup.
+        self.workspace_reaper_enable = False
+        self.workspace_trash_dir = "/tmp/aci-gui-workspace-trash"
+        self.workspace_dirs = []
+        self.workspace_orphan_age = 3600
+        self.workspace_max_pending = 50
+        self.workspace_min_free_bytes = 1024 * 1024 * 1024
+
         # Set environment variables for ACI
         self.apic_creds = {
             'url': '',
             'username': '',
             'password': ''}
 
+        # Shared APIC client: connection pool size, certificate checks and the directory the
+        # worker processes share login tokens through (empty keeps tokens in each process)
+        self.apic_pool_size = 10
+        self.apic_verify_ssl = False
+        self.apic_token_dir = "/tmp/aci-gui-apic-tokens"
+
+        # Cache of APIC class and MO queries: default lifetime in seconds, per class lifetimes
+        # (0 disables caching for that class) and the memory cap for the cached responses.  A change made by any
+        # worker empties every worker's cache through a generation file in apic_token_dir.
+        self.apic_cache_ttl = 60
+        self.apic_cache_ttls = {'fvTenant': 300, 'fvCtx': 300, 'fvBD': 120, 'fvAEPg': 60, 'faultInst': 0}
+        self.apic_cache_max_bytes = 32 * 1024 * 1024
+
+        # Largest merged payload a script's APIC batch sends in one POST
+        self.apic_batch_max_bytes = 1024 * 1024
+
         # Application variables
         self.application_title = ""
         self.app_addr = os.getenv('APP_SERVER_IPADDR', 'localhost')
@@ -49,6 +89,49 @@ class Settings():
         self.style_wu_file = 'wu.css'
         self.fabric_names = {'https://10.50.0.100': 'Lab2-fake'}
 
+        # Import scripts and compile templates in the background when the app starts
+        self.warm_up = os.getenv('APP_WARM_UP', 'false').lower() in ('1', 'true', 'yes')
+        self.warm_up_threads = 4
+
+        # Script runs allowed at once in each worker, and how many more may wait for a slot
+        # Scripts can lower these in their gui/config.yml with the same names, and queue_timeout
+        self.max_concurrent_runs = 8
+        self.max_queued_runs = 16
+        self.run_queue_timeout = 30
+
+        # Fabrics a script runs against at once when the operator picks several
+        self.fabric_fanout_workers = 4
+
+        # Bulk submissions: rows run at once and the most rows one uploaded file may have
+        self.bulk_workers = 4
+        self.bulk_max_rows = 1000
+
+        # Seconds a script's pre() output is kept to answer searchable dropdowns, and the most options one page returns
+        self.pre_cache_ttl = 60
+        self.options_max_per_page = 200
+
+        # Tabular results: the directory every worker reads them from, how many are kept for paging and downloads,
+        # for how many seconds, and rows per page
+        self.result_store_dir = "/tmp/aci-gui-results"
+        self.result_store_max = 50
+        self.result_ttl = 3600
+        self.result_page_size = 100
+
+        # SQLite file every run_script call is recorded in (empty turns the history off), and the most runs written at once
+        self.run_history_file = "/tmp/aci-gui-run-history.sqlite3"
+        self.run_history_batch_size = 100
+
+        # File each request's trace is written to as Zipkin v2 JSON, one trace per line (empty turns tracing off),
+        # the size in bytes it rotates at and how many rotated copies (trace_file.1 and on) are kept and searched
+        self.trace_file = "/tmp/aci-gui-traces.jsonl"
+        self.trace_file_max_bytes = 10 * 1024 * 1024
+        self.trace_file_backups = 3
+
+        # Identical submissions of a script share one run while it is in flight, and for this many seconds after.
+        # Workers claim submissions through files in coalesce_dir (empty shares runs within each worker only).
+        self.coalesce_reuse_window = 0
+        self.coalesce_dir = "/tmp/aci-gui-coalesce"
+
         # Override the defaults above
         self.load_settings_file()
 
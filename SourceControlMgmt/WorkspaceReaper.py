@@ -0,0 +1,121 @@
+# Background deletion of cloned workspaces, so requests do not wait on rmtree of a large repo
+from pathlib import Path
+import os
+import shutil
+import threading
+import time
+import uuid
+
+
+class WorkspaceReaper():
+    """
+    Moves workspaces into a trash directory with one rename and deletes them on a background thread
+
+    The trash directory should be on the same filesystem as the workspaces, otherwise the rename fails and the
+    workspace is deleted in the caller.  Anything in the trash directory is deleted, including what a crashed
+    process left there, so several worker processes can share it.
+    """
+    def __init__(self, trash_dir, max_pending=50, min_free_bytes=0, interval=30.0):
+        self.trash_dir = Path(trash_dir)
+        self.max_pending = max_pending
+        self.min_free_bytes = min_free_bytes
+        self.interval = interval
+        self.deleted = 0
+        self.deleted_in_caller = 0
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._thread_pid = None
+
+        self.trash_dir.mkdir(parents=True, exist_ok=True)
+
+    def _ensure_thread(self):
+        # Started in each worker process, a thread started before a fork does not survive it
+        with self._lock:
+            if self._thread_pid != os.getpid() or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="workspace-reaper", daemon=True)
+                self._thread.start()
+                self._thread_pid = os.getpid()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            self.sweep()
+            self._wake.wait(self.interval)
+
+    def sweep(self):
+        """
+        Delete everything in the trash directory
+        """
+        for entry in list(self.trash_dir.iterdir()):
+            shutil.rmtree(entry, ignore_errors=True)
+            if not entry.exists():
+                self.deleted += 1
+
+    def pending(self):
+        return sum(1 for _ in self.trash_dir.iterdir())
+
+    def _low_on_space(self):
+        if not self.min_free_bytes:
+            return False
+        return shutil.disk_usage(self.trash_dir).free < self.min_free_bytes
+
+    def discard(self, path):
+        """
+        Take a workspace out of the way now and delete it later
+
+        The workspace is deleted in the caller when the trash is full, the disk is short of space or it is on
+        another filesystem, so the trash can never grow without bound.
+        """
+        path = Path(path)
+        if not path.exists():
+            return
+
+        if self.pending() >= self.max_pending or self._low_on_space():
+            self._delete_now(path)
+            return
+
+        try:
+            os.rename(path, self.trash_dir / f"{path.name}-{uuid.uuid4().hex}")
+        except OSError:
+            self._delete_now(path)
+            return
+
+        self._ensure_thread()
+        self._wake.set()
+
+    def _delete_now(self, path):
+        shutil.rmtree(path)
+        self.deleted_in_caller += 1
+
+    def cleanup_orphans(self, workspace_dirs, max_age=3600):
+        """
+        Discard workspaces a crashed run left behind: directories under the workspace roots untouched for max_age seconds
+        """
+        cutoff = time.time() - max_age
+        discarded = []
+        for root in workspace_dirs:
+            root = Path(root)
+            if not root.is_dir():
+                continue
+            for workspace in root.iterdir():
+                if workspace.is_dir() and workspace.stat().st_mtime < cutoff:
+                    self.discard(workspace)
+                    discarded.append(workspace)
+
+        # Trash left by a crashed process is deleted too
+        self._ensure_thread()
+        self._wake.set()
+        return discarded
+
+    def wait(self, timeout=10.0):
+        """
+        Wait until the background thread has emptied the trash
+        """
+        deadline = time.monotonic() + timeout
+        while self.pending() and time.monotonic() < deadline:
+            time.sleep(0.01)
+        return not self.pending()
+
+    def stats(self):
+        return {'pending': self.pending(), 'deleted': self.deleted, 'deleted_in_caller': self.deleted_in_caller}
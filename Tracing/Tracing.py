@@ -0,0 +1,207 @@
+# Request tracing: nested spans from the web request down to git, exported as Zipkin v2 JSON
+from contextlib import contextmanager
+from pathlib import Path
+import contextvars
+import functools
+import json
+import logging
+import os
+import time
+
+SERVICE_NAME = 'aci-gui'
+
+# Finished traces are written to this logger, one JSON array of Zipkin v2 spans per line.  Nothing is written
+# until a handler is added to it.
+trace_log = logging.getLogger('aci_gui.traces')
+trace_log.propagate = False
+
+# Span the current thread is in, None outside a trace
+current_span = contextvars.ContextVar('current_span', default=None)
+
+
+def new_id(size=8):
+    return os.urandom(size).hex()
+
+
+class Trace():
+    def __init__(self, trace_id=None):
+        self.id = trace_id or new_id(16)
+        self.spans = []
+
+    def add(self, span):
+        # Spans finish on several threads during fan-out, list.append is atomic
+        self.spans.append(span)
+
+    def to_zipkin(self):
+        return [span.to_zipkin() for span in self.spans]
+
+    def write(self):
+        trace_log.info(json.dumps(self.to_zipkin(), separators=(',', ':')))
+
+
+class Span():
+    def __init__(self, trace, name, parent_id=None, kind=None, tags=None):
+        self.trace = trace
+        self.name = name
+        self.id = new_id()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.tags = {key: str(value) for key, value in (tags or {}).items()}
+        self.timestamp = time.time()
+        self.duration = None
+        self._start = time.perf_counter()
+
+    def tag(self, key, value):
+        self.tags[key] = str(value)
+
+    def finish(self, error=None):
+        self.duration = time.perf_counter() - self._start
+        if error is not None:
+            self.tag('error', f"{type(error).__name__}: {error}")
+        self.trace.add(self)
+
+    def to_zipkin(self):
+        span = {
+            'traceId': self.trace.id,
+            'id': self.id,
+            'name': self.name,
+            'timestamp': int(self.timestamp * 1000000),
+            'duration': max(1, int((self.duration or 0) * 1000000)),
+            'localEndpoint': {'serviceName': SERVICE_NAME},
+            'tags': self.tags,
+        }
+        if self.parent_id:
+            span['parentId'] = self.parent_id
+        if self.kind:
+            span['kind'] = self.kind
+        return span
+
+
+class NoSpan():
+    """
+    Stand-in span outside a trace, so callers can tag without checking
+    """
+    def tag(self, key, value):
+        pass
+
+
+NO_SPAN = NoSpan()
+
+
+def begin_trace(name, trace_id=None, kind='SERVER', **tags):
+    """
+    Start a new trace with its root span as the current span, returning the span and the token to end it with
+    """
+    root = Span(Trace(trace_id), name, kind=kind, tags=tags)
+    return root, current_span.set(root)
+
+
+def end_trace(root, token, error=None):
+    """
+    Finish the root span and write the whole trace
+    """
+    root.finish(error)
+    current_span.reset(token)
+    root.trace.write()
+
+
+@contextmanager
+def span(name, **tags):
+    """
+    A child of the current span, or nothing when no trace is running
+    """
+    parent = current_span.get()
+    if parent is None:
+        yield NO_SPAN
+        return
+
+    child = Span(parent.trace, name, parent_id=parent.id, tags=tags)
+    token = current_span.set(child)
+    error = None
+    try:
+        yield child
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        current_span.reset(token)
+        child.finish(error)
+
+
+def traced(name=None):
+    """
+    Decorator running every call of a function in its own span, named after the function by default
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__qualname__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def trace_files(path, backups):
+    """
+    The trace file and its rotated copies, newest first
+    """
+    path = Path(path)
+    return [path] + [Path(f"{path}.{number}") for number in range(1, backups + 1)]
+
+
+def read_trace(path, trace_id, backups=0):
+    """
+    The Zipkin v2 spans of one trace from the trace files, or None when it is not there
+    """
+    needle = f'"traceId":"{trace_id}"'
+    for trace_file in trace_files(path, backups):
+        try:
+            with open(trace_file) as lines:
+                for line in lines:
+                    if needle in line:
+                        return json.loads(line)
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def tail_lines(path, limit, block_size=64 * 1024):
+    """
+    The last limit lines of a file, read backwards a block at a time so only the end of the file is read
+    """
+    with open(path, 'rb') as trace_file:
+        end = trace_file.seek(0, os.SEEK_END)
+        data = b''
+        while end > 0 and data.count(b'\n') <= limit:
+            start = max(0, end - block_size)
+            trace_file.seek(start)
+            data = trace_file.read(end - start) + data
+            end = start
+
+    lines = data.decode(errors='replace').splitlines()
+    return lines[-limit:] if limit else []
+
+
+def recent_traces(path, limit=50, backups=0):
+    """
+    Root spans of the newest traces in the trace file, and its rotated copies when it has fewer, newest first
+    """
+    roots = []
+    wanted = limit
+    for trace_file in trace_files(path, backups):
+        try:
+            newest = tail_lines(trace_file, wanted)
+        except FileNotFoundError:
+            continue
+
+        for line in reversed(newest):
+            try:
+                spans = json.loads(line)
+            except ValueError:
+                continue
+            roots.extend(span for span in spans if 'parentId' not in span)
+
+        wanted -= len(newest)
+        if wanted <= 0:
+            break
+    return roots
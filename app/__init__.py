@@ -1,7 +1,52 @@
 from flask import Flask
+from Settings.Settings import Settings
+from ScriptCatalog.ScriptCatalog import ScriptCatalog
+from ApicClient.ApicClient import ApicClientRegistry
+from SourceControlMgmt.GitBackend import set_default_git_backend
+from SourceControlMgmt.SourceControlMgmt import set_workspace_reaper, set_github_budget_dir
+from SourceControlMgmt.WorkspaceReaper import WorkspaceReaper
+from app import assets, logs, tracing
+from app.warmup import WarmUp, NoWarmUp
+from app.admission import AdmissionController
+from app.precache import PreOutputCache
+from app.results import ResultStore
+from app.history import RunHistory, NoHistory
+from app.singleflight import SingleFlight
 
 app = Flask(__name__)
 app.config['TESTING'] = False
 app.config['ENV'] = 'production'
 
+settings = Settings()
+set_default_git_backend(settings.git_backend)
+set_github_budget_dir(settings.github_budget_dir)
+
+if settings.workspace_reaper_enable:
+    reaper = WorkspaceReaper(settings.workspace_trash_dir, max_pending=settings.workspace_max_pending,
+                             min_free_bytes=settings.workspace_min_free_bytes)
+    reaper.cleanup_orphans(settings.workspace_dirs, max_age=settings.workspace_orphan_age)
+    set_workspace_reaper(reaper)
+
+catalog = ScriptCatalog()
+admission = AdmissionController(settings, catalog)
+apic_clients = ApicClientRegistry(settings)
+pre_cache = PreOutputCache(settings.pre_cache_ttl)
+result_store = ResultStore(settings.result_store_dir, settings.result_store_max, settings.result_ttl)
+single_flight = SingleFlight(settings.coalesce_reuse_window, settings.coalesce_dir)
+
+if settings.run_history_file:
+    history = RunHistory(settings.run_history_file, batch_size=settings.run_history_batch_size)
+else:
+    history = NoHistory()
+
+assets.init_app(app)
+logs.init_app(app)
+tracing.init_app(app)
+
+if settings.warm_up:
+    warm_up = WarmUp(app, catalog, threads=settings.warm_up_threads)
+    warm_up.start()
+else:
+    warm_up = NoWarmUp()
+
 from app import routes
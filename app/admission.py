@@ -0,0 +1,147 @@
+# Admission control for script runs: per-script and global concurrency limits with a bounded wait queue
+#
+# The limits are per worker process.  Set them from the worker count when running several workers.
+from contextlib import contextmanager
+import threading
+import time
+
+
+class AdmissionError(Exception):
+    pass
+
+
+class AdmissionQueueFull(AdmissionError):
+    pass
+
+
+class AdmissionTimeout(AdmissionError):
+    pass
+
+
+class UnknownScript(AdmissionError):
+    pass
+
+
+class Gate():
+    def __init__(self, name, limit, max_queue, timeout):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.running = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._cond = threading.Condition()
+
+    def configure(self, limit, max_queue, timeout):
+        with self._cond:
+            self.limit = limit
+            self.max_queue = max_queue
+            self.timeout = timeout
+            self._cond.notify_all()
+
+    def acquire(self):
+        start = time.monotonic()
+        with self._cond:
+            if self.running >= self.limit or self.waiting:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise AdmissionQueueFull(f"Too many runs of {self.name} are already waiting")
+
+                self.waiting += 1
+                try:
+                    admitted = self._cond.wait_for(lambda: self.running < self.limit, timeout=self.timeout)
+                finally:
+                    self.waiting -= 1
+
+                if not admitted:
+                    self.timed_out += 1
+                    raise AdmissionTimeout(f"Timed out after {self.timeout}s waiting to run {self.name}")
+
+            waited = time.monotonic() - start
+            self.running += 1
+            self.admitted += 1
+            self.total_wait += waited
+            self.max_wait = max(self.max_wait, waited)
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'limit': self.limit,
+                'running': self.running,
+                'queue_depth': self.waiting,
+                'max_queue': self.max_queue,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'avg_wait': round(self.total_wait / self.admitted, 4) if self.admitted else 0.0,
+                'max_wait': round(self.max_wait, 4),
+            }
+
+
+class AdmissionController():
+    def __init__(self, settings, catalog):
+        self.settings = settings
+        self.catalog = catalog
+        self.global_gate = Gate('all scripts', settings.max_concurrent_runs, settings.max_queued_runs, settings.run_queue_timeout)
+        self.script_gates = {}
+        self._lock = threading.Lock()
+
+    def _script_gate(self, script):
+        """
+        Gate for one script, sized from the optional limits in its gui/config.yml
+
+        Scripts can only lower the limits in Settings, and only scripts in the catalog get a gate.
+        """
+        scripts = self.catalog.scripts(as_dict=True)
+        if script not in scripts:
+            raise UnknownScript(f"There is no script named {script}")
+
+        config = scripts[script]['config']
+        limit = min(config.get('max_concurrent_runs', self.settings.max_concurrent_runs), self.settings.max_concurrent_runs)
+        max_queue = min(config.get('max_queued_runs', self.settings.max_queued_runs), self.settings.max_queued_runs)
+        timeout = min(config.get('queue_timeout', self.settings.run_queue_timeout), self.settings.run_queue_timeout)
+
+        with self._lock:
+            gate = self.script_gates.get(script)
+            if gate is None:
+                gate = Gate(script, limit, max_queue, timeout)
+                self.script_gates[script] = gate
+            elif (gate.limit, gate.max_queue, gate.timeout) != (limit, max_queue, timeout):
+                gate.configure(limit, max_queue, timeout)
+
+        return gate
+
+    @contextmanager
+    def admit(self, script):
+        """
+        Hold a slot for the script and a global slot while the block runs
+        """
+        script_gate = self._script_gate(script)
+        script_gate.acquire()
+        try:
+            self.global_gate.acquire()
+            try:
+                yield
+            finally:
+                self.global_gate.release()
+        finally:
+            script_gate.release()
+
+    def stats(self):
+        with self._lock:
+            gates = dict(self.script_gates)
+
+        return {
+            'global': self.global_gate.stats(),
+            'scripts': {name: gate.stats() for name, gate in gates.items()},
+        }
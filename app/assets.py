@@ -0,0 +1,192 @@
+# Static asset pipeline: minify, fingerprint and precompress the files under app/static
+#
+# Run ./build_assets.py at build time.  The results are written to app/static/dist along with
+# a manifest.json that maps the original static filenames to the fingerprinted ones.
+from flask import request, send_from_directory
+from pathlib import Path, PurePosixPath
+import gzip
+import hashlib
+import json
+import mimetypes
+import posixpath
+import re
+import shutil
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import rjsmin
+except ImportError:
+    rjsmin = None
+
+try:
+    import rcssmin
+except ImportError:
+    rcssmin = None
+
+
+STATIC_DIR = Path(__file__).parent / "static"
+DIST_NAME = "dist"
+MANIFEST_NAME = "manifest.json"
+
+ASSET_EXTENSIONS = ('.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico', '.woff', '.woff2')
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.svg')
+CSS_URL = re.compile(r"""url\(\s*(['"]?)([^'")]+)\1\s*\)""")
+
+# Fingerprinted files never change, so browsers may keep them for a year without revalidating
+IMMUTABLE_MAX_AGE = 31536000
+
+
+def minify_css(text):
+    if rcssmin is not None:
+        return rcssmin.cssmin(text)
+
+    text = re.sub(r"/\*.*?\*/", "", text, flags=re.S)
+    text = re.sub(r"\s+", " ", text)
+    text = re.sub(r"\s*([{};:,>])\s*", r"\1", text)
+    return text.replace(";}", "}").strip()
+
+
+def minify_js(text):
+    # There is no safe way to minify javascript without a parser, so without rjsmin it is left alone
+    if rjsmin is not None:
+        return rjsmin.jsmin(text)
+    return text
+
+
+def fingerprint(relative_name, content):
+    digest = hashlib.sha256(content).hexdigest()[:12]
+    path = PurePosixPath(relative_name)
+    return str(path.with_name(f"{path.stem}.{digest}{path.suffix}"))
+
+
+def _rewrite_css_urls(text, relative_name, manifest):
+    """
+    Point relative url() references in a stylesheet at the fingerprinted files
+    """
+    css_dir = posixpath.dirname(relative_name)
+
+    def replace(match):
+        url = match.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '/', '#')):
+            return match.group(0)
+
+        target = posixpath.normpath(posixpath.join(css_dir, url))
+        if target not in manifest:
+            return match.group(0)
+
+        return f'url("{posixpath.relpath(manifest[target], css_dir)}")'
+
+    return CSS_URL.sub(replace, text)
+
+
+def _write_compressed(path, content):
+    if path.suffix not in COMPRESSIBLE_EXTENSIONS:
+        return
+
+    compressed = gzip.compress(content, compresslevel=9, mtime=0)
+    if len(compressed) < len(content):
+        path.with_name(path.name + '.gz').write_bytes(compressed)
+
+    if brotli is not None:
+        compressed = brotli.compress(content, quality=11)
+        if len(compressed) < len(content):
+            path.with_name(path.name + '.br').write_bytes(compressed)
+
+
+def build_assets(static_dir=STATIC_DIR):
+    """
+    Write minified, fingerprinted and precompressed copies of the static assets and return the manifest
+    """
+    static_dir = Path(static_dir)
+    dist_dir = static_dir / DIST_NAME
+    if dist_dir.exists():
+        shutil.rmtree(dist_dir)
+
+    sources = sorted(p for p in static_dir.rglob('*')
+                     if p.is_file() and p.suffix in ASSET_EXTENSIONS and DIST_NAME not in p.relative_to(static_dir).parts[:1])
+
+    # Stylesheets go last so the files they reference already have their fingerprinted names
+    sources.sort(key=lambda p: p.suffix == '.css')
+
+    manifest = {}
+    for source in sources:
+        relative_name = source.relative_to(static_dir).as_posix()
+        content = source.read_bytes()
+
+        if source.suffix == '.css':
+            text = minify_css(content.decode('utf-8'))
+            content = _rewrite_css_urls(text, relative_name, manifest).encode('utf-8')
+        elif source.suffix == '.js' and not source.name.endswith('.min.js'):
+            content = minify_js(content.decode('utf-8')).encode('utf-8')
+
+        hashed_name = fingerprint(relative_name, content)
+        target = dist_dir / hashed_name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        target.write_bytes(content)
+        _write_compressed(target, content)
+
+        manifest[relative_name] = hashed_name
+
+    (dist_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2, sort_keys=True))
+
+    return manifest
+
+
+def load_manifest(static_dir=STATIC_DIR):
+    manifest_file = Path(static_dir) / DIST_NAME / MANIFEST_NAME
+    try:
+        with open(manifest_file) as mf:
+            return json.load(mf)
+    except FileNotFoundError:
+        return {}
+
+
+def init_app(app):
+    """
+    Serve the fingerprinted assets when a build exists, otherwise leave the default static handling alone
+    """
+    manifest = load_manifest(app.static_folder)
+    if not manifest:
+        return
+
+    app.config['ASSET_VERSION'] = hashlib.sha256(json.dumps(manifest, sort_keys=True).encode()).hexdigest()[:12]
+
+    dist_dir = Path(app.static_folder) / DIST_NAME
+    dist_prefix = f"{DIST_NAME}/"
+    fingerprinted = set(manifest.values())
+    precompressed = {p.relative_to(dist_dir).as_posix() for p in dist_dir.rglob('*') if p.suffix in ('.br', '.gz')}
+    default_static = app.view_functions['static']
+
+    @app.url_defaults
+    def fingerprinted_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = dist_prefix + manifest[values['filename']]
+
+    def send_static(filename):
+        name = filename[len(dist_prefix):] if filename.startswith(dist_prefix) else None
+        if name not in fingerprinted:
+            return default_static(filename=filename)
+
+        mimetype = mimetypes.guess_type(name)[0] or 'application/octet-stream'
+        encoding = None
+        for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if request.accept_encodings[candidate] and name + suffix in precompressed:
+                encoding = candidate
+                name = name + suffix
+                break
+
+        response = send_from_directory(dist_dir, name, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.headers.pop('Content-Disposition', None)
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+
+        return response
+
+    app.view_functions['static'] = send_static
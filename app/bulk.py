@@ -0,0 +1,98 @@
+# Bulk submissions: many rows of form values from an uploaded CSV or YAML file, checked against the ui spec
+import csv
+import io
+import ipaddress
+import re
+import yaml
+
+
+class BulkInputError(Exception):
+    pass
+
+
+TRUE_VALUES = ('1', 'true', 'yes', 'y', 'x', 'on')
+
+
+def parse_rows(filename, content):
+    """
+    Read the rows of a CSV file or a YAML list of mappings
+    """
+    if isinstance(content, bytes):
+        try:
+            content = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise BulkInputError("The bulk file must be UTF-8 text")
+
+    if filename.lower().endswith(('.yml', '.yaml')):
+        try:
+            rows = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise BulkInputError(f"The bulk file is not valid YAML: {e}")
+
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise BulkInputError("A YAML bulk file must be a list of mappings of field names to values")
+    elif filename.lower().endswith('.csv'):
+        rows = list(csv.DictReader(io.StringIO(content)))
+    else:
+        raise BulkInputError("The bulk file must be a .csv, .yml or .yaml file")
+
+    if not rows:
+        raise BulkInputError("The bulk file does not contain any rows")
+
+    return [{str(k).strip(): '' if v is None else str(v).strip() for k, v in row.items()} for row in rows]
+
+
+def validate_value(name, field, value):
+    field_type = field.get('type')
+
+    if field_type == 'text' and field.get('regex') and not re.fullmatch(field['regex'], value):
+        return f"'{value}' does not match the pattern for {name}"
+
+    if field_type == 'ip_cidr':
+        try:
+            if '/' not in value:
+                raise ValueError
+            ipaddress.IPv4Interface(value)
+        except ValueError:
+            return f"'{value}' is not an IP address with CIDR notation for {name}"
+
+    if field_type in ('dropdown', 'dropdown_search') and value not in [str(option) for option in field.get('options') or []]:
+        return f"'{value}' is not one of the choices for {name}"
+
+    return None
+
+
+def validate_rows(rows, spec):
+    """
+    Turn the rows into the form data main() would get from the form, or list every problem found
+    """
+    fields = {name: field for name, field in spec.items() if isinstance(field, dict) and field.get('type') != 'paragraph'}
+    clean_rows = []
+    errors = []
+
+    for number, row in enumerate(rows, start=1):
+        unknown = sorted(set(row) - set(fields))
+        if unknown:
+            errors.append(f"Row {number}: unknown columns {unknown}")
+            continue
+
+        form_data = {}
+        for name, field in fields.items():
+            value = row.get(name)
+            if value in (None, ''):
+                default = field.get('default')
+                value = '' if default is None else str(default)
+
+            if field.get('type') == 'checkbox':
+                if value.lower() in TRUE_VALUES:
+                    form_data[name] = '1'
+                continue
+
+            error = validate_value(name, field, value) if value != '' or field.get('type') in ('dropdown', 'dropdown_search') else None
+            if error:
+                errors.append(f"Row {number}: {error}")
+            form_data[name] = value
+
+        clean_rows.append(form_data)
+
+    return clean_rows, errors
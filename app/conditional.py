@@ -0,0 +1,47 @@
+# Conditional GET support for pages that only change when the catalog or their templates change
+from flask import request, make_response
+from pathlib import Path
+from app import app, catalog
+import functools
+import hashlib
+
+
+def template_mtimes(templates):
+    template_dir = Path(app.root_path) / app.template_folder
+    return [(template, (template_dir / template).stat().st_mtime_ns) for template in templates]
+
+
+def page_etag(templates, use_catalog=True):
+    """
+    Strong ETag for the current request, built only from the things the page is rendered from
+    """
+    parts = [request.endpoint, sorted((request.view_args or {}).items()), template_mtimes(templates),
+             app.config.get('ASSET_VERSION')]
+
+    if use_catalog:
+        catalog.refresh()
+        parts.append(catalog.version)
+
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+def conditional(*templates, use_catalog=True):
+    """
+    Answer If-None-Match with a 304 before the view does any rendering work
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = page_etag(templates, use_catalog=use_catalog)
+
+            if request.if_none_match.contains(etag):
+                response = app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+
+            return response
+        return wrapper
+    return decorator
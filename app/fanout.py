@@ -0,0 +1,25 @@
+# Run one function over many inputs in parallel with bounded concurrency
+from concurrent.futures import ThreadPoolExecutor
+import contextvars
+
+
+def run_parallel(func, items, max_workers=4):
+    """
+    Call func for every item on a bounded thread pool
+
+    Returns a (result, error) pair per item, in the order of the items, so one failure never hides the others.
+    Each call runs in a copy of the caller's context, so it keeps the request's correlation ID.
+    """
+    def run(item):
+        try:
+            return func(item), None
+        except Exception as e:
+            return None, f"{type(e).__name__}: {e}"
+
+    items = list(items)
+    if not items:
+        return []
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items)))) as pool:
+        contexts = [contextvars.copy_context() for _ in items]
+        return list(pool.map(lambda context, item: context.run(run, item), contexts, items))
@@ -0,0 +1,222 @@
+# Run history: every run_script call recorded in SQLite, written in batches by a background thread
+import hashlib
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    script TEXT NOT NULL,
+    user TEXT,
+    kind TEXT NOT NULL,
+    inputs_hash TEXT,
+    status TEXT NOT NULL,
+    duration REAL NOT NULL,
+    phases TEXT NOT NULL,
+    runs INTEGER NOT NULL DEFAULT 1,
+    failed_runs INTEGER NOT NULL DEFAULT 0,
+    shared INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    pr_number INTEGER,
+    pr_url TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_script_started ON runs (script, started);
+CREATE INDEX IF NOT EXISTS runs_user_started ON runs (user, started);
+CREATE INDEX IF NOT EXISTS runs_started_duration ON runs (started, duration);
+CREATE INDEX IF NOT EXISTS runs_pr_number ON runs (pr_number);
+"""
+
+# Columns added after the table was first created, with their definitions, for databases made by older versions
+ADDED_COLUMNS = {'shared': "INTEGER NOT NULL DEFAULT 0"}
+
+log = logging.getLogger(__name__)
+
+COLUMNS = ('started', 'script', 'user', 'kind', 'inputs_hash', 'status', 'duration', 'phases', 'runs', 'failed_runs',
+           'shared', 'error', 'pr_number', 'pr_url')
+
+
+def inputs_hash(form_data, extra=b''):
+    """
+    Stable hash of the submitted fields, the same for the same values in any order
+    """
+    digest = hashlib.sha256(json.dumps(sorted(form_data.items()), default=str).encode())
+    digest.update(extra)
+    return digest.hexdigest()
+
+
+def pull_request(output):
+    """
+    Number and URL of the pull request in a script's output, if it made one
+    """
+    try:
+        pr = output['data']['createPullRequest']['pullRequest']
+        return pr.get('number'), pr.get('url')
+    except (KeyError, TypeError, AttributeError):
+        return None, None
+
+
+class RunHistory():
+    def __init__(self, path, batch_size=100, flush_interval=1.0):
+        self.path = str(path)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=10000)
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writer_pid = None
+        self._ready = False
+
+    def _prepare(self):
+        """
+        Create or migrate the database on first use, so importing the app never touches the file
+        """
+        if self._ready:
+            return
+
+        with self._lock:
+            if self._ready:
+                return
+            db = self._connect()
+            try:
+                db.execute("PRAGMA journal_mode=WAL")
+                db.executescript(SCHEMA)
+                self._migrate(db)
+            finally:
+                db.close()
+            self._ready = True
+
+    def _migrate(self, db):
+        """
+        Add the columns a database created by an older version is missing
+        """
+        for column, definition in ADDED_COLUMNS.items():
+            existing = {row['name'] for row in db.execute("PRAGMA table_info(runs)")}
+            if column in existing:
+                continue
+            try:
+                with db:
+                    db.execute(f"ALTER TABLE runs ADD COLUMN {column} {definition}")
+            except sqlite3.OperationalError:
+                # Another worker added it first
+                if column not in {row['name'] for row in db.execute("PRAGMA table_info(runs)")}:
+                    raise
+
+    def _connect(self):
+        db = sqlite3.connect(self.path, timeout=10)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _ensure_writer(self):
+        # The writer is started in each worker process, a thread started before a fork does not survive it
+        if self._writer_pid == os.getpid() and self._writer.is_alive():
+            return
+
+        with self._lock:
+            if self._writer_pid != os.getpid() or not self._writer.is_alive():
+                self._writer = threading.Thread(target=self._write_batches, name="run-history", daemon=True)
+                self._writer.start()
+                self._writer_pid = os.getpid()
+
+    def record(self, **run):
+        """
+        Queue one run for writing, never blocking the request
+        """
+        run = dict({'runs': 1, 'failed_runs': 0, 'shared': 0}, **run)
+        run['phases'] = json.dumps({name: round(seconds, 4) for name, seconds in run.get('phases', {}).items()})
+        row = tuple(run.get(column) for column in COLUMNS)
+
+        self._ensure_writer()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.dropped += 1
+            log.warning("Dropped a run, the run history queue is full")
+
+    def _write_batches(self):
+        db = None
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get(timeout=max(0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            try:
+                self._prepare()
+                if db is None:
+                    db = self._connect()
+                with db:
+                    db.executemany(f"INSERT INTO runs ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})", batch)
+            except sqlite3.Error as e:
+                self.dropped += len(batch)
+                log.error("Dropped %s runs, they could not be written to the run history %s: %s", len(batch), self.path, e)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def flush(self):
+        """
+        Wait until every queued run is written
+        """
+        self._queue.join()
+
+    def stats(self):
+        return {'queued': self._queue.qsize(), 'dropped': self.dropped}
+
+    def query(self, script=None, user=None, pr_number=None, status=None, since=None, min_duration=None, limit=50):
+        """
+        The newest runs matching every given filter
+        """
+        where = []
+        params = []
+        for column, value in (('script', script), ('user', user), ('pr_number', pr_number), ('status', status)):
+            if value is not None:
+                where.append(f"{column} = ?")
+                params.append(value)
+        if since is not None:
+            where.append("started >= ?")
+            params.append(since)
+        if min_duration is not None:
+            where.append("duration >= ?")
+            params.append(min_duration)
+
+        sql = "SELECT * FROM runs"
+        if where:
+            sql += " WHERE " + " AND ".join(where)
+        sql += " ORDER BY started DESC LIMIT ?"
+        params.append(limit)
+
+        self._prepare()
+        db = self._connect()
+        try:
+            rows = db.execute(sql, params).fetchall()
+        finally:
+            db.close()
+
+        return [dict(row, phases=json.loads(row['phases'])) for row in rows]
+
+
+class NoHistory():
+    """
+    Stand-in when the run history is turned off
+    """
+    def record(self, **run):
+        pass
+
+    def flush(self):
+        pass
+
+    def query(self, **filters):
+        return []
+
+    def stats(self):
+        return {'queued': 0, 'dropped': 0}
@@ -0,0 +1,207 @@
+# Logging: records go through a queue to a listener thread, so request threads never wait on the log file
+from datetime import datetime, timezone
+import atexit
+import contextvars
+import fcntl
+import flask
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+
+from SourceControlMgmt.GitBackend import redact_credentials
+
+log = logging.getLogger(__name__)
+
+# Correlation ID of the request the current thread is serving, None outside requests
+correlation_id = contextvars.ContextVar('correlation_id', default=None)
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+REQUEST_ID = re.compile(r'[A-Za-z0-9._-]{1,64}')
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line
+    """
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'correlation_id': getattr(record, 'correlation_id', None),
+            'pid': record.process,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LogQueueHandler(logging.handlers.QueueHandler):
+    """
+    Queue handler that stamps the correlation ID, redacts credentials and never blocks
+
+    Each process gets its own queue and listener thread, started on first use: a thread started before a fork
+    does not survive it, and the parent's queue may have been locked when the fork happened.  When the queue is
+    full records are counted and dropped.
+    """
+    def __init__(self, handlers, max_queued=10000):
+        super().__init__(queue.Queue(maxsize=max_queued))
+        self.handlers = handlers
+        self.dropped = 0
+        self._listener = None
+        self._listener_pid = None
+        self._lock = threading.Lock()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.queue = queue.Queue(maxsize=self.queue.maxsize)
+        self._lock = threading.Lock()
+        self._listener = None
+        self._listener_pid = None
+
+    def _ensure_listener(self):
+        if self._listener_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._listener_pid != os.getpid():
+                self._listener = logging.handlers.QueueListener(self.queue, *self.handlers, respect_handler_level=True)
+                self._listener.start()
+                self._listener_pid = os.getpid()
+
+    def prepare(self, record):
+        record.correlation_id = correlation_id.get()
+        # Formats the message and any traceback into record.msg, which is then safe to redact
+        record = super().prepare(record)
+        record.msg = redact_credentials(record.msg)
+        record.message = record.msg
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        """
+        Write everything queued and stop the listener
+        """
+        with self._lock:
+            if self._listener is not None and self._listener_pid == os.getpid():
+                self._listener.stop()
+            self._listener = None
+            self._listener_pid = None
+
+
+class SharedRotatingFileHandler(logging.handlers.WatchedFileHandler):
+    """
+    File handler for a file every worker process appends to, rotated by size
+
+    The worker that sees the file reach max_bytes renames it under an flock, after checking that no other worker
+    rotated it first.  The other workers notice the rename the way WatchedFileHandler notices logrotate and
+    reopen the new file.  Rotated files are name.1, the newest, up to name.<backups>.
+    """
+    def __init__(self, filename, max_bytes=0, backups=0):
+        super().__init__(filename)
+        self.max_bytes = max_bytes
+        self.backups = backups
+
+    def emit(self, record):
+        super().emit(record)
+        try:
+            if self.max_bytes and self.stream is not None and self.stream.tell() >= self.max_bytes:
+                self.rotate()
+        except Exception:
+            self.handleError(record)
+
+    def rotate(self):
+        fd = os.open(f"{self.baseFilename}.lock", os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                size = os.stat(self.baseFilename).st_size
+            except FileNotFoundError:
+                size = 0
+
+            if size >= self.max_bytes:
+                for number in range(self.backups - 1, 0, -1):
+                    if os.path.exists(f"{self.baseFilename}.{number}"):
+                        os.replace(f"{self.baseFilename}.{number}", f"{self.baseFilename}.{number + 1}")
+                if self.backups:
+                    os.replace(self.baseFilename, f"{self.baseFilename}.1")
+                else:
+                    os.unlink(self.baseFilename)
+        finally:
+            os.close(fd)
+
+        self.reopenIfNeeded()
+
+
+def init_logging(settings, logger=None):
+    """
+    Send the root logger, or the given one, through a queue to the log file, or to stderr when the log file is
+    turned off or cannot be opened
+
+    Called by the server entry points, never on import.  Every worker process appends to the same file, which is
+    rotated at log_file_max_bytes by whichever worker gets there first.  Queued records are written when the
+    process exits.
+    """
+    logger = logger or logging.getLogger()
+    error = None
+    handler = logging.StreamHandler(sys.stderr)
+    if settings.log_file_enable:
+        try:
+            handler = SharedRotatingFileHandler(settings.log_file_name, settings.log_file_max_bytes, settings.log_file_backups)
+        except OSError as e:
+            error = e
+    handler.setFormatter(JsonFormatter())
+
+    queue_handler = LogQueueHandler([handler], max_queued=settings.log_queue_size)
+    logger.addHandler(queue_handler)
+    logger.setLevel(settings.log_level)
+    atexit.register(queue_handler.stop)
+
+    if error is not None:
+        log.warning("Logging to stderr, the log file cannot be opened: %s", error)
+    return queue_handler
+
+
+def init_app(app):
+    """
+    Give every request a correlation ID, from the X-Request-ID header when the client or proxy sent one
+    """
+    @app.before_request
+    def start_request():
+        request_id = flask.request.headers.get(REQUEST_ID_HEADER, '')
+        if not REQUEST_ID.fullmatch(request_id):
+            request_id = uuid.uuid4().hex
+        flask.g.correlation_token = correlation_id.set(request_id)
+        flask.g.request_started = time.monotonic()
+
+    @app.after_request
+    def finish_request(response):
+        if 'request_started' in flask.g:
+            response.headers[REQUEST_ID_HEADER] = correlation_id.get()
+            log.info("%s %s %s %.3fs", flask.request.method, flask.request.path, response.status_code,
+                     time.monotonic() - flask.g.request_started)
+        return response
+
+    @app.teardown_request
+    def end_request(error=None):
+        token = flask.g.pop('correlation_token', None)
+        if token is not None:
+            correlation_id.reset(token)
@@ -0,0 +1,95 @@
+# Short lived cache of each script's pre() output, with sorted indexes for searching long option lists
+import bisect
+import os
+import threading
+import time
+
+
+class OptionIndex():
+    """
+    Case-insensitive prefix search over an option list, sorted once so every search is a binary search
+    """
+    def __init__(self, options):
+        pairs = sorted((str(option).lower(), str(option)) for option in options)
+        self.keys = [key for key, _ in pairs]
+        self.options = [option for _, option in pairs]
+
+    def search(self, prefix='', offset=0, limit=50):
+        prefix = prefix.lower()
+        start = bisect.bisect_left(self.keys, prefix)
+        end = bisect.bisect_left(self.keys, prefix + '\U0010ffff') if prefix else len(self.keys)
+
+        return self.options[start + offset:min(start + offset + limit, end)], end - start
+
+
+class PreOutputCache():
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entries = {}
+        self._locks = {}
+        self._lock = threading.Lock()
+
+    def put(self, script, variables):
+        # The version is random rather than a counter so it never means the same thing in two workers
+        self._entries[script] = {'variables': variables, 'indexes': {}, 'expires': time.monotonic() + self.ttl,
+                                 'version': os.urandom(8).hex()}
+
+    def clear(self):
+        self._entries.clear()
+
+    def _entry(self, script, loader):
+        entry = self._entries.get(script)
+        if entry and entry['expires'] > time.monotonic():
+            return entry
+
+        with self._lock:
+            lock = self._locks.setdefault(script, threading.Lock())
+
+        # One pre() call refills the cache, the other requests wait for it.  A lock whose load failed is dropped,
+        # so names that are not scripts do not each leave one behind.
+        with lock:
+            entry = self._entries.get(script)
+            if entry and entry['expires'] > time.monotonic():
+                return entry
+            try:
+                self.put(script, loader())
+            except BaseException:
+                with self._lock:
+                    if self._locks.get(script) is lock:
+                        del self._locks[script]
+                raise
+            return self._entries[script]
+
+    def get(self, script, loader):
+        return self._entry(script, loader)['variables']
+
+    def lookup(self, script, loader):
+        """
+        The pre() output and the version of the cache entry it came from
+        """
+        entry = self._entry(script, loader)
+        return entry['variables'], entry['version']
+
+    def version(self, script):
+        """
+        Version of the script's cached pre() output, or None when there is none that is still fresh
+        """
+        entry = self._entries.get(script)
+        if entry and entry['expires'] > time.monotonic():
+            return entry['version']
+        return None
+
+    def options(self, script, source, loader):
+        """
+        The search index for one option list in the pre() output, or None when there is no such list
+        """
+        entry = self._entry(script, loader)
+        index = entry['indexes'].get(source)
+        if index is None:
+            options = entry['variables'].get(source)
+            if not isinstance(options, (list, tuple)):
+                return None
+            index = OptionIndex(options)
+            entry['indexes'][source] = index
+
+        return index
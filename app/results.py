@@ -0,0 +1,120 @@
+# Tabular script results kept on the server and handed out a page at a time or as a streamed download
+from pathlib import Path
+import csv
+import io
+import json
+import os
+import re
+import secrets
+import time
+
+# secrets.token_urlsafe ids, nothing that could name a file outside the store
+RESULT_ID = re.compile(r'[A-Za-z0-9_-]{1,64}')
+
+
+class ResultTable():
+    def __init__(self, columns, rows, title=None):
+        self.columns = columns
+        self.rows = rows
+        self.title = title
+
+    def page(self, page=1, per_page=100):
+        start = (page - 1) * per_page
+        return self.rows[start:start + per_page]
+
+    def iter_ndjson(self):
+        for row in self.rows:
+            yield json.dumps(dict(zip(self.columns, row)), default=str) + "\n"
+
+    def iter_csv(self):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in [self.columns] + self.rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+
+def table_from_output(output):
+    """
+    The table in a script's output, or None when the output is not tabular
+
+    Tabular output is {'table': {'columns': [...], 'rows': [...], 'title': '...'}}.  Rows are lists in column order,
+    or dicts keyed by column, in which case the columns may be left out.
+    """
+    if not isinstance(output, dict) or not isinstance(output.get('table'), dict):
+        return None
+
+    table = output['table']
+    rows = list(table.get('rows') or [])
+    columns = list(table.get('columns') or [])
+
+    if not columns:
+        for row in rows:
+            if isinstance(row, dict):
+                columns.extend(key for key in row if key not in columns)
+
+    rows = [[row.get(column) for column in columns] if isinstance(row, dict) else list(row) for row in rows]
+
+    return ResultTable(columns, rows, table.get('title'))
+
+
+class ResultStore():
+    """
+    Results kept as files in a directory every worker process shares, so any worker can serve any result's pages
+
+    Each result is written to a temporary file and renamed into place, so readers never see half a result.  A
+    result's file modification time is when it was stored.  The directory is made by the first put().
+    """
+    def __init__(self, directory, max_results=50, ttl=3600):
+        self.directory = Path(directory)
+        self.max_results = max_results
+        self.ttl = ttl
+
+    def _path(self, result_id):
+        return self.directory / f"{result_id}.json"
+
+    def _expire(self, now):
+        results = []
+        for path in self.directory.glob("*.json"):
+            try:
+                results.append((path.stat().st_mtime, path))
+            except FileNotFoundError:
+                continue
+
+        results.sort(reverse=True)
+        for number, (stored, path) in enumerate(results):
+            if number >= self.max_results or stored + self.ttl <= now:
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+
+    def put(self, table):
+        result_id = secrets.token_urlsafe(12)
+        now = time.time()
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        temporary = self.directory / f".{result_id}.tmp"
+        with open(temporary, "x") as result_file:
+            json.dump({'columns': table.columns, 'rows': table.rows, 'title': table.title}, result_file, default=str)
+        os.utime(temporary, (now, now))
+        os.replace(temporary, self._path(result_id))
+
+        self._expire(now)
+        return result_id
+
+    def get(self, result_id):
+        if not RESULT_ID.fullmatch(result_id):
+            return None
+
+        path = self._path(result_id)
+        try:
+            if path.stat().st_mtime + self.ttl <= time.time():
+                return None
+            with open(path) as result_file:
+                result = json.load(result_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+        return ResultTable(result['columns'], result['rows'], result['title'])
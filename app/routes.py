@@ -1,15 +1,30 @@
 from flask import render_template, request
-from app import app
-from pathlib import Path
-from jinja2 import FileSystemLoader, Environment
+from app import app, settings, catalog, warm_up, admission, apic_clients, pre_cache, result_store, history, single_flight
+from app.admission import AdmissionQueueFull, AdmissionTimeout, UnknownScript
+from app.conditional import conditional
+from app.fanout import run_parallel
+from app.bulk import BulkInputError, parse_rows, validate_rows
+from app.results import table_from_output
+from app.history import inputs_hash, pull_request
+from app.tracing import waterfall
+from ScriptCatalog.ScriptCatalog import ScriptCatalogError, call_script, accepts, bind_spec
+from Tracing.Tracing import span, read_trace, recent_traces
+from contextlib import contextmanager
+from datetime import datetime
+from markupsafe import escape
 import flask
+import hashlib
+import json
+import time
 import yaml
-import importlib
-import sys
+
+FABRICS_FIELD = '__fabrics'
+BULK_FIELD = '__bulk_file'
 
 
 @app.route('/')
 @app.route('/index')
+@conditional('base.j2')
 def index():
     # Load up all the scripts from the user directory
     script_data = get_repo_name()
@@ -17,6 +32,7 @@ def index():
 
 
 @app.route('/script/<script>')
+@conditional('script_start.html')
 def script_start_point(script):
     script_details = get_repo_name(as_dict=True)
     return render_template('script_start.html', script_details=script_details[script])
@@ -24,78 +40,526 @@ def script_start_point(script):
 
 @app.route('/run_script/<script>', methods=['GET', 'POST'])
 def run_script(script):
-    if flask.request.method == 'GET':
-        file_path = Path(".") / "repos" / script / "gui" / "main.py"
-        file_path = file_path.resolve()
+    flask.g.run = {'kind': 'form' if flask.request.method == 'GET' else 'single', 'phases': {}, 'runs': 1, 'failed_runs': 0,
+                   'shared': 0}
+    started = time.time()
+    clock = time.perf_counter()
+    try:
+        with admission.admit(script):
+            flask.g.run['phases']['queue'] = time.perf_counter() - clock
+            response = flask.make_response(execute_script(script))
+    except UnknownScript as e:
+        return f"<b>{escape(e)}</b>", 404
+    except AdmissionQueueFull as e:
+        response = busy(e, 429)
+    except AdmissionTimeout as e:
+        response = busy(e, 503)
+    except Exception as e:
+        record_run(script, started, clock, 'error', error=f"{type(e).__name__}: {e}")
+        raise
+
+    record_run(script, started, clock, run_status(response))
+    return response
 
-        spec = importlib.util.spec_from_file_location('main', file_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        sys.modules['main'] = module
-        main = importlib.import_module('main')
 
-        variables = main.pre()
+def run_status(response):
+    run = flask.g.run
+    if response.status_code in (429, 503):
+        return 'rejected'
+    if response.status_code >= 400 or run['failed_runs'] >= run['runs']:
+        return 'failed'
+    return 'partial' if run['failed_runs'] else 'ok'
 
-        return ui(script, "ui.yml", **variables)
+
+def record_run(script, started, clock, status, error=None):
+    run = flask.g.run
+    history.record(started=started, script=script, user=request.remote_user or request.remote_addr, kind=run['kind'],
+                   inputs_hash=run.get('inputs_hash'), status=status, duration=time.perf_counter() - clock,
+                   phases=run['phases'], runs=run['runs'], failed_runs=run['failed_runs'],
+                   shared=run['shared'], error=error or run.get('error'),
+                   pr_number=run.get('pr_number'), pr_url=run.get('pr_url'))
+
+
+@contextmanager
+def phase(name):
+    """
+    Time one phase of a run for the run history, and trace it
+    """
+    start = time.perf_counter()
+    try:
+        with span(name):
+            yield
+    finally:
+        phases = flask.g.run['phases']
+        phases[name] = phases.get(name, 0) + time.perf_counter() - start
+
+
+def record_outcomes(outcomes):
+    """
+    Note how many of several runs failed, and the first pull request they made
+    """
+    flask.g.run['runs'] = len(outcomes)
+    flask.g.run['failed_runs'] = sum(1 for _, error in outcomes if error)
+    for output, error in outcomes:
+        if not error and pull_request(output)[0] is not None:
+            flask.g.run['pr_number'], flask.g.run['pr_url'] = pull_request(output)
+            break
+
+
+def execute_script(script):
+    if flask.request.method == 'GET':
+        with phase('pre'):
+            variables = pre_variables(script)
+            pre_cache.put(script, variables)
+
+        with phase('render'):
+            return ui(script, "ui.yml", **variables)
 
     elif flask.request.method == 'POST':
-        file_path = Path(".") / "repos" / script / "gui" / "main.py"
-        file_path = file_path.resolve()
-
-        spec = importlib.util.spec_from_file_location('main', file_path)
-        module = importlib.util.module_from_spec(spec)
-        spec.loader.exec_module(module)
-        sys.modules['main'] = module
-        main = importlib.import_module('main')
+        main = catalog.load_module(script)
+        fabrics = selected_fabrics(request.form.getlist(FABRICS_FIELD))
         form_data = request.form.to_dict()
+        form_data.pop(FABRICS_FIELD, None)
+        flask.g.run['inputs_hash'] = inputs_hash(form_data)
+
+        bulk_file = request.files.get(BULK_FIELD)
+        if bulk_file and bulk_file.filename:
+            flask.g.run['kind'] = 'bulk'
+            if fabrics:
+                return render_template('bulk_output.j2', errors=["Pick fabrics or upload a bulk file, not both"]), 400
+            return run_bulk(script, main, bulk_file)
+
+        if fabrics:
+            flask.g.run['kind'] = 'fabrics'
+            return run_on_fabrics(script, main, fabrics, form_data)
+
+        with phase('main'):
+            output = coalesce((script, 'single', flask.g.run['inputs_hash']),
+                              lambda: call_script(main.main, script_services(), **form_data))
+        flask.g.run['pr_number'], flask.g.run['pr_url'] = pull_request(output)
+
+        with phase('render'):
+            table = table_from_output(output)
+            if table is not None:
+                return render_template('table_output.j2', result=result_page(result_store.put(table), table))
+
+            return render_template('output.j2', data=output)
+
+
+def selected_fabrics(values):
+    if 'all' in values:
+        return list(settings.fabric_names)
+    return [url for url in values if url in settings.fabric_names]
+
+
+def coalesce(key, func):
+    """
+    Run func unless an identical submission is already running, then wait for and share its result
+    """
+    result, shared = single_flight.do(key, func)
+    if shared:
+        flask.g.run['shared'] = 1
+    return result
+
+
+def run_on_fabrics(script, main, fabrics, form_data):
+    """
+    Run the script's main() against each fabric in parallel and show every fabric's result together
+    """
+    def run(url):
+        with span('fabric', fabric=settings.fabric_names[url]):
+            return call_script(main.main, script_services(url), **dict(form_data))
+
+    with phase('main'):
+        outcomes = coalesce((script, 'fabrics', tuple(fabrics), flask.g.run['inputs_hash']),
+                            lambda: run_parallel(run, fabrics, max_workers=settings.fabric_fanout_workers))
+    record_outcomes(outcomes)
+
+    runs = [{'fabric': settings.fabric_names[url], 'url': url, 'data': output, 'error': error}
+            for url, (output, error) in zip(fabrics, outcomes)]
+
+    with phase('render'):
+        for fabric_run in runs:
+            table = table_from_output(fabric_run['data'])
+            if table is not None:
+                fabric_run['result'] = result_page(result_store.put(table), table)
+
+        return render_template('output.j2', runs=runs)
+
+
+def run_bulk(script, main, bulk_file):
+    """
+    Validate every row of an uploaded file against the ui spec, then run main() for the rows in parallel
+    """
+    try:
+        content = bulk_file.read()
+        flask.g.run['inputs_hash'] = inputs_hash({}, content)
+        rows = parse_rows(bulk_file.filename, content)
+        if len(rows) > settings.bulk_max_rows:
+            raise BulkInputError(f"The bulk file has {len(rows)} rows, the limit is {settings.bulk_max_rows}")
+
+        with phase('pre'):
+            variables = call_script(main.pre, script_services())
+        spec = resolve_option_sources(ui_spec(script, "ui.yml", **variables), variables)
+    except BulkInputError as e:
+        return render_template('bulk_output.j2', errors=[str(e)]), 400
+    except (yaml.YAMLError, ScriptCatalogError):
+        return render_template('bulk_output.j2', errors=["Unable to parse the script launcher"]), 500
+
+    rows, errors = validate_rows(rows, spec)
+    if errors:
+        return render_template('bulk_output.j2', errors=errors), 400
+
+    def run(row):
+        with span('row'):
+            return call_script(main.main, script_services(), **row)
+
+    with phase('main'):
+        outcomes = coalesce((script, 'bulk', flask.g.run['inputs_hash']),
+                            lambda: run_parallel(run, rows, max_workers=settings.bulk_workers))
+    record_outcomes(outcomes)
+
+    runs = [{'row': number, 'inputs': row, 'data': output, 'error': error}
+            for number, (row, (output, error)) in enumerate(zip(rows, outcomes), start=1)]
+
+    with phase('render'):
+        for bulk_run in runs:
+            if bulk_run['error']:
+                continue
+            table = table_from_output(bulk_run['data'])
+            if table is not None:
+                bulk_run['result'] = result_page(result_store.put(table), table)
+            bulk_run['pr_number'], bulk_run['pr_url'] = pull_request(bulk_run['data'])
+
+        return render_template('bulk_output.j2', runs=runs)
+
+
+def pre_variables(script):
+    main = catalog.load_module(script)
+    return call_script(main.pre, script_services())
+
+
+def admitted_pre_variables(script):
+    """
+    pre() for a pre_cache refill, which runs against the APIC and so waits its turn like any other run
+
+    The refill lock is already held here.  Admission is always taken inside it and never the other way round, so
+    a request holding a slot never waits for a refill that waits for a slot.
+    """
+    with admission.admit(script):
+        return pre_variables(script)
+
+
+def resolve_option_sources(spec, variables):
+    """
+    Give searchable dropdowns the options list they name, so they are checked like plain dropdowns
+    """
+    resolved = {}
+    for name, field in spec.items():
+        if isinstance(field, dict) and field.get('type') == 'dropdown_search':
+            field = dict(field, options=variables.get(field.get('source')) or [])
+        resolved[name] = field
+
+    return resolved
+
+
+def result_page(result_id, table, page=1, per_page=None):
+    per_page = per_page or settings.result_page_size
+    rows = table.page(page, per_page)
+    first = (page - 1) * per_page + 1
+
+    return {'id': result_id, 'title': table.title, 'columns': table.columns, 'rows': rows, 'page': page,
+            'per_page': per_page, 'total': len(table.rows), 'first': first, 'last': first + len(rows) - 1,
+            'more': page * per_page < len(table.rows)}
+
+
+@app.route('/results/<result_id>', methods=['GET'])
+def result_pages(result_id):
+    table = result_store.get(result_id)
+    if table is None:
+        return "<b>This result has expired.</b>  Run the script again to see it.", 404
+
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(max(1, int(request.args.get('per_page', settings.result_page_size))), 1000)
+    except ValueError:
+        return "page and per_page must be integers", 400
+
+    return render_template('table_output.j2', result=result_page(result_id, table, page, per_page))
+
+
+@app.route('/results/<result_id>/download/<file_format>', methods=['GET'])
+def result_download(result_id, file_format):
+    """
+    The whole result streamed as CSV or NDJSON, one row at a time
+    """
+    table = result_store.get(result_id)
+    if table is None:
+        return "This result has expired", 404
+
+    if file_format == 'csv':
+        rows, mimetype = table.iter_csv(), 'text/csv'
+    elif file_format == 'ndjson':
+        rows, mimetype = table.iter_ndjson(), 'application/x-ndjson'
+    else:
+        return "The format must be csv or ndjson", 404
+
+    response = app.response_class(rows, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="result-{result_id}.{file_format}"'
+    return response
+
 
-        output = main.main(**form_data)
+def script_services(fabric_url=None):
+    """
+    Framework services a script can ask for by naming them as parameters of pre() or main()
+    """
+    def apic():
+        if fabric_url:
+            return apic_clients.client(fabric_url)
+        return apic_clients.client() if apic_clients.configured() else None
 
-        return render_template('output.j2', data=output)
+    def fabric():
+        url = fabric_url or settings.apic_creds.get('url')
+        return {'url': url, 'name': settings.fabric_names.get(url, url)}
+
+    return {'apic': apic, 'fabric': fabric}
+
+
+def busy(error, status):
+    response = flask.make_response(f"<b>The server is busy:</b> {escape(error)}.  Please try again in a few seconds.", status)
+    response.headers['Retry-After'] = '5'
+    return response
+
+
+@app.route('/api/options/<script>/<source>', methods=['GET'])
+def search_options(script, source):
+    """
+    One page of the options in a list returned by pre(), matching the prefix in q
+    """
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = min(max(1, int(request.args.get('per_page', 50))), settings.options_max_per_page)
+    except ValueError:
+        return flask.jsonify({'error': "page and per_page must be integers"}), 400
+
+    try:
+        index = pre_cache.options(script, source, lambda: admitted_pre_variables(script))
+    except (UnknownScript, FileNotFoundError):
+        return flask.jsonify({'error': f"Unknown script {script}"}), 404
+    except AdmissionQueueFull as e:
+        return busy(e, 429)
+    except AdmissionTimeout as e:
+        return busy(e, 503)
+    if index is None:
+        return flask.jsonify({'error': f"pre() of {script} does not return a list named {source}"}), 404
+
+    options, total = index.search(request.args.get('q', ''), (page - 1) * per_page, per_page)
+    return flask.jsonify({'options': options, 'page': page, 'per_page': per_page, 'total': total,
+                          'more': page * per_page < total})
+
+
+def ui_etag(script, pre_version):
+    """
+    Validator for the ui spec JSON, built from what it is made of without building it: the script's gui files,
+    the catalog, the fabrics and the version of the cached pre() output
+    """
+    gui = catalog.repos_dir / script / "gui"
+    mtimes = []
+    for name in ("ui.yml", "ui_spec.yml", "main.py"):
+        try:
+            mtimes.append((name, (gui / name).stat().st_mtime_ns))
+        except FileNotFoundError:
+            mtimes.append((name, None))
+
+    parts = [script, catalog.version, mtimes, settings.fabric_names, pre_version]
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+
+@app.route('/api/ui/<script>', methods=['GET'])
+def ui_api(script):
+    """
+    The script's parsed ui spec as compact JSON for the browser to render
+
+    While the pre() output is cached, If-None-Match is answered before running or rendering anything.
+    """
+    if script not in catalog.scripts(as_dict=True):
+        return flask.jsonify({'error': f"Unknown script {script}"}), 404
+
+    pre_version = pre_cache.version(script)
+    if pre_version is not None:
+        etag = ui_etag(script, pre_version)
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+            response.set_etag(etag)
+            response.cache_control.no_cache = True
+            return response
+
+    try:
+        variables, pre_version = pre_cache.lookup(script, lambda: admitted_pre_variables(script))
+        with admission.admit(script):
+            spec = ui_spec(script, "ui.yml", **variables)
+    except UnknownScript:
+        return flask.jsonify({'error': f"Unknown script {script}"}), 404
+    except AdmissionQueueFull as e:
+        return busy(e, 429)
+    except AdmissionTimeout as e:
+        return busy(e, 503)
+    except FileNotFoundError:
+        return flask.jsonify({'error': f"Unknown script {script}"}), 404
+    except (yaml.YAMLError, ScriptCatalogError):
+        return flask.jsonify({'error': "Unable to parse the script launcher"}), 500
+
+    document = {'script': script,
+                'fields': [dict(field, name=name) for name, field in (spec or {}).items() if isinstance(field, dict)],
+                'fabrics': fabric_choices(script), 'fabrics_field': FABRICS_FIELD, 'bulk_field': BULK_FIELD}
+    body = json.dumps(document, separators=(',', ':'), default=str)
+
+    response = app.response_class(body, mimetype='application/json')
+    response.set_etag(ui_etag(script, pre_version))
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+
+def history_filters(args):
+    """
+    Run history filters from the query string, since is a date, a date and time, 'today' or a unix time
+    """
+    since = args.get('since')
+    if since == 'today':
+        since = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0).timestamp()
+    elif since:
+        try:
+            since = float(since)
+        except ValueError:
+            since = datetime.fromisoformat(since).timestamp()
+
+    min_duration = args.get('min_duration')
+    pr_number = args.get('pr')
+
+    return {'script': args.get('script') or None, 'user': args.get('user') or None, 'status': args.get('status') or None,
+            'pr_number': int(pr_number) if pr_number else None, 'since': since or None,
+            'min_duration': float(min_duration) if min_duration else None,
+            'limit': min(max(1, int(args.get('limit', 50))), 500)}
+
+
+@app.route('/api/history', methods=['GET'])
+def history_api():
+    try:
+        filters = history_filters(request.args)
+    except ValueError as e:
+        return flask.jsonify({'error': f"Bad filter: {e}"}), 400
+
+    return flask.jsonify(history.query(**filters))
+
+
+@app.route('/history', methods=['GET'])
+def history_page():
+    try:
+        filters = history_filters(request.args)
+    except ValueError as e:
+        return f"Bad filter: {e}", 400
+
+    runs = history.query(**filters)
+    for run in runs:
+        run['started'] = datetime.fromtimestamp(run['started']).strftime("%Y-%m-%d %H:%M:%S")
+
+    return render_template('history.j2', runs=runs, filters=request.args)
+
+
+@app.route('/api/traces/<trace_id>', methods=['GET'])
+def trace_api(trace_id):
+    spans = read_trace(settings.trace_file, trace_id, settings.trace_file_backups) if settings.trace_file else None
+    if spans is None:
+        return flask.jsonify({'error': f"No trace {trace_id}"}), 404
+    return flask.jsonify(spans)
+
+
+@app.route('/traces', methods=['GET'])
+def traces_page():
+    traces = recent_traces(settings.trace_file, backups=settings.trace_file_backups) if settings.trace_file else []
+    for root in traces:
+        root['started'] = datetime.fromtimestamp(root['timestamp'] / 1000000).strftime("%Y-%m-%d %H:%M:%S")
+    return render_template('traces.j2', traces=traces)
+
+
+@app.route('/traces/<trace_id>', methods=['GET'])
+def trace_page(trace_id):
+    spans = read_trace(settings.trace_file, trace_id, settings.trace_file_backups) if settings.trace_file else None
+    if spans is None:
+        return f"No trace {trace_id}", 404
+    return render_template('trace.j2', trace_id=trace_id, rows=waterfall(spans))
+
+
+@app.route('/stats/admission', methods=['GET'])
+def admission_stats():
+    return flask.jsonify(admission.stats())
+
+
+@app.route('/stats/history', methods=['GET'])
+def history_stats():
+    return flask.jsonify(history.stats())
+
+
+@app.route('/stats/coalescing', methods=['GET'])
+def coalescing_stats():
+    return flask.jsonify(single_flight.stats())
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    status = warm_up.status()
+    return flask.jsonify(status), 200 if status['ready'] else 503
 
 
 @app.route('/welcome', methods=['GET'])
+@conditional('welcome.html', use_catalog=False)
 def welcome():
     return render_template("welcome.html")
 
 
-def ui(script, ui_name, **kwargs):
-    ui_details = {}
-    templateLoader = FileSystemLoader(searchpath=f'./repos/{script}/gui')
-    templateEnv = Environment(loader=templateLoader)
+def ui_spec(script, ui_name, **kwargs):
+    """
+    The form spec built from the pre() variables: by the script's ui() function, from its static ui_spec.yml
+    and bindings, or by rendering ui.yml as a template and parsing the result
+    """
+    main = catalog.load_module(script)
+    if callable(getattr(main, 'ui', None)):
+        spec = call_script(main.ui, script_services(), **kwargs)
+        if not isinstance(spec, dict):
+            raise ScriptCatalogError(f"ui() of '{script}' must return a mapping of field names to fields")
+        return spec
+
+    static_spec = catalog.static_ui_spec(script)
+    if static_spec is not None:
+        return bind_spec(static_spec, kwargs)
+
+    templateEnv = catalog.ui_environment(script)
     template = templateEnv.get_template(ui_name)
     raw_ui = template.render(**kwargs)
 
+    return yaml.safe_load(raw_ui)
+
+
+def ui(script, ui_name, **kwargs):
+    ui_details = {}
     try:
-        ui_details = yaml.safe_load(raw_ui)
-    except yaml.YAMLError:
+        ui_details = ui_spec(script, ui_name, **kwargs)
+    except (yaml.YAMLError, ScriptCatalogError):
         return "Unable to parse the script launcher"
 
-    template = render_template("ui_template.j2", details=ui_details, script=script)
+    template = render_template("ui_template.j2", details=ui_details, script=script, fabrics=fabric_choices(script),
+                               fabrics_field=FABRICS_FIELD, bulk_field=BULK_FIELD)
     return(template)
 
 
-def get_repo_name(as_dict=False):
-    p = Path('./repos')
-
-    script_data = [
-        {"name": x.parts[-1],
-         "id": x.parts[-1],
-         "path": x} for x in p.iterdir() if x.is_dir()]
+def fabric_choices(script):
+    """
+    Fabrics the operator may pick from, only offered to scripts that take the apic client or fabric
+    """
+    if len(settings.fabric_names) > 1 and accepts(catalog.load_module(script).main, 'apic', 'fabric'):
+        return settings.fabric_names
+    return {}
 
-    for repo in script_data:
-        config_file = repo['path'] / "gui" / "config.yml"
-        config = {}
-        if config_file.exists():
-            with open(config_file) as cf:
-                config = yaml.safe_load(cf)
 
-        if config and config.get('display_name'):
-            repo['name'] = config['display_name']
-        if config and config.get('description'):
-            repo['description'] = config['description']
-
-    if as_dict:
-        script_data = {repo['id']: repo for repo in script_data}
-
-    return script_data
+def get_repo_name(as_dict=False):
+    return catalog.scripts(as_dict=as_dict)
@@ -0,0 +1,217 @@
+# Single-flight: identical submissions that arrive while one is running share its result instead of running again
+#
+# Threads of one worker wait on an in-process call.  With a directory, the workers also claim each key through an
+# flock'd file in it, and the worker that ran the call leaves the outcome there for the others.
+from pathlib import Path
+import fcntl
+import hashlib
+import json
+import os
+import stat
+import threading
+import time
+
+# Seconds an outcome file outlives the reuse window, so workers that waited on the claim can still read it
+OUTCOME_GRACE = 60
+
+
+class SingleFlightError(Exception):
+    pass
+
+
+class SharedRunError(SingleFlightError):
+    """
+    The identical submission another worker ran failed, with its error as the message
+    """
+    pass
+
+
+class Call():
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.finished = None
+
+
+class SingleFlight():
+    def __init__(self, reuse_window=0, directory=None):
+        self.reuse_window = reuse_window
+        self.directory = Path(directory) if directory else None
+        self.started = 0
+        self.shared = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._directory_ready = False
+
+    def _forget_expired(self, now):
+        for key, call in list(self._calls.items()):
+            if call.finished is not None and call.finished + self.reuse_window <= now:
+                del self._calls[key]
+
+    def do(self, key, func):
+        """
+        Run func once for every caller with the same key, returning (result, shared)
+
+        Callers that arrive while it runs, or within reuse_window seconds after it finished, get the same result or
+        the same exception.  A failed call is never reused after it finished.  Callers in other workers get the
+        result as it reads back from JSON, and a failure as SharedRunError.
+        """
+        with self._lock:
+            self._forget_expired(time.monotonic())
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Call()
+            else:
+                self.shared += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        shared = False
+        try:
+            if self.directory is None:
+                self._count_started()
+                call.result = func()
+            else:
+                call.result, shared = self._claim(key, func)
+            return call.result, shared
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                call.finished = time.monotonic()
+                if (call.error is not None or not self.reuse_window) and self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
+
+    def _count_started(self, shared=False):
+        with self._lock:
+            if shared:
+                self.shared += 1
+            else:
+                self.started += 1
+
+    def _prepare_directory(self):
+        if self._directory_ready:
+            return
+
+        self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+        info = os.lstat(self.directory)
+        if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+            raise SingleFlightError(f"The coalescing directory {self.directory} must be a directory of this user "
+                                    f"with mode 0700")
+        self._directory_ready = True
+
+    def _open_claim(self, name, blocking=True):
+        """
+        The claim file for a key, open and flock'd, or None when another worker holds it and blocking is False
+
+        A claim file can be removed by the sweep while we wait for it, so the lock only counts when the path still
+        names the file we locked.
+        """
+        path = self.directory / f"{name}.lock"
+        while True:
+            fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_NOFOLLOW, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                return None
+
+            try:
+                if os.stat(path, follow_symlinks=False).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+
+    def _claim(self, key, func):
+        self._prepare_directory()
+        name = hashlib.sha256(repr(key).encode()).hexdigest()
+        arrived = time.time()
+
+        fd = self._open_claim(name, blocking=False)
+        waited = fd is None
+        if waited:
+            # Another worker is running it, its outcome is there once it lets go of the claim
+            fd = self._open_claim(name)
+
+        try:
+            outcome = self._read_outcome(name)
+            if outcome is not None:
+                finished_since = outcome['finished'] >= arrived
+                reusable = outcome['error'] is None and outcome['finished'] + self.reuse_window > time.time()
+                if (waited and finished_since) or reusable:
+                    self._count_started(shared=True)
+                    if outcome['error'] is not None:
+                        raise SharedRunError(outcome['error'])
+                    return outcome['result'], True
+
+            self._count_started()
+            try:
+                result = func()
+            except Exception as e:
+                self._write_outcome(name, None, f"{type(e).__name__}: {e}")
+                raise
+            self._write_outcome(name, result, None)
+            return result, False
+        finally:
+            os.close(fd)
+            self._sweep()
+
+    def _read_outcome(self, name):
+        try:
+            fd = os.open(self.directory / f"{name}.json", os.O_RDONLY | os.O_NOFOLLOW)
+            with os.fdopen(fd) as outcome_file:
+                return json.load(outcome_file)
+        except (OSError, ValueError):
+            return None
+
+    def _write_outcome(self, name, result, error):
+        temporary = self.directory / f".{name}.{os.getpid()}.{threading.get_ident()}.tmp"
+        fd = os.open(temporary, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | os.O_NOFOLLOW, 0o600)
+        with os.fdopen(fd, 'w') as outcome_file:
+            json.dump({'finished': time.time(), 'result': result, 'error': error}, outcome_file, default=str)
+        os.replace(temporary, self.directory / f"{name}.json")
+
+    def _sweep(self):
+        """
+        Remove the claims and outcomes nobody can reuse any more, each only while holding its claim
+        """
+        expired = time.time() - self.reuse_window - OUTCOME_GRACE
+        for lock_path in self.directory.glob("*.lock"):
+            name = lock_path.stem
+            try:
+                outcome_path = self.directory / f"{name}.json"
+                latest = outcome_path.stat().st_mtime if outcome_path.exists() else lock_path.stat().st_mtime
+            except FileNotFoundError:
+                continue
+            if latest > expired:
+                continue
+
+            fd = self._open_claim(name, blocking=False)
+            if fd is None:
+                continue
+            try:
+                # A run may have finished between the check above and taking the claim
+                outcome = self._read_outcome(name)
+                if outcome is not None and outcome['finished'] > expired:
+                    continue
+                for path in (outcome_path, lock_path):
+                    try:
+                        path.unlink()
+                    except FileNotFoundError:
+                        pass
+            finally:
+                os.close(fd)
+
+    def stats(self):
+        with self._lock:
+            return {'started': self.started, 'shared': self.shared,
+                    'in_flight': sum(1 for call in self._calls.values() if call.finished is None)}
@@ -0,0 +1,128 @@
+// Build a script's form in the browser from the JSON spec served by /api/ui/<script>
+var UiForm = (function() {
+    var IP_CIDR = "((^|\\.)((25[0-5])|(2[0-4]\\d)|(1\\d\\d)|([1-9]?\\d))){4}/(?:\\d|[12]\\d|3[01])$";
+
+    function value(field) {
+        return field["default"] === undefined || field["default"] === null ? "" : field["default"];
+    }
+
+    function input(type, name, field) {
+        return $("<input>", {type: type, name: name, value: value(field)});
+    }
+
+    function renderField(form, field) {
+        var name = field.name;
+        switch (field.type) {
+        case "text":
+            form.append(document.createTextNode(name), input("text", name, field).attr("pattern", field.regex || null), "<br>", "<hr>");
+            break;
+        case "ip_cidr":
+            form.append(document.createTextNode(name),
+                        input("text", name, field).attr({pattern: IP_CIDR, title: "Enter a valid IP address with CIDR notation.  Example '127.0.0.1/32'"}),
+                        "<br>", "<hr>");
+            break;
+        case "checkbox":
+            form.append(document.createTextNode(name), $("<input>", {type: "checkbox", name: name, value: "1"}), "<br>", "<hr>");
+            break;
+        case "password":
+            form.append(document.createTextNode(name), $("<input>", {type: "password", name: name}), "<br>", "<hr>");
+            break;
+        case "hidden":
+            form.append(input("text", name, field).attr("hidden", true), "<br>");
+            break;
+        case "dropdown":
+            var select = $("<select>", {name: name, size: 1});
+            $.each(field.options || [], function(i, option) {
+                select.append($("<option>", {value: option, text: option}));
+            });
+            form.append($("<label>").text(name).append(select), "<br>", "<hr>");
+            break;
+        case "dropdown_search":
+            var search = input("text", name, field).attr({"class": "dropdown-search", autocomplete: "off", placeholder: "Type to search",
+                                                          "data-source": "/api/options/" + form.data("script") + "/" + field.source});
+            form.append($("<label>").text(name).append(search), "<br>", "<hr>");
+            break;
+        case "paragraph":
+            form.append(value(field));
+            break;
+        }
+    }
+
+    function renderExtras(form, spec) {
+        if (!$.isEmptyObject(spec.fabrics)) {
+            var fabrics = $("<fieldset>").append($("<legend>").text("Run on fabrics"),
+                                                 $("<label>").append($("<input>", {type: "checkbox", name: spec.fabrics_field, value: "all"}), " All fabrics"), "<br>");
+            $.each(spec.fabrics, function(url, name) {
+                fabrics.append($("<label>").append($("<input>", {type: "checkbox", name: spec.fabrics_field, value: url}), " " + name), "<br>");
+            });
+            form.append(fabrics, "<hr>");
+        }
+
+        form.append($("<fieldset>").append(
+            $("<legend>").text("Bulk submission"),
+            "Upload a CSV file or a YAML list with one row per submission, using the field names above as the columns<br>",
+            $("<input>", {type: "file", name: spec.bulk_field, accept: ".csv,.yml,.yaml"}), "<br>"), "<hr>");
+        form.append($("<input>", {type: "submit", id: "btn_submit", value: "Submit"}));
+    }
+
+    // Searchable dropdowns and the submit handler, shared by forms rendered here and by ui_template.j2
+    function bind(form, script, bulkField) {
+        form.find(".dropdown-search").each(function() {
+            var search = $(this);
+            search.autocomplete({
+                minLength: 0,
+                delay: 200,
+                source: function(request, response) {
+                    $.getJSON(search.data("source"), {q: request.term, per_page: 50})
+                        .done(function(data) { response(data.options); })
+                        .fail(function() { response([]); });
+                }
+            }).focus(function() {
+                search.autocomplete("search", search.val());
+            });
+        });
+
+        form.submit(function(event) {
+            event.preventDefault();
+            $("#btn_submit").attr("disabled", true);
+            $("#btn_submit").attr("value", "Loading...");
+            var bulkFile = form.find("input[name='" + bulkField + "']")[0];
+            if (bulkFile && bulkFile.files.length) {
+                $.ajax({url: "/run_script/" + script, type: "POST", data: new FormData(this), processData: false, contentType: false})
+                    .done(function(response) { $("#script_output").html(response); })
+                    .fail(function(xhr) { $("#script_output").html(xhr.responseText); });
+                return;
+            }
+            $("#script_output").load("/run_script/" + script, form.serializeArray(), function(response, status) {
+                if (status == "error") {
+                    $("#script_output").html(response);
+                }
+            });
+        });
+    }
+
+    function render(container, spec) {
+        var form = $("<form>", {id: "ui"}).data("script", spec.script);
+        $.each(spec.fields, function(i, field) {
+            renderField(form, field);
+        });
+        renderExtras(form, spec);
+        container.empty().append(form);
+        bind(form, spec.script, spec.bulk_field);
+    }
+
+    // Fetch the spec, letting the browser revalidate its cached copy by ETag, and fall back to the server rendered form
+    function load(container, script) {
+        $.getJSON("/api/ui/" + script)
+            .done(function(spec) { render(container, spec); })
+            .fail(function() {
+                container.load("/run_script/" + script, function(response, status) {
+                    if (status == "error") {
+                        container.html(response);
+                    }
+                });
+            });
+    }
+
+    return {render: render, bind: bind, load: load};
+})();
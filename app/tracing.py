@@ -0,0 +1,108 @@
+# Request tracing for the app: a trace per request, written through the log queue to the trace file
+import atexit
+import flask
+import logging
+import logging.handlers
+import re
+
+from app.logs import LogQueueHandler, SharedRotatingFileHandler, correlation_id
+from Tracing.Tracing import begin_trace, end_trace, trace_log
+
+log = logging.getLogger(__name__)
+
+TRACE_ID_HEADER = 'X-Trace-ID'
+TRACE_ID = re.compile(r'[0-9a-f]{32}')
+
+# Requests that are not traced: static files and the trace pages themselves
+UNTRACED_ENDPOINTS = {'static', 'traces_page', 'trace_page', 'trace_api'}
+
+# The handler writing the trace file, requests are only traced once init_tracing has set it
+sink = None
+
+
+def init_tracing(settings):
+    """
+    Write finished traces to the trace file, returning None when tracing is turned off or the file cannot be opened
+
+    Called by the server entry points, never on import, and requests are only traced once it has been.  Like the
+    log file, the trace file is shared by every worker and rotated by size, keeping trace_file_backups copies.
+    """
+    if not settings.trace_file:
+        return None
+
+    try:
+        handler = SharedRotatingFileHandler(settings.trace_file, settings.trace_file_max_bytes, settings.trace_file_backups)
+    except OSError as e:
+        log.warning("Tracing is off, the trace file cannot be opened: %s", e)
+        return None
+
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    queue_handler = LogQueueHandler([handler], max_queued=settings.log_queue_size)
+    trace_log.addHandler(queue_handler)
+    trace_log.setLevel(logging.INFO)
+    atexit.register(queue_handler.stop)
+
+    global sink
+    sink = queue_handler
+    return queue_handler
+
+
+def init_app(app):
+    """
+    Trace every request, reusing the request's correlation ID as the trace ID when it is a valid one
+    """
+    @app.before_request
+    def start_trace():
+        if sink is None or flask.request.endpoint in UNTRACED_ENDPOINTS:
+            return
+
+        request = flask.request
+        trace_id = correlation_id.get()
+        rule = request.url_rule.rule if request.url_rule else request.path
+        flask.g.trace_span, flask.g.trace_token = begin_trace(f"{request.method} {rule}",
+                                                              trace_id if trace_id and TRACE_ID.fullmatch(trace_id) else None,
+                                                              **{'http.method': request.method, 'http.path': request.path})
+
+    @app.after_request
+    def tag_response(response):
+        root = flask.g.get('trace_span')
+        if root is not None:
+            root.tag('http.status_code', response.status_code)
+            response.headers[TRACE_ID_HEADER] = root.trace.id
+        return response
+
+    @app.teardown_request
+    def finish_trace(error=None):
+        root = flask.g.pop('trace_span', None)
+        if root is not None:
+            end_trace(root, flask.g.pop('trace_token'), error)
+
+
+def waterfall(spans):
+    """
+    Rows for the waterfall view: the spans in tree order with their depth and position as percentages of the trace
+    """
+    if not spans:
+        return []
+
+    start = min(span['timestamp'] for span in spans)
+    end = max(span['timestamp'] + span['duration'] for span in spans)
+    total = max(1, end - start)
+
+    children = {}
+    ids = {span['id'] for span in spans}
+    for span in sorted(spans, key=lambda span: span['timestamp']):
+        parent = span.get('parentId') if span.get('parentId') in ids else None
+        children.setdefault(parent, []).append(span)
+
+    rows = []
+
+    def add(parent, depth):
+        for span in children.get(parent, []):
+            rows.append({'name': span['name'], 'depth': depth, 'tags': span.get('tags', {}),
+                         'start_ms': (span['timestamp'] - start) / 1000, 'duration_ms': span['duration'] / 1000,
+                         'offset': 100 * (span['timestamp'] - start) / total, 'width': max(0.2, 100 * span['duration'] / total)})
+            add(span['id'], depth + 1)
+
+    add(None, 0)
+    return rows
@@ -0,0 +1,103 @@
+# Startup warm-up: scan the catalog, import every script and compile every template before users arrive
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+
+class WarmUp():
+    def __init__(self, app, catalog, threads=4):
+        self.app = app
+        self.catalog = catalog
+        self.threads = threads
+        self.started = None
+        self.finished = None
+        self.total = 0
+        self.done = 0
+        self.errors = []
+        self._lock = threading.Lock()
+        self._complete = threading.Event()
+        self._thread = None
+
+    @property
+    def ready(self):
+        return self._complete.is_set()
+
+    def _tasks(self):
+        tasks = [(f"template {name}", self.app.jinja_env.get_template, name) for name in self.app.jinja_env.list_templates()]
+
+        for repo in self.catalog.scripts():
+            gui = repo['path'] / "gui"
+            if (gui / "main.py").exists():
+                tasks.append((f"module {repo['id']}", self.catalog.load_module, repo['id']))
+            if (gui / "ui.yml").exists():
+                tasks.append((f"ui {repo['id']}", self.catalog.ui_environment(repo['id']).get_template, "ui.yml"))
+            if (gui / "ui_spec.yml").exists():
+                tasks.append((f"ui spec {repo['id']}", self.catalog.static_ui_spec, repo['id']))
+
+        return tasks
+
+    def _run_task(self, name, func, arg):
+        try:
+            func(arg)
+        except Exception as e:
+            with self._lock:
+                self.errors.append(f"{name}: {type(e).__name__} {e}")
+        finally:
+            with self._lock:
+                self.done += 1
+
+    def run(self):
+        """
+        Warm everything up in the calling thread, using a pool for the imports and compiles
+        """
+        self.started = time.time()
+        try:
+            tasks = self._tasks()
+            with self._lock:
+                self.total = len(tasks)
+
+            with ThreadPoolExecutor(max_workers=self.threads) as pool:
+                for task in tasks:
+                    pool.submit(self._run_task, *task)
+        except Exception as e:
+            self.errors.append(f"catalog: {type(e).__name__} {e}")
+        finally:
+            self.finished = time.time()
+            self._complete.set()
+
+    def start(self):
+        """
+        Warm up in the background so app creation does not wait for it
+        """
+        self._thread = threading.Thread(target=self.run, name="warm-up", daemon=True)
+        self._thread.start()
+
+    def wait(self, timeout=None):
+        return self._complete.wait(timeout)
+
+    def status(self):
+        with self._lock:
+            elapsed = None
+            if self.started:
+                elapsed = round((self.finished or time.time()) - self.started, 3)
+
+            return {
+                'ready': self.ready,
+                'done': self.done,
+                'total': self.total,
+                'errors': list(self.errors),
+                'elapsed': elapsed,
+            }
+
+
+class NoWarmUp():
+    """
+    Stand-in used when warm-up is disabled, the app is ready as soon as it exists
+    """
+    ready = True
+
+    def wait(self, timeout=None):
+        return True
+
+    def status(self):
+        return {'ready': True, 'done': 0, 'total': 0, 'errors': [], 'elapsed': None}
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# Compare the git backends on the steps of one script submission against a local bare repo
+#
+#   ./benchmark_git_backends.py --runs 20
+import argparse
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from SourceControlMgmt.GitBackend import GIT_BACKENDS, SCMGitBackendError, get_git_backend
+
+STEPS = ['ls_remote', 'clone', 'create_branch', 'add', 'commit', 'push']
+
+
+def make_remote(directory, files):
+    """
+    Bare repo with a seed commit of the given number of files, standing in for the GitHub repo
+    """
+    bare = directory / "remote.git"
+    seed = directory / "seed"
+    subprocess.run(['git', 'init', '-q', '--bare', '-b', 'master', str(bare)], check=True)
+    subprocess.run(['git', 'init', '-q', '-b', 'master', str(seed)], check=True)
+    (seed / "epgs").mkdir()
+    for number in range(files):
+        (seed / "epgs" / f"epg-{number}.yml").write_text(f"---\nepgname: epg-{number}\n...\n")
+    subprocess.run(['git', 'add', '.'], cwd=seed, check=True)
+    subprocess.run(['git', '-c', 'user.name=seed', '-c', 'user.email=seed@example.com', 'commit', '-q', '-m', 'seed'], cwd=seed, check=True)
+    subprocess.run(['git', 'push', '-q', str(bare), 'master'], cwd=seed, check=True)
+    return bare
+
+
+def submission(backend, remote, work, number):
+    """
+    Time each step of one submission, the same sequence SourceControlMgmt runs
+    """
+    clone = work / f"{backend.name}-{number}"
+    branch = f"bench-{backend.name}-{number}"
+    timings = {}
+
+    def step(name, *args):
+        start = time.perf_counter()
+        results = getattr(backend, name)(*args)
+        timings[name] = time.perf_counter() - start
+        if results.returncode != 0:
+            raise RuntimeError(f"{backend.name} {name} failed: {results.stderr.decode()}")
+
+    step('ls_remote', str(remote))
+    step('clone', str(remote), clone)
+    step('create_branch', clone, branch)
+    (clone / "epgs" / f"{branch}.yml").write_text(f"---\nepgname: {branch}\n...\n")
+    step('add', clone, f"epgs/{branch}.yml")
+    step('commit', clone, "Benchmark", "bench@example.com", "Adding file to repo from python")
+    step('push', clone, str(remote), branch)
+
+    return timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SourceControlMgmt git backends on a local bare repo")
+    parser.add_argument("--runs", type=int, default=10, help="submissions per backend")
+    parser.add_argument("--files", type=int, default=200, help="files in the seed commit of the repo")
+    parser.add_argument("--backends", nargs='+', default=sorted(GIT_BACKENDS), help="backends to compare")
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as directory:
+        directory = Path(directory)
+        remote = make_remote(directory, args.files)
+
+        print(f"{'backend':<12}" + "".join(f"{step:>15}" for step in STEPS) + f"{'total':>15}   (median ms of {args.runs} runs)")
+        for name in args.backends:
+            try:
+                backend = get_git_backend(name)
+            except SCMGitBackendError as e:
+                print(f"{name:<12}skipped: {e}")
+                continue
+
+            runs = [submission(backend, remote, directory / "work", number) for number in range(args.runs)]
+            medians = [statistics.median(run[step] for run in runs) * 1000 for step in STEPS]
+            total = statistics.median(sum(run.values()) for run in runs) * 1000
+            print(f"{name:<12}" + "".join(f"{median:>15.1f}" for median in medians) + f"{total:>15.1f}")
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,8 @@
+#!/usr/bin/env python3
+# Build the minified, fingerprinted and precompressed static assets into app/static/dist
+from app.assets import build_assets, STATIC_DIR, DIST_NAME
+
+
+if __name__ == '__main__':
+    built = build_assets()
+    print(f"Built {len(built)} assets into {STATIC_DIR / DIST_NAME}")
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+# Run a script from ./repos over NDJSON input records without the web server
+#
+#   ./run_batch.py dc_2020_aci_legacy_tenant --input records.ndjson --workers 8 > results.ndjson
+import argparse
+import json
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from ApicClient.ApicClient import ApicClientRegistry
+from ScriptCatalog.ScriptCatalog import ScriptCatalog, call_script
+from Settings.Settings import Settings
+from SourceControlMgmt.GitBackend import set_default_git_backend
+from SourceControlMgmt.SourceControlMgmt import set_github_budget_dir
+
+
+# Set once per worker process, or once for the thread pool
+_runner = None
+
+
+class ScriptRunner():
+    def __init__(self, script, repos_dir=None, settings_file=None):
+        self.settings = Settings(settings_file)
+        set_default_git_backend(self.settings.git_backend)
+        set_github_budget_dir(self.settings.github_budget_dir)
+        self.catalog = ScriptCatalog(repos_dir)
+        self.module = self.catalog.load_module(script)
+        self.apic_clients = ApicClientRegistry(self.settings)
+
+    def services(self):
+        return {'apic': lambda: self.apic_clients.client() if self.apic_clients.configured() else None}
+
+    def run(self, index, phase, record):
+        start = time.perf_counter()
+        result = {'index': index, 'input': record, 'result': None, 'error': None}
+        try:
+            # As in the web app, pre() only gets the services it asks for, never form inputs
+            if phase == 'pre':
+                result['result'] = call_script(self.module.pre, self.services())
+            else:
+                result['result'] = call_script(getattr(self.module, phase), self.services(), **record)
+        except Exception as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        result['duration'] = round(time.perf_counter() - start, 4)
+        return result
+
+
+def _init_worker(script, repos_dir, settings_file):
+    global _runner
+    _runner = ScriptRunner(script, repos_dir, settings_file)
+
+
+def _run_record(index, phase, record):
+    return _runner.run(index, phase, record)
+
+
+def read_records(stream):
+    """
+    Yield (index, record) for every non-empty NDJSON line, bad lines become error results
+    """
+    for index, line in enumerate(stream):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("each line must be a JSON object")
+        except ValueError as e:
+            yield index, None, f"Invalid input line: {e}"
+            continue
+        yield index, record, None
+
+
+def run(script, records, output, phase='main', pool='thread', workers=4, repos_dir=None, settings_file=None):
+    """
+    Run the script for every record, writing each result as a JSON line as soon as it is done
+
+    The pre phase takes no inputs, so pre() runs once and its output is the only line.
+    """
+    if pool == 'process':
+        executor = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(script, repos_dir, settings_file))
+    else:
+        _init_worker(script, repos_dir, settings_file)
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    if phase == 'pre':
+        records = [(0, None, None)]
+
+    counts = {'ok': 0, 'failed': 0}
+
+    def emit(result):
+        counts['failed' if result['error'] else 'ok'] += 1
+        output.write(json.dumps(result, default=str) + "\n")
+        output.flush()
+
+    def failed(index, record, error):
+        emit({'index': index, 'input': record, 'result': None, 'error': error, 'duration': 0})
+
+    def collect(future):
+        # A worker that died or a result that could not be sent back fails its record, not the whole run
+        try:
+            emit(future.result())
+        except BrokenProcessPool as e:
+            failed(*pending.pop(future), f"Worker process failed: {e}")
+            return
+        except Exception as e:
+            failed(*pending.pop(future), f"Result could not be returned: {type(e).__name__}: {e}")
+            return
+        del pending[future]
+
+    # Only a few records per worker are in flight so large inputs are streamed, not loaded
+    pending = {}
+    with executor:
+        for index, record, error in records:
+            if error:
+                failed(index, None, error)
+                continue
+
+            try:
+                pending[executor.submit(_run_record, index, phase, record)] = (index, record)
+            except BrokenProcessPool as e:
+                failed(index, record, f"Worker process failed: {e}")
+                continue
+
+            if len(pending) >= workers * 4:
+                for future in wait(pending, return_when=FIRST_COMPLETED).done:
+                    collect(future)
+
+        for future in wait(pending).done:
+            collect(future)
+
+    return counts
+
+
+def main(argv=None, stdin=None, stdout=None):
+    parser = argparse.ArgumentParser(description="Run a GUI script over NDJSON records without the web server")
+    parser.add_argument("script", help="name of the script directory in ./repos")
+    parser.add_argument("--input", default='-', help="NDJSON file of records, '-' reads stdin")
+    parser.add_argument("--phase", choices=['main', 'pre'], default='main', help="call main() for each record, or pre() once")
+    parser.add_argument("--pool", choices=['thread', 'process'], default='thread', help="run records on threads or processes")
+    parser.add_argument("--workers", type=int, default=4, help="records run at once")
+    parser.add_argument("--repos", default=None, help="directory holding the scripts, ./repos by default")
+    parser.add_argument("--settings", default=None, help="settings file, ./settings.yml by default")
+    args = parser.parse_args(argv)
+
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+
+    if args.input == '-':
+        counts = run(args.script, read_records(stdin), stdout, args.phase, args.pool, args.workers, args.repos, args.settings)
+    else:
+        with open(args.input) as input_file:
+            counts = run(args.script, read_records(input_file), stdout, args.phase, args.pool, args.workers, args.repos, args.settings)
+
+    print(f"{counts['ok']} records succeeded, {counts['failed']} failed", file=sys.stderr)
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
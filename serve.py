@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+# Production entry point: a preforking gunicorn server around the Flask app
+import argparse
+import gc
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+from app import app, catalog, settings, warm_up
+from app.logs import init_logging
+from app.tracing import init_tracing
+from app.warmup import WarmUp
+
+
+class ProductionServer(BaseApplication):
+    def __init__(self, application, options=None):
+        self.application = application
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def preload():
+    """
+    Load everything the workers would otherwise build on their first request, threads do not survive the fork
+    """
+    if settings.warm_up:
+        warm_up.wait()
+    else:
+        WarmUp(app, catalog, threads=settings.warm_up_threads).run()
+
+
+def default_workers():
+    return multiprocessing.cpu_count() * 2 + 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bind", default=os.getenv('APP_BIND', '0.0.0.0:5000'), help="address and port to listen on")
+    parser.add_argument("--workers", type=int, default=int(os.getenv('APP_WORKERS', default_workers())), help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=int(os.getenv('APP_THREADS', 1)), help="number of threads per worker process")
+    parser.add_argument("--timeout", type=int, default=int(os.getenv('APP_TIMEOUT', 120)), help="seconds before a silent worker is restarted")
+    args = parser.parse_args()
+
+    init_logging(settings)
+    init_tracing(settings)
+    preload()
+
+    # Everything allocated so far is shared with the workers, keep the collector from touching it
+    # so the pages stay shared copy-on-write after the fork
+    gc.collect()
+    gc.freeze()
+
+    options = {
+        'bind': args.bind,
+        'workers': args.workers,
+        'threads': args.threads,
+        'timeout': args.timeout,
+        'preload_app': True,
+        'worker_class': 'gthread' if args.threads > 1 else 'sync',
+    }
+    ProductionServer(app, options).run()
+
+
+if __name__ == '__main__':
+    main()
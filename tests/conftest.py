@@ -0,0 +1,21 @@
+import pytest
+import yaml
+
+
+@pytest.fixture
+def make_script(tmp_path):
+    """
+    Write a script's gui directory under root (tmp_path by default) and return it
+    """
+    def make_script(name, config=None, ui=None, main=None, root=None):
+        gui = (root or tmp_path) / name / "gui"
+        gui.mkdir(parents=True)
+        if config is not None:
+            (gui / "config.yml").write_text(yaml.dump(config))
+        if ui is not None:
+            (gui / "ui.yml").write_text(ui)
+        if main is not None:
+            (gui / "main.py").write_text(main)
+        return gui
+
+    yield make_script
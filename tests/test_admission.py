@@ -0,0 +1,131 @@
+from app.admission import Gate, AdmissionController, AdmissionQueueFull, AdmissionTimeout, UnknownScript
+from Settings.Settings import Settings
+from ScriptCatalog.ScriptCatalog import ScriptCatalog
+
+import pytest
+import threading
+import time
+import yaml
+
+
+@pytest.fixture
+def catalog(tmp_path):
+    for name, config in (('limited', {'max_concurrent_runs': 1, 'max_queued_runs': 1, 'queue_timeout': 0.2}), ('open', None),
+                         ('greedy', {'max_concurrent_runs': 1000, 'max_queued_runs': 1000, 'queue_timeout': 3600})):
+        gui = tmp_path / name / "gui"
+        gui.mkdir(parents=True)
+        if config:
+            (gui / "config.yml").write_text(yaml.dump(config))
+
+    yield ScriptCatalog(tmp_path)
+
+
+def hold(gate, started, release):
+    gate.acquire()
+    started.set()
+    release.wait()
+    gate.release()
+
+
+def test_gate_admits_up_to_limit():
+    gate = Gate('test', limit=2, max_queue=0, timeout=1)
+
+    gate.acquire()
+    gate.acquire()
+    with pytest.raises(AdmissionQueueFull):
+        gate.acquire()
+
+    gate.release()
+    gate.acquire()
+    assert gate.stats()['running'] == 2
+    assert gate.stats()['rejected'] == 1
+
+
+def test_gate_queues_until_a_slot_frees_up():
+    gate = Gate('test', limit=1, max_queue=1, timeout=5)
+    started, release = threading.Event(), threading.Event()
+    holder = threading.Thread(target=hold, args=(gate, started, release))
+    holder.start()
+    started.wait()
+
+    waiter = threading.Thread(target=gate.acquire)
+    waiter.start()
+    while gate.stats()['queue_depth'] == 0:
+        time.sleep(0.001)
+
+    with pytest.raises(AdmissionQueueFull):
+        gate.acquire()
+
+    release.set()
+    waiter.join(timeout=5)
+    holder.join(timeout=5)
+
+    stats = gate.stats()
+    assert stats['running'] == 1
+    assert stats['queue_depth'] == 0
+    assert stats['admitted'] == 2
+    assert stats['max_wait'] > 0
+
+
+def test_gate_times_out():
+    gate = Gate('test', limit=1, max_queue=1, timeout=0.05)
+    gate.acquire()
+
+    with pytest.raises(AdmissionTimeout):
+        gate.acquire()
+
+    assert gate.stats()['timed_out'] == 1
+    assert gate.stats()['queue_depth'] == 0
+
+
+def test_controller_uses_script_config(catalog):
+    controller = AdmissionController(Settings(), catalog)
+
+    with controller.admit('limited'):
+        with pytest.raises(AdmissionTimeout):
+            with controller.admit('limited'):
+                pass
+        with controller.admit('open'):
+            stats = controller.stats()
+
+    assert stats['global']['running'] == 2
+    assert stats['scripts']['limited']['limit'] == 1
+    assert stats['scripts']['open']['limit'] == Settings().max_concurrent_runs
+    assert controller.stats()['global']['running'] == 0
+
+
+def test_controller_global_limit(catalog):
+    settings = Settings()
+    settings.max_concurrent_runs = 1
+    settings.max_queued_runs = 0
+    controller = AdmissionController(settings, catalog)
+
+    with controller.admit('open'):
+        with pytest.raises(AdmissionQueueFull):
+            with controller.admit('limited'):
+                pass
+
+    assert controller.stats()['scripts']['limited']['running'] == 0
+
+
+def test_scripts_can_only_lower_the_limits(catalog):
+    settings = Settings()
+    controller = AdmissionController(settings, catalog)
+
+    with controller.admit('greedy'):
+        stats = controller.stats()['scripts']['greedy']
+
+    assert stats['limit'] == settings.max_concurrent_runs
+    assert stats['max_queue'] == settings.max_queued_runs
+    assert controller.script_gates['greedy'].timeout == settings.run_queue_timeout
+
+
+def test_unknown_scripts_are_rejected_without_a_gate(catalog):
+    controller = AdmissionController(Settings(), catalog)
+
+    for i in range(3):
+        with pytest.raises(UnknownScript):
+            with controller.admit(f'missing{i}'):
+                pass
+
+    assert controller.script_gates == {}
@@ -0,0 +1,418 @@
+from ApicClient.ApicClient import (ApicClient, ApicClientRegistry, ApicError, ApicLoginError, ApicTokenStoreError,
+                                   FileTokenStore, MemoryTokenStore, QueryCache, split_dn)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from Settings.Settings import Settings
+
+import json
+import os
+import pytest
+import threading
+import urllib.parse
+
+
+class MockApicHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, data):
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _token(self):
+        cookies = dict(c.strip().split('=', 1) for c in self.headers.get('Cookie', '').split(';') if '=' in c)
+        return cookies.get('APIC-cookie')
+
+    def _new_token(self):
+        apic = self.server
+        with apic.lock:
+            apic.issued += 1
+            token = f"token-{apic.issued}"
+            apic.valid_tokens.add(token)
+        return {'imdata': [{'aaaLogin': {'attributes': {'token': token, 'refreshTimeoutSeconds': str(apic.token_lifetime)}}}]}
+
+    def do_GET(self):
+        apic = self.server
+        url = urllib.parse.urlparse(self.path)
+        apic.requests.append(('GET', url.path, url.query))
+
+        if url.path == '/api/aaaRefresh.json':
+            if self._token() not in apic.valid_tokens:
+                return self._send(403, {'imdata': []})
+            apic.refreshes += 1
+            return self._send(200, self._new_token())
+
+        if self._token() not in apic.valid_tokens:
+            return self._send(403, {'imdata': [{'error': {'attributes': {'text': 'Token was invalid'}}}]})
+
+        return self._send(200, {'imdata': apic.objects.get(url.path, []), 'totalCount': str(len(apic.objects.get(url.path, [])))})
+
+    def do_POST(self):
+        apic = self.server
+        payload = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        apic.requests.append(('POST', self.path, payload))
+
+        if self.path == '/api/aaaLogin.json':
+            attributes = payload['aaaUser']['attributes']
+            if (attributes['name'], attributes['pwd']) != ('admin', 'secret'):
+                return self._send(401, {'imdata': []})
+            apic.logins += 1
+            return self._send(200, self._new_token())
+
+        if self._token() not in apic.valid_tokens:
+            return self._send(403, {'imdata': []})
+
+        if apic.fail_posts and apic.fail_posts(self.path, payload):
+            return self._send(400, {'imdata': [{'error': {'attributes': {'text': 'rejected by mock'}}}]})
+
+        apic.posts.append((self.path, payload))
+        return self._send(200, {'imdata': []})
+
+
+@pytest.fixture
+def mock_apic():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MockApicHandler)
+    server.lock = threading.Lock()
+    server.issued = 0
+    server.logins = 0
+    server.refreshes = 0
+    server.token_lifetime = 600
+    server.valid_tokens = set()
+    server.objects = {}
+    server.requests = []
+    server.posts = []
+    server.fail_posts = None
+    server.url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def client(mock_apic):
+    yield ApicClient(url=mock_apic.url, username='admin', password='secret')
+
+
+def test_client_requires_credentials():
+    with pytest.raises(TypeError) as e:
+        ApicClient(url='https://apic')
+
+    assert str(e.value) == "An APIC url, username and password are required"
+
+
+def test_login_once_for_many_requests(client, mock_apic):
+    mock_apic.objects['/api/class/fvTenant.json'] = [{'fvTenant': {'attributes': {'name': 'common'}}}]
+
+    for _ in range(5):
+        data = client.get('/api/class/fvTenant.json', cache=False)
+
+    assert data['imdata'][0]['fvTenant']['attributes']['name'] == 'common'
+    assert mock_apic.logins == 1
+
+
+def test_bad_credentials(mock_apic):
+    client = ApicClient(url=mock_apic.url, username='admin', password='wrong')
+
+    with pytest.raises(ApicLoginError) as e:
+        client.get('/api/class/fvTenant.json')
+
+    assert "Login failed" in str(e.value)
+
+
+def test_token_is_refreshed_before_it_expires(client, mock_apic):
+    client.get('/api/class/fvTenant.json', cache=False)
+
+    # Age the token into its refresh window
+    client._token['issued'] -= 500
+    client._token['expires'] -= 500
+    client.token_store.save(client.token_key, client._token)
+    client.get('/api/class/fvTenant.json', cache=False)
+
+    assert mock_apic.logins == 1
+    assert mock_apic.refreshes == 1
+
+
+def test_expired_token_logs_in_again(client, mock_apic):
+    client.get('/api/class/fvTenant.json', cache=False)
+
+    client._token['issued'] -= 700
+    client._token['expires'] -= 700
+    client.token_store.save(client.token_key, client._token)
+    client.get('/api/class/fvTenant.json', cache=False)
+
+    assert mock_apic.logins == 2
+    assert mock_apic.refreshes == 0
+
+
+def test_rejected_token_logs_in_again(client, mock_apic):
+    client.get('/api/class/fvTenant.json', cache=False)
+    mock_apic.valid_tokens.clear()
+
+    client.get('/api/class/fvTenant.json', cache=False)
+
+    assert mock_apic.logins == 2
+
+
+def test_request_errors_raise(client, mock_apic):
+    mock_apic.fail_posts = lambda path, payload: True
+
+    with pytest.raises(ApicError) as e:
+        client.post('/api/mo/uni.json', {'fvTenant': {'attributes': {'name': 'bad'}}})
+
+    assert "status: 400" in str(e.value)
+
+
+def test_file_token_store_shares_login_between_workers(tmp_path, mock_apic):
+    workers = [ApicClient(url=mock_apic.url, username='admin', password='secret', token_store=FileTokenStore(tmp_path))
+               for _ in range(4)]
+
+    threads = [threading.Thread(target=worker.get, args=('/api/class/fvTenant.json',)) for worker in workers]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert mock_apic.logins == 1
+    assert sum(worker.logins for worker in workers) == 1
+    assert len(list(tmp_path.glob('*.json'))) == 1
+
+
+def test_file_token_store_does_not_keep_the_password(tmp_path, mock_apic):
+    client = ApicClient(url=mock_apic.url, username='admin', password='secret', token_store=FileTokenStore(tmp_path))
+    client.get('/api/class/fvTenant.json')
+
+    token_file = next(tmp_path.glob('*.json'))
+    assert 'secret' not in token_file.read_text()
+    assert token_file.stat().st_mode & 0o077 == 0
+
+
+def test_file_token_store_refuses_an_open_directory(tmp_path):
+    shared = tmp_path / "tokens"
+    shared.mkdir()
+    shared.chmod(0o777)
+
+    with pytest.raises(ApicTokenStoreError):
+        FileTokenStore(shared)
+
+    (tmp_path / "link").symlink_to(shared)
+    shared.chmod(0o700)
+    with pytest.raises(ApicTokenStoreError):
+        FileTokenStore(tmp_path / "link")
+
+
+def test_file_token_store_never_follows_planted_links(tmp_path):
+    store = FileTokenStore(tmp_path / "tokens")
+    target = tmp_path / "target"
+    target.write_text("keep")
+    (tmp_path / "tokens" / f"key.json.{os.getpid()}.{threading.get_ident()}.tmp").symlink_to(target)
+    (tmp_path / "tokens" / "key.lock").symlink_to(target)
+
+    store.save('key', {'token': 't'})
+    assert store.load('key') == {'token': 't'}
+    assert target.read_text() == "keep"
+
+    with pytest.raises(OSError):
+        with store.locked('key'):
+            pass
+    assert target.read_text() == "keep"
+
+
+def test_registry_shares_one_client_per_apic(mock_apic):
+    settings = Settings()
+    settings.apic_creds = {'url': mock_apic.url, 'username': 'admin', 'password': 'secret'}
+    settings.apic_token_dir = ''
+    registry = ApicClientRegistry(settings)
+
+    assert registry.configured()
+    assert registry.client() is registry.client(mock_apic.url)
+    assert isinstance(registry.token_store(), MemoryTokenStore)
+
+
+def tenant(name):
+    return {'fvTenant': {'attributes': {'dn': f'uni/tn-{name}', 'name': name}}}
+
+
+def apic_gets(mock_apic):
+    return [r for r in mock_apic.requests if r[0] == 'GET']
+
+
+def test_class_queries_are_cached(client, mock_apic):
+    mock_apic.objects['/api/class/fvTenant.json'] = [tenant('common')]
+
+    first = client.get_class('fvTenant')
+    first['imdata'].append('changed by the caller')
+    second = client.get_class('fvTenant')
+
+    assert len(apic_gets(mock_apic)) == 1
+    assert second['imdata'] == [tenant('common')]
+    assert client.cache.stats()['hits'] == 1
+
+
+def test_cache_key_includes_filters(client, mock_apic):
+    client.get_class('fvAEPg', **{'query-target-filter': 'eq(fvAEPg.name,"web")'})
+    client.get_class('fvAEPg', **{'query-target-filter': 'eq(fvAEPg.name,"db")'})
+    client.get_class('fvAEPg', **{'query-target-filter': 'eq(fvAEPg.name,"web")'})
+
+    assert len(apic_gets(mock_apic)) == 2
+
+
+def test_cache_entries_expire(mock_apic):
+    client = ApicClient(url=mock_apic.url, username='admin', password='secret', cache=QueryCache(ttls={'fvTenant': 0}))
+
+    client.get_class('fvTenant')
+    client.get_class('fvTenant')
+    client.get_class('fvBD')
+    client.get_class('fvBD')
+
+    assert len(apic_gets(mock_apic)) == 3
+
+
+def test_post_invalidates_affected_queries(client, mock_apic):
+    client.get_class('fvTenant')
+    client.get_class('fvBD')
+    client.get_mo('uni/tn-prod', **{'rsp-subtree': 'full'})
+    client.get_mo('uni/tn-prod/ap-web')
+    client.get_mo('uni/tn-dev')
+
+    client.post('/api/mo/uni/tn-prod.json', {'fvTenant': {'attributes': {'dn': 'uni/tn-prod'},
+                                                          'children': [{'fvAp': {'attributes': {'name': 'web'}}}]}})
+    assert client.cache.stats()['entries'] == 2
+
+    client.get_class('fvBD')
+    client.get_mo('uni/tn-dev')
+    assert len(apic_gets(mock_apic)) == 5
+
+
+def test_deleting_a_parent_invalidates_its_children_classes(client, mock_apic):
+    for cls in ('fvTenant', 'fvAp', 'fvBD', 'fvAEPg'):
+        client.get_class(cls)
+    client.get_mo('uni/tn-dev')
+
+    client.post('/api/mo/uni.json', {'polUni': {'attributes': {},
+                                                'children': [{'fvTenant': {'attributes': {'name': 'prod', 'status': 'deleted'}}}]}})
+    assert client.cache.stats()['entries'] == 0
+
+    client.get_class('fvAEPg')
+    client.get_class('fvAp')
+    client.post('/api/mo/uni/tn-prod/ap-web.json', {'fvAp': {'attributes': {'dn': 'uni/tn-prod/ap-web', 'status': 'deleted'}}})
+    assert client.cache.stats()['entries'] == 0
+
+
+def test_changes_invalidate_the_caches_of_every_worker(tmp_path, mock_apic):
+    def worker():
+        store = FileTokenStore(tmp_path)
+        return ApicClient(url=mock_apic.url, username='admin', password='secret', token_store=store,
+                          cache=QueryCache(generations=store, generation_key='apic1'))
+
+    a, b = worker(), worker()
+    mock_apic.objects['/api/class/fvTenant.json'] = [tenant('common')]
+    assert b.get_class('fvTenant')['imdata'] == [tenant('common')]
+    assert b.get_class('fvBD')['imdata'] == []
+
+    a.post('/api/mo/uni/tn-prod.json', {'fvTenant': {'attributes': {'dn': 'uni/tn-prod', 'name': 'prod'}}})
+    mock_apic.objects['/api/class/fvTenant.json'] = [tenant('common'), tenant('prod')]
+
+    assert b.get_class('fvTenant')['imdata'] == [tenant('common'), tenant('prod')]
+    assert b.cache.stats()['entries'] == 1
+    b.get_class('fvTenant')
+    assert len(apic_gets(mock_apic)) == 3
+
+
+def test_responses_read_across_a_change_are_not_cached(tmp_path, mock_apic):
+    store = FileTokenStore(tmp_path)
+    cache = QueryCache(generations=store, generation_key='apic1')
+    before = cache.generation()
+    store.bump_generation('apic1')
+
+    cache.put(('class', 'fvTenant', ()), 'class', 'fvTenant', False, '{"imdata": []}', before)
+
+    assert cache.stats()['entries'] == 0
+
+
+def test_cache_evicts_least_recently_used():
+    cache = QueryCache(max_bytes=10)
+
+    cache.put('a', 'class', 'fvTenant', False, '1234')
+    cache.put('b', 'class', 'fvBD', False, '1234')
+    cache.get('a')
+    cache.put('c', 'class', 'fvCtx', False, '1234')
+
+    assert cache.get('a') == '1234'
+    assert cache.get('b') is None
+    assert cache.stats()['evictions'] == 1
+    assert cache.stats()['bytes'] == 8
+
+
+def test_split_dn_keeps_bracketed_rns_together():
+    dn = 'uni/tn-prod/ap-web/epg-web1/rspathAtt-[topology/pod-1/paths-101/pathep-[eth1/1]]'
+
+    assert split_dn(dn) == ['uni', 'tn-prod', 'ap-web', 'epg-web1', 'rspathAtt-[topology/pod-1/paths-101/pathep-[eth1/1]]']
+
+
+def test_batch_merges_objects_into_one_post(client, mock_apic):
+    with client.batch() as batch:
+        for i in range(50):
+            batch.add(f'uni/tn-prod/ap-web/epg-web{i}', 'fvAEPg', {'name': f'web{i}'})
+            batch.add(f'uni/tn-prod/ap-web/epg-web{i}/rspathAtt-[topology/pod-1/paths-101/pathep-[eth1/{i}]]',
+                      'fvRsPathAtt', {'encap': f'vlan-{100 + i}'})
+
+    assert batch.requests == 1
+    assert len(mock_apic.posts) == 1
+    assert all(result['status'] == 'ok' for result in batch.results)
+    assert len(batch.results) == 100
+
+    path, payload = mock_apic.posts[0]
+    assert path == '/api/mo/uni.json'
+    tenant = payload['polUni']['children'][0]['fvTenant']
+    assert tenant['attributes'] == {'dn': 'uni/tn-prod', 'status': 'modified'}
+    app_profile = tenant['children'][0]['fvAp']
+    assert len(app_profile['children']) == 50
+    assert app_profile['children'][0]['fvAEPg']['children'][0]['fvRsPathAtt']['attributes']['encap'] == 'vlan-100'
+
+
+def test_batch_respects_payload_limit(client, mock_apic):
+    batch = client.batch(max_payload_bytes=2000)
+    for tenant_name in ('a', 'b'):
+        batch.add(f'uni/tn-{tenant_name}', 'fvTenant', {'name': tenant_name})
+        for i in range(30):
+            batch.add(f'uni/tn-{tenant_name}/BD-bd{i}', 'fvBD', {'name': f'bd{i}'})
+    results = batch.submit()
+
+    assert 1 < batch.requests < 61
+    assert all(len(json.dumps(payload)) <= 2000 for _, payload in mock_apic.posts)
+    assert all(result['status'] == 'ok' for result in results)
+
+    # Parents are always sent before their children
+    assert mock_apic.posts[0][1]['polUni']['children'][0]['fvTenant']['attributes'] == {'name': 'a', 'dn': 'uni/tn-a'}
+
+
+def test_batch_reports_failures_per_object(client, mock_apic):
+    mock_apic.fail_posts = lambda path, payload: 'epg-bad' in json.dumps(payload)
+
+    with client.batch() as batch:
+        good = batch.add('uni/tn-prod/ap-web/epg-good', 'fvAEPg', {'name': 'good'})
+        bad = batch.add('uni/tn-prod/ap-web/epg-bad', 'fvAEPg', {'name': 'bad'})
+
+    assert batch.results[good]['status'] == 'ok'
+    assert batch.results[bad]['status'] == 'failed'
+    assert 'status: 400' in batch.results[bad]['error']
+
+
+def test_batch_posts_unknown_parents_on_their_own(client, mock_apic):
+    with client.batch() as batch:
+        batch.add('uni/tn-prod/ap-web/epg-web1', 'fvAEPg', {'name': 'web1'})
+        batch.add('uni/userext/user-bob', 'aaaUser', {'name': 'bob'})
+        batch.delete('topology/pod-1/node-101/sys', 'topSystem')
+
+    assert batch.requests == 3
+    expected_paths = ['/api/mo/uni.json', '/api/mo/uni/userext/user-bob.json', '/api/mo/topology/pod-1/node-101/sys.json']
+    assert [path for path, _ in mock_apic.posts] == expected_paths
+    assert mock_apic.posts[2][1] == {'topSystem': {'attributes': {'status': 'deleted', 'dn': 'topology/pod-1/node-101/sys'}}}
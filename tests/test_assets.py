@@ -0,0 +1,88 @@
+from app import assets
+from flask import Flask, render_template_string
+
+import gzip
+import json
+import pytest
+
+
+@pytest.fixture
+def static_dir(tmp_path):
+    static = tmp_path / "static"
+    (static / "styles" / "images").mkdir(parents=True)
+    (static / "styles" / "images" / "icon.png").write_bytes(b"\x89PNG fake image")
+    (static / "styles" / "site.css").write_text("/* a comment */\n.icon {\n    background: url(\"images/icon.png\");\n}\n" * 20)
+    (static / "site.js").write_text("function hello() {\n    // say hello\n    return 'hello';\n}\n" * 20)
+
+    yield static
+
+
+@pytest.fixture
+def client(static_dir):
+    assets.build_assets(static_dir)
+    app = Flask(__name__, static_folder=str(static_dir))
+    assets.init_app(app)
+
+    @app.route('/page')
+    def page():
+        return render_template_string("{{ url_for('static', filename='site.js') }}")
+
+    yield app.test_client()
+
+
+def test_build_assets_writes_manifest(static_dir):
+    manifest = assets.build_assets(static_dir)
+
+    assert set(manifest) == {'site.js', 'styles/site.css', 'styles/images/icon.png'}
+    assert manifest == json.loads((static_dir / "dist" / "manifest.json").read_text())
+    for hashed_name in manifest.values():
+        assert (static_dir / "dist" / hashed_name).exists()
+
+
+def test_build_assets_minifies_and_rewrites_css_urls(static_dir):
+    manifest = assets.build_assets(static_dir)
+    css = (static_dir / "dist" / manifest['styles/site.css']).read_text()
+
+    assert "a comment" not in css
+    assert manifest['styles/images/icon.png'].split('/', 1)[1] in css
+
+
+def test_build_assets_precompresses_text_files(static_dir):
+    manifest = assets.build_assets(static_dir)
+    js = static_dir / "dist" / manifest['site.js']
+
+    assert gzip.decompress(js.with_name(js.name + '.gz').read_bytes()) == js.read_bytes()
+    assert not (static_dir / "dist" / (manifest['styles/images/icon.png'] + '.gz')).exists()
+
+
+def test_fingerprint_changes_with_content():
+    assert assets.fingerprint('a/site.js', b'one') != assets.fingerprint('a/site.js', b'two')
+    assert assets.fingerprint('a/site.js', b'one').startswith('a/site.')
+
+
+def test_url_for_resolves_to_fingerprinted_name(client, static_dir):
+    manifest = assets.load_manifest(static_dir)
+
+    assert client.get('/page').data.decode() == f"/static/dist/{manifest['site.js']}"
+
+
+def test_static_handler_serves_precompressed_variant(client):
+    url = client.get('/page').data.decode()
+
+    rv = client.get(url, headers={'Accept-Encoding': 'gzip'})
+    assert rv.status_code == 200
+    assert rv.headers['Content-Encoding'] == 'gzip'
+    assert rv.headers['Content-Type'].startswith('text/javascript')
+    assert 'immutable' in rv.headers['Cache-Control']
+    assert 'Accept-Encoding' in rv.headers['Vary']
+
+    rv = client.get(url, headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in rv.headers
+    assert b"hello" in rv.data
+
+
+def test_static_handler_falls_back_for_original_files(client):
+    rv = client.get('/static/site.js')
+
+    assert rv.status_code == 200
+    assert 'immutable' not in rv.headers.get('Cache-Control', '')
@@ -0,0 +1,64 @@
+from app.bulk import BulkInputError, parse_rows, validate_rows
+
+import pytest
+
+
+SPEC = {
+    'intro': {'type': 'paragraph', 'default': '<b>hello</b>'},
+    'epg_name': {'type': 'text', 'regex': '[a-z0-9-]+'},
+    'vlan': {'type': 'text'},
+    'subnet': {'type': 'ip_cidr'},
+    'tenant': {'type': 'dropdown', 'options': ['prod', 'dev']},
+    'shared': {'type': 'checkbox'},
+    'owner': {'type': 'hidden', 'default': 'network-team'},
+}
+
+
+def test_parse_csv_rows():
+    rows = parse_rows('epgs.csv', b"epg_name,vlan\nweb,100\n db , 101\n")
+
+    assert rows == [{'epg_name': 'web', 'vlan': '100'}, {'epg_name': 'db', 'vlan': '101'}]
+
+
+def test_parse_yaml_rows():
+    rows = parse_rows('epgs.yml', "- epg_name: web\n  vlan: 100\n- epg_name: db\n  vlan:\n")
+
+    assert rows == [{'epg_name': 'web', 'vlan': '100'}, {'epg_name': 'db', 'vlan': ''}]
+
+
+@pytest.mark.parametrize("filename, content, message", [
+    ('epgs.txt', "epg_name\nweb\n", "must be a .csv, .yml or .yaml file"),
+    ('epgs.yml', "epg_name: web\n", "must be a list of mappings"),
+    ('epgs.yml', "- [web\n", "not valid YAML"),
+    ('epgs.csv', "epg_name,vlan\n", "does not contain any rows"),
+])
+def test_parse_rejects_bad_files(filename, content, message):
+    with pytest.raises(BulkInputError) as e:
+        parse_rows(filename, content)
+
+    assert message in str(e.value)
+
+
+def test_validate_rows_builds_form_data():
+    rows = [{'epg_name': 'web', 'vlan': '100', 'subnet': '10.1.1.1/24', 'tenant': 'prod', 'shared': 'yes'},
+            {'epg_name': 'db', 'vlan': '101', 'subnet': '10.1.2.1/24', 'tenant': 'dev', 'shared': ''}]
+
+    clean_rows, errors = validate_rows(rows, SPEC)
+
+    assert errors == []
+    assert clean_rows[0] == {'epg_name': 'web', 'vlan': '100', 'subnet': '10.1.1.1/24', 'tenant': 'prod', 'shared': '1',
+                             'owner': 'network-team'}
+    assert 'shared' not in clean_rows[1]
+
+
+def test_validate_rows_reports_every_problem():
+    rows = [{'epg_name': 'Web!', 'subnet': '10.1.1.1', 'tenant': 'prod'},
+            {'epg_name': 'db', 'subnet': '10.1.2.1/24', 'tenant': 'qa'},
+            {'epg_name': 'app', 'colour': 'blue'}]
+
+    _, errors = validate_rows(rows, SPEC)
+
+    assert errors == ["Row 1: 'Web!' does not match the pattern for epg_name",
+                      "Row 1: '10.1.1.1' is not an IP address with CIDR notation for subnet",
+                      "Row 2: 'qa' is not one of the choices for tenant",
+                      "Row 3: unknown columns ['colour']"]
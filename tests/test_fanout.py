@@ -0,0 +1,38 @@
+from app.fanout import run_parallel
+
+import threading
+import time
+
+
+def test_run_parallel_keeps_order_and_errors():
+    def square(x):
+        if x == 3:
+            raise ValueError("three is not allowed")
+        time.sleep(0.01 * (5 - x))
+        return x * x
+
+    results = run_parallel(square, range(5), max_workers=5)
+
+    assert results == [(0, None), (1, None), (4, None), (None, "ValueError: three is not allowed"), (16, None)]
+
+
+def test_run_parallel_bounds_concurrency():
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def work(x):
+        with lock:
+            running.append(x)
+            peak.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(x)
+
+    run_parallel(work, range(12), max_workers=3)
+
+    assert max(peak) <= 3
+
+
+def test_run_parallel_with_no_items():
+    assert run_parallel(lambda x: x, []) == []
@@ -0,0 +1,86 @@
+from SourceControlMgmt import GitBackend
+from SourceControlMgmt.GitBackend import SubprocessGitBackend, SCMGitBackendError, get_git_backend, set_default_git_backend
+
+import pytest
+import subprocess
+
+BACKENDS = ['subprocess', pytest.param('dulwich', marks=pytest.mark.skipif(GitBackend.porcelain is None, reason="dulwich is not installed"))]
+
+
+def git(*args, cwd=None):
+    return subprocess.run(['git', *args], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True).stdout.decode()
+
+
+@pytest.fixture
+def remote(tmp_path):
+    """
+    Bare repo with one commit on master, like a freshly created GitHub repo
+    """
+    bare = tmp_path / "remote.git"
+    seed = tmp_path / "seed"
+    git('init', '--bare', '-b', 'master', str(bare))
+    git('init', '-b', 'master', str(seed))
+    (seed / "epgs").mkdir()
+    (seed / "epgs" / "README").write_text("EPG files\n")
+    git('add', '.', cwd=seed)
+    git('-c', 'user.name=seed', '-c', 'user.email=seed@example.com', 'commit', '-m', 'seed', cwd=seed)
+    git('push', str(bare), 'master', cwd=seed)
+
+    return bare
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_submission_round_trip(remote, tmp_path, name):
+    backend = get_git_backend(name)
+    clone = tmp_path / "work" / "repo"
+
+    assert backend.ls_remote(str(remote)).returncode == 0
+    assert b"HEAD" in backend.ls_remote(str(remote)).stdout
+
+    results = backend.clone(str(remote), clone)
+    # Cloning over https prints only this line, a local clone adds "done."
+    assert results.returncode == 0 and results.stderr.startswith(f"Cloning into '{clone}'...\n".encode())
+
+    results = backend.create_branch(clone, "new_epg")
+    assert results.returncode == 0 and results.stderr == b"Switched to a new branch 'new_epg'\n"
+
+    (clone / "epgs" / "web.yml").write_text("epgname: web\n")
+    assert backend.add(clone, "epgs/web.yml").returncode == 0
+    assert backend.commit(clone, "Fake User", "fake@user.com", "Adding file to repo from python").returncode == 0
+    assert backend.push(clone, str(remote), "new_epg").returncode == 0
+
+    assert git('show', 'new_epg:epgs/web.yml', cwd=remote) == "epgname: web\n"
+    assert "Adding file to repo from python" in git('log', '-1', '--format=%s', 'new_epg', cwd=remote)
+    assert git('log', '-1', '--format=%an <%ae>|%cn <%ce>', 'new_epg', cwd=remote) == "Fake User <fake@user.com>|Fake User <fake@user.com>\n"
+
+
+@pytest.mark.parametrize("name", BACKENDS)
+def test_failures_are_reported_like_git(tmp_path, name):
+    backend = get_git_backend(name)
+
+    assert backend.ls_remote(str(tmp_path / "missing.git")).returncode != 0
+    assert backend.clone(str(tmp_path / "missing.git"), tmp_path / "clone").returncode != 0
+
+
+def test_backends_implement_every_operation():
+    class PartialBackend(GitBackend.GitBackend):
+        def clone(self, url, path):
+            pass
+
+    with pytest.raises(TypeError):
+        PartialBackend()
+
+
+def test_backend_selection(monkeypatch):
+    assert isinstance(get_git_backend(), SubprocessGitBackend)
+    assert isinstance(get_git_backend(SubprocessGitBackend()), SubprocessGitBackend)
+
+    with pytest.raises(SCMGitBackendError):
+        get_git_backend('libgit')
+    with pytest.raises(SCMGitBackendError):
+        set_default_git_backend('libgit')
+
+    monkeypatch.setattr("SourceControlMgmt.GitBackend.porcelain", None)
+    with pytest.raises(SCMGitBackendError, match="pip install dulwich"):
+        set_default_git_backend('dulwich')
+    assert isinstance(get_git_backend(), SubprocessGitBackend)
@@ -0,0 +1,227 @@
+from SourceControlMgmt.SourceControlMgmt import (SourceControlMgmt, GitHubBudget, SCMRateLimitError,
+                                                 PRIORITY_MUTATION, PRIORITY_QUERY)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import json
+import pytest
+import requests
+import socket
+import threading
+import time
+
+PR_DATA = {'data': {'createPullRequest': {'pullRequest': {'number': 1, 'url': 'https://github.com/o/r/pull/1'}}}}
+REPO_DATA = {'data': {'repository': {'id': 'repo-id', 'refs': {'nodes': []}}}}
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        github = self.server
+        query = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['query']
+        with github.lock:
+            github.requests.append((query.split()[0], time.monotonic()))
+            status, headers, data = github.script.pop(0) if github.script else (200, {}, None)
+            github.remaining = max(0, github.remaining - 1)
+
+        if data is None:
+            data = PR_DATA if query.lstrip().startswith('mutation') else REPO_DATA
+        headers = dict({'X-RateLimit-Remaining': str(github.remaining), 'X-RateLimit-Reset': str(int(time.time()) + 3600)}, **headers)
+
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def fake_github():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGitHubHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.script = []
+    server.remaining = 5000
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/graphql"
+
+    thread = threading.Thread(target=server.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_scm(fake_github, budget):
+    return SourceControlMgmt(username='fake', password='token', friendly_name='Fake User', email='fake@user.com',
+                             repo_name='repo', budget=budget, graphql_api=fake_github.url)
+
+
+def test_secondary_rate_limit_is_retried_after_retry_after(fake_github):
+    budget = GitHubBudget(mutation_interval=0)
+    scm = make_scm(fake_github, budget)
+    fake_github.script = [(403, {'Retry-After': '0.3'}, {'message': 'You have exceeded a secondary rate limit'})] * 2
+
+    start = time.monotonic()
+    data = scm.create_git_hub_pull_request(destination_branch='master', source_branch='new')
+
+    assert data == PR_DATA
+    assert len(fake_github.requests) == 4
+    assert time.monotonic() - start >= 0.6
+    assert budget.throttled_responses == 2
+
+
+def test_graphql_rate_limited_errors_back_off_with_jitter(fake_github):
+    budget = GitHubBudget(backoff_base=0.05, backoff_cap=0.1)
+    scm = make_scm(fake_github, budget)
+    fake_github.script = [(200, {}, {'errors': [{'type': 'RATE_LIMITED', 'message': 'API rate limit exceeded'}]})]
+
+    scm.get_all_current_branches()
+
+    assert len(fake_github.requests) == 3
+    assert budget.throttled_responses == 1
+
+
+def test_gives_up_after_max_retries(fake_github):
+    budget = GitHubBudget(max_retries=2, backoff_base=0.01, backoff_cap=0.01)
+    scm = make_scm(fake_github, budget)
+    fake_github.script = [(429, {'Retry-After': '0'}, {'message': 'slow down'})] * 5
+
+    with pytest.raises(SCMRateLimitError):
+        scm.get_all_current_branches()
+
+    assert len(fake_github.requests) == 4
+
+
+def test_queries_hold_back_for_the_reserve_but_pull_requests_go_ahead(fake_github):
+    budget = GitHubBudget(reserve=10, mutation_interval=0, max_wait=5)
+    scm = make_scm(fake_github, budget)
+    fake_github.remaining = 8
+
+    scm.create_git_hub_pull_request(destination_branch='master', source_branch='new')
+    assert budget.remaining == 7
+
+    # The budget resets far in the future, so a query fails fast instead of waiting for it
+    with pytest.raises(SCMRateLimitError):
+        scm.get_all_current_branches()
+
+    # Once the reset time passes the query is sent
+    budget.reset = time.time() + 0.3
+    start = time.monotonic()
+    scm.get_all_current_branches()
+    assert time.monotonic() - start >= 0.25
+
+
+def test_mutations_are_spaced(fake_github):
+    budget = GitHubBudget(mutation_interval=0.2)
+    scm = make_scm(fake_github, budget)
+
+    for _ in range(3):
+        scm.create_git_hub_pull_request(destination_branch='master', source_branch='new')
+
+    times = [at for kind, at in fake_github.requests if kind == 'mutation']
+    assert all(later - earlier >= 0.19 for earlier, later in zip(times, times[1:]))
+
+
+def test_waiting_mutations_are_sent_before_queries():
+    budget = GitHubBudget(mutation_interval=0)
+    order = []
+
+    budget.acquire(PRIORITY_QUERY)
+
+    def request(priority, name):
+        budget.acquire(priority)
+        order.append(name)
+        budget.release()
+
+    threads = [threading.Thread(target=request, args=(PRIORITY_QUERY, 'query'))]
+    threads[0].start()
+    while budget.stats()['waiting'] < 1:
+        time.sleep(0.001)
+    threads.append(threading.Thread(target=request, args=(PRIORITY_MUTATION, 'mutation')))
+    threads[1].start()
+    while budget.stats()['waiting'] < 2:
+        time.sleep(0.001)
+
+    budget.release()
+    for thread in threads:
+        thread.join(5)
+
+    assert order == ['mutation', 'query']
+
+
+def test_waiting_for_a_turn_gives_up_after_max_wait():
+    budget = GitHubBudget(max_wait=0.2)
+    budget.acquire(PRIORITY_QUERY)
+
+    start = time.monotonic()
+    with pytest.raises(SCMRateLimitError):
+        budget.acquire(PRIORITY_QUERY)
+
+    assert 0.15 <= time.monotonic() - start < 2
+    assert budget.stats()['waiting'] == 0
+
+
+def test_hung_github_request_times_out_and_frees_the_budget(fake_github):
+    budget = GitHubBudget(mutation_interval=0)
+    scm = make_scm(fake_github, budget)
+    scm.timeout = 0.2
+
+    # Accepts the connection but never answers
+    silent = socket.socket()
+    silent.bind(('127.0.0.1', 0))
+    silent.listen()
+    scm.git_hub_graphql_api = f"http://127.0.0.1:{silent.getsockname()[1]}/graphql"
+    try:
+        with pytest.raises(requests.exceptions.Timeout):
+            scm.get_all_current_branches()
+    finally:
+        silent.close()
+
+    assert budget.stats()['in_flight'] == 0
+
+
+class Response():
+    def __init__(self, headers):
+        self.headers = headers
+
+
+def test_workers_share_the_in_flight_slot(tmp_path):
+    first, second = (GitHubBudget(mutation_interval=0, max_wait=0.2, state_dir=tmp_path, key='token') for _ in range(2))
+
+    first.acquire()
+    with pytest.raises(SCMRateLimitError, match="for a turn"):
+        second.acquire()
+
+    first.release(Response({}))
+    second.acquire()
+    second.release(Response({}))
+
+
+def test_retry_after_from_one_worker_pauses_the_others(tmp_path):
+    first, second = (GitHubBudget(mutation_interval=0, max_wait=0.2, state_dir=tmp_path, key='token') for _ in range(2))
+
+    first.acquire()
+    first.release(Response({'Retry-After': '30', 'X-RateLimit-Remaining': '42', 'X-RateLimit-Reset': '1'}))
+
+    with pytest.raises(SCMRateLimitError, match="exhausted"):
+        second.acquire()
+    assert second.remaining == 42
+    assert 29 < second.stats()['paused_for'] <= 30
+
+
+def test_mutations_are_spaced_across_workers(tmp_path):
+    first, second = (GitHubBudget(mutation_interval=0.3, state_dir=tmp_path, key='token') for _ in range(2))
+
+    first.acquire(PRIORITY_MUTATION)
+    first.release(Response({}))
+    start = time.monotonic()
+    second.acquire(PRIORITY_MUTATION)
+    second.release(Response({}))
+
+    assert time.monotonic() - start >= 0.25
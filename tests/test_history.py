@@ -0,0 +1,111 @@
+from app.history import SCHEMA, RunHistory, inputs_hash, pull_request
+
+import sqlite3
+import time
+
+
+def record(history, **run):
+    defaults = {'started': time.time(), 'script': 'script_a', 'user': '10.0.0.1', 'kind': 'single', 'status': 'ok',
+                'duration': 1.0, 'phases': {'main': 1.0}, 'runs': 1, 'failed_runs': 0}
+    history.record(**dict(defaults, **run))
+
+
+def test_runs_are_written_in_batches_and_queried_newest_first(tmp_path):
+    history = RunHistory(tmp_path / "history.sqlite3", batch_size=50, flush_interval=0.05)
+    for i in range(120):
+        record(history, started=1000.0 + i, script=f"script_{i % 3}", duration=float(i))
+    history.flush()
+
+    runs = history.query(script='script_1', limit=5)
+    assert [run['started'] for run in runs] == [1118.0, 1115.0, 1112.0, 1109.0, 1106.0]
+    assert runs[0]['phases'] == {'main': 1.0}
+
+    slow = history.query(since=1100.0, min_duration=115, limit=500)
+    assert [run['duration'] for run in slow] == [119.0, 118.0, 117.0, 116.0, 115.0]
+
+
+def test_lookup_by_pull_request(tmp_path):
+    history = RunHistory(tmp_path / "history.sqlite3", flush_interval=0.01)
+    record(history, pr_number=42, pr_url='https://github.com/o/r/pull/42')
+    record(history)
+    history.flush()
+
+    assert [run['pr_url'] for run in history.query(pr_number=42)] == ['https://github.com/o/r/pull/42']
+
+
+def test_queries_use_the_indexes(tmp_path):
+    history = RunHistory(tmp_path / "history.sqlite3")
+    history.query()
+    db = history._connect()
+    plans = {name: " ".join(row[3] for row in db.execute("EXPLAIN QUERY PLAN " + sql, params))
+             for name, sql, params in [
+                 ('script', "SELECT * FROM runs WHERE script = ? ORDER BY started DESC LIMIT 50", ('a',)),
+                 ('slow', "SELECT * FROM runs WHERE started >= ? AND duration >= ? ORDER BY started DESC LIMIT 50", (0, 10)),
+                 ('pr', "SELECT * FROM runs WHERE pr_number = ?", (1,))]}
+    db.close()
+
+    assert 'runs_script_started' in plans['script']
+    assert 'runs_started_duration' in plans['slow']
+    assert 'runs_pr_number' in plans['pr']
+
+
+def test_inputs_hash_ignores_field_order():
+    assert inputs_hash({'a': '1', 'b': '2'}) == inputs_hash({'b': '2', 'a': '1'})
+    assert inputs_hash({'a': '1'}) != inputs_hash({'a': '2'})
+
+
+def test_pull_request_of_output():
+    output = {'data': {'createPullRequest': {'pullRequest': {'number': 7, 'url': 'https://pr/7'}}}}
+
+    assert pull_request(output) == (7, 'https://pr/7')
+    assert pull_request({'table': {}}) == (None, None)
+    assert pull_request(None) == (None, None)
+
+
+def test_database_from_before_the_shared_column_is_migrated(tmp_path):
+    path = tmp_path / "history.sqlite3"
+    db = sqlite3.connect(path)
+    db.executescript(SCHEMA.replace("    shared INTEGER NOT NULL DEFAULT 0,\n", ""))
+    db.execute("INSERT INTO runs (started, script, kind, status, duration, phases) VALUES (1.0, 'old', 'single', 'ok', 1.0, '{}')")
+    db.commit()
+    db.close()
+
+    history = RunHistory(path, flush_interval=0.01)
+    record(history, script='new', shared=1)
+    history.flush()
+
+    assert [(run['script'], run['shared']) for run in history.query()] == [('new', 1), ('old', 0)]
+    assert history.stats() == {'queued': 0, 'dropped': 0}
+
+
+def test_failed_writes_are_counted(tmp_path):
+    history = RunHistory(tmp_path / "history.sqlite3", flush_interval=0.01)
+    history.query()
+    db = sqlite3.connect(tmp_path / "history.sqlite3")
+    db.execute("DROP TABLE runs")
+    db.commit()
+    db.close()
+
+    record(history)
+    history.flush()
+
+    assert history.stats()['dropped'] == 1
+
+
+def test_database_is_created_on_first_use(tmp_path):
+    history = RunHistory(tmp_path / "history.sqlite3", flush_interval=0.01)
+    assert not (tmp_path / "history.sqlite3").exists()
+
+    record(history)
+    history.flush()
+
+    assert len(history.query()) == 1
+
+
+def test_unwritable_database_drops_runs_instead_of_failing(tmp_path):
+    history = RunHistory(tmp_path / "missing" / "history.sqlite3", flush_interval=0.01)
+
+    record(history)
+    history.flush()
+
+    assert history.stats()['dropped'] == 1
@@ -0,0 +1,74 @@
+from app.results import ResultStore, ResultTable, table_from_output
+
+import itertools
+import json
+
+
+def test_table_from_dict_rows_collects_columns_in_order():
+    table = table_from_output({'table': {'title': 'Faults', 'rows': [{'dn': 'a', 'code': 'F1'}, {'dn': 'b', 'severity': 'major'}]}})
+
+    assert table.title == 'Faults'
+    assert table.columns == ['dn', 'code', 'severity']
+    assert table.rows == [['a', 'F1', None], ['b', None, 'major']]
+
+
+def test_non_tabular_output_is_left_alone():
+    assert table_from_output({'data': {'createPullRequest': {}}}) is None
+    assert table_from_output(None) is None
+
+
+def test_pages_and_downloads():
+    table = ResultTable(['name', 'note'], [[f"ep{i}", 'a,"b"'] for i in range(250)])
+
+    assert table.page(3, 100) == [[f"ep{i}", 'a,"b"'] for i in range(200, 250)]
+    assert table.page(4, 100) == []
+
+    csv_text = "".join(table.iter_csv())
+    assert csv_text.splitlines()[:2] == ['name,note', 'ep0,"a,""b"""']
+
+    lines = list(table.iter_ndjson())
+    assert len(lines) == 250 and json.loads(lines[-1]) == {'name': 'ep249', 'note': 'a,"b"'}
+
+
+def test_store_keeps_the_newest_results(tmp_path, monkeypatch):
+    clock = itertools.count(1000)
+    monkeypatch.setattr("app.results.time.time", lambda: next(clock))
+    store = ResultStore(tmp_path, max_results=2, ttl=60)
+    first, second, third = (store.put(ResultTable(['n'], [[i]])) for i in range(3))
+
+    assert store.get(first) is None
+    assert store.get(second).rows == [[1]] and store.get(third).rows == [[2]]
+
+
+def test_store_expires_results(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.results.time.time", lambda: now[0])
+    store = ResultStore(tmp_path, ttl=60)
+    result_id = store.put(ResultTable(['n'], []))
+
+    now[0] += 59
+    assert store.get(result_id) is not None
+    now[0] += 2
+    assert store.get(result_id) is None
+
+
+def test_every_worker_reads_the_same_results(tmp_path):
+    # Each gunicorn worker has its own store object on the shared directory
+    writer, reader = ResultStore(tmp_path), ResultStore(tmp_path)
+    result_id = writer.put(ResultTable(['dn', 'code'], [['uni/tn-a', 'F1']], title='Faults'))
+
+    table = reader.get(result_id)
+    assert (table.columns, table.rows, table.title) == (['dn', 'code'], [['uni/tn-a', 'F1']], 'Faults')
+    assert reader.get('../results') is None
+    assert reader.get('unknown') is None
+
+
+def test_store_directory_is_made_by_the_first_result(tmp_path):
+    store = ResultStore(tmp_path / "results")
+    assert not (tmp_path / "results").exists()
+    assert store.get('unknown') is None
+
+    result_id = store.put(ResultTable(['dn'], [['uni/tn-a']]))
+
+    assert store.get(result_id).rows == [['uni/tn-a']]
+    assert (tmp_path / "results").stat().st_mode & 0o077 == 0
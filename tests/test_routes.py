@@ -0,0 +1,522 @@
+from app import app, catalog, routes, pre_cache
+from app.results import ResultStore
+from app.warmup import WarmUp
+from app.history import RunHistory
+from app.singleflight import SingleFlight
+from concurrent.futures import ThreadPoolExecutor
+
+import functools
+import io
+import os
+import pytest
+import re
+import sys
+
+
+@pytest.fixture
+def repos(tmp_path, monkeypatch, make_script):
+    make_script = functools.partial(make_script, root=tmp_path / "repos")
+    make_script("script_a", config={'display_name': 'Script A', 'description': 'First script'})
+    (tmp_path / "repos").mkdir(exist_ok=True)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(catalog, "repos_dir", tmp_path / "repos")
+    pre_cache.clear()
+    monkeypatch.setattr(routes, "history", RunHistory(tmp_path / "history.sqlite3", flush_interval=0.01))
+    monkeypatch.setattr(routes, "result_store", ResultStore(tmp_path / "results"))
+    monkeypatch.setattr(routes, "single_flight", SingleFlight(directory=tmp_path / "coalesce"))
+
+    yield make_script
+
+
+@pytest.fixture
+def client(repos):
+    app.config['TESTING'] = True
+    yield app.test_client()
+
+
+@pytest.mark.parametrize("url", ['/', '/index', '/script/script_a', '/welcome'])
+def test_pages_answer_if_none_match_with_304(client, url):
+    rv = client.get(url)
+    assert rv.status_code == 200
+    etag = rv.headers['ETag']
+
+    rv = client.get(url, headers={'If-None-Match': etag})
+    assert rv.status_code == 304
+    assert rv.headers['ETag'] == etag
+    assert rv.data == b""
+
+
+def test_etag_changes_with_catalog(client, repos):
+    etag = client.get('/').headers['ETag']
+
+    repos("script_b", config={'display_name': 'Script B'})
+
+    rv = client.get('/', headers={'If-None-Match': etag})
+    assert rv.status_code == 200
+    assert rv.headers['ETag'] != etag
+    assert b"Script B" in rv.data
+
+
+def test_etag_differs_per_script(client, repos):
+    repos("script_b")
+
+    assert client.get('/script/script_a').headers['ETag'] != client.get('/script/script_b').headers['ETag']
+
+
+def test_ready_when_warm_up_disabled(client):
+    rv = client.get('/ready')
+
+    assert rv.status_code == 200
+    assert rv.get_json()['ready'] is True
+
+
+def test_not_ready_until_warm_up_finishes(client, monkeypatch):
+    warm_up = WarmUp(app, catalog)
+    monkeypatch.setattr(routes, "warm_up", warm_up)
+
+    assert client.get('/ready').status_code == 503
+
+    warm_up.run()
+    rv = client.get('/ready')
+
+    assert rv.status_code == 200
+    assert rv.get_json()['done'] == rv.get_json()['total']
+
+
+ISOLATION_SCRIPT = """
+import threading
+import time
+
+NAME = "{name}"
+
+
+def pre():
+    time.sleep(0.001)
+    return {{'owner': NAME, 'thread': threading.get_ident()}}
+
+
+def main(**kwargs):
+    time.sleep(0.001)
+    return {{'data': {{'createPullRequest': {{'pullRequest': {{'number': NAME, 'url': kwargs['marker']}}}}}}}}
+"""
+
+
+def test_concurrent_requests_for_different_scripts_stay_isolated(client, repos):
+    names = [f"script_{i}" for i in range(4)]
+    for name in names:
+        repos(name, ui="owner:\n  type: hidden\n  default: {{ owner }}\n", main=ISOLATION_SCRIPT.format(name=name))
+
+    def submit(i):
+        name = names[i % len(names)]
+        marker = f"marker-{i}"
+        if i % 2:
+            rv = client.get(f'/run_script/{name}')
+            return f'value="{name}"' in rv.data.decode()
+        rv = client.post(f'/run_script/{name}', data={'marker': marker})
+        body = rv.data.decode()
+        return f"Pull Request Number: </b>{name}<br>" in body and marker in body
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        results = list(pool.map(submit, range(400)))
+
+    assert all(results)
+    assert 'main' not in sys.modules or not hasattr(sys.modules['main'], 'NAME')
+
+
+def test_scripts_load_under_their_own_module_names(repos):
+    repos("script_x", main=ISOLATION_SCRIPT.format(name="script_x"))
+    repos("script_y", main=ISOLATION_SCRIPT.format(name="script_y"))
+
+    x = catalog.load_module("script_x")
+    y = catalog.load_module("script_y")
+
+    assert x is not y
+    assert x.__name__ != y.__name__
+    assert (x.NAME, y.NAME) == ("script_x", "script_y")
+
+
+def test_run_script_answers_busy_when_queue_is_full(client, repos, monkeypatch):
+    repos("script_busy", main=ISOLATION_SCRIPT.format(name="script_busy"))
+    monkeypatch.setattr(routes.admission.global_gate, "limit", 0)
+    monkeypatch.setattr(routes.admission.global_gate, "max_queue", 0)
+
+    rv = client.post('/run_script/script_busy', data={'marker': 'busy'})
+
+    assert rv.status_code == 429
+    assert rv.headers['Retry-After']
+    assert b"busy" in rv.data
+    assert client.get('/stats/admission').get_json()['global']['rejected'] >= 1
+
+
+def test_unknown_scripts_get_no_admission_gate(client, repos):
+    rv = client.post('/run_script/<img src=x onerror=alert(1)>', data={})
+
+    assert rv.status_code == 404
+    assert b"<img" not in rv.data
+    assert client.get('/api/ui/no_such_script').status_code == 404
+    assert '<img src=x onerror=alert(1)>' not in routes.admission.script_gates
+    assert 'no_such_script' not in routes.admission.script_gates
+
+
+def test_scripts_ask_for_the_apic_client_by_name(client, repos, monkeypatch):
+    repos("script_apic", ui="apic:\n  type: hidden\n  default: {{ apic }}\n",
+          main="def pre(apic):\n    return {'apic': apic}\n")
+    monkeypatch.setattr(routes.apic_clients, "configured", lambda: True)
+    monkeypatch.setattr(routes.apic_clients, "client", lambda: "shared-client")
+
+    rv = client.get('/run_script/script_apic')
+
+    assert 'value="shared-client"' in rv.data.decode()
+
+
+FABRIC_SCRIPT = """
+def pre():
+    return {}
+
+
+def main(fabric, **kwargs):
+    if fabric['name'] == 'broken':
+        raise RuntimeError('fabric is down <img src=x onerror=alert(1)>')
+    return {'data': {'createPullRequest': {'pullRequest': {'number': fabric['name'], 'url': kwargs['marker']}}}}
+"""
+
+
+@pytest.fixture
+def fabrics(monkeypatch):
+    fabric_names = {'https://apic1': 'lab1', 'https://apic2': 'lab2', 'https://apic3': 'broken'}
+    monkeypatch.setattr(routes.settings, "fabric_names", fabric_names)
+    yield fabric_names
+
+
+def test_fabric_choices_only_for_fabric_aware_scripts(client, repos, fabrics):
+    repos("script_fabric", ui="marker:\n  type: text\n", main=FABRIC_SCRIPT)
+    repos("script_plain", ui="marker:\n  type: text\n", main=ISOLATION_SCRIPT.format(name="script_plain"))
+
+    assert b'value="https://apic2"' in client.get('/run_script/script_fabric').data
+    assert b'__fabrics' not in client.get('/run_script/script_plain').data
+
+
+def test_run_on_selected_fabrics(client, repos, fabrics):
+    repos("script_fabric", main=FABRIC_SCRIPT)
+
+    rv = client.post('/run_script/script_fabric', data={'marker': 'm1', '__fabrics': ['https://apic1', 'https://apic3']})
+    body = rv.data.decode()
+
+    assert rv.status_code == 200
+    assert "Ran on 2 fabrics, 1 succeeded" in body
+    assert "Pull Request Number: </b>lab1<br>" in body
+    assert "RuntimeError: fabric is down &lt;img src=x onerror=alert(1)&gt;" in body
+    assert "<img" not in body
+    assert "lab2" not in body
+
+
+def test_run_on_all_fabrics(client, repos, fabrics):
+    repos("script_fabric", main=FABRIC_SCRIPT)
+
+    body = client.post('/run_script/script_fabric', data={'marker': 'm1', '__fabrics': 'all'}).data.decode()
+
+    assert "Ran on 3 fabrics, 2 succeeded" in body
+    assert "Pull Request Number: </b>lab2<br>" in body
+
+
+BULK_UI = "epg_name:\n  type: text\n  regex: '[a-z0-9]+'\nmarker:\n  type: text\n"
+
+
+def test_bulk_submission_runs_every_row(client, repos):
+    repos("script_bulk", ui=BULK_UI, main=ISOLATION_SCRIPT.format(name="script_bulk"))
+    csv_file = "epg_name,marker\n" + "".join(f"epg{i},https://pr/{i}\n" for i in range(20))
+
+    rv = client.post('/run_script/script_bulk', data={'__bulk_file': (io.BytesIO(csv_file.encode()), 'rows.csv')},
+                     content_type='multipart/form-data')
+    body = rv.data.decode()
+
+    assert rv.status_code == 200
+    assert "Ran 20 rows, 20 succeeded" in body
+    assert all(f'href="https://pr/{i}"' in body for i in range(20))
+
+
+def test_bulk_submission_of_a_tabular_script(client, repos):
+    repos("script_bulk_table", ui=BULK_UI, main="def pre():\n    return {}\n\n\n"
+          "def main(epg_name, marker):\n    return {'table': {'columns': ['epg'], 'rows': [[epg_name]]}}\n")
+    csv_file = "epg_name,marker\nepga,1\nepgb,2\n"
+
+    rv = client.post('/run_script/script_bulk_table', data={'__bulk_file': (io.BytesIO(csv_file.encode()), 'rows.csv')},
+                     content_type='multipart/form-data')
+    body = rv.data.decode()
+
+    assert rv.status_code == 200
+    assert "Ran 2 rows, 2 succeeded" in body
+    assert "<td>epga</td>" in body and "<td>epgb</td>" in body
+    result_ids = set(re.findall(r'/results/([\w-]+)/download/csv', body))
+    assert len(result_ids) == 2
+    assert all(client.get(f'/results/{result_id}').status_code == 200 for result_id in result_ids)
+
+
+def test_bulk_submission_is_validated_before_anything_runs(client, repos):
+    repos("script_bulk", ui=BULK_UI, main="def pre():\n    return {}\n\n\ndef main(**kwargs):\n    raise RuntimeError('should not run')\n")
+    csv_file = "epg_name,marker\ngood,1\nBAD,2\n"
+
+    rv = client.post('/run_script/script_bulk', data={'__bulk_file': (io.BytesIO(csv_file.encode()), 'rows.csv')},
+                     content_type='multipart/form-data')
+
+    assert rv.status_code == 400
+    assert "Row 2: &#39;BAD&#39; does not match the pattern for epg_name" in rv.data.decode()
+
+
+SEARCH_UI = "epg:\n  type: dropdown_search\n  source: epgs\n"
+SEARCH_SCRIPT = """
+calls = []
+
+
+def pre():
+    calls.append(1)
+    return {'epgs': ['epg-%04d' % i for i in range(3000)] + ['Web', 'web-2', 'db']}
+
+
+def main(epg):
+    return {'epg': epg}
+"""
+
+
+def test_searchable_dropdown_is_not_inlined(client, repos):
+    repos("script_search", ui=SEARCH_UI, main=SEARCH_SCRIPT)
+
+    body = client.get('/run_script/script_search').data.decode()
+
+    assert 'data-source="/api/options/script_search/epgs"' in body
+    assert 'epg-0001' not in body
+
+
+def test_options_are_searched_by_prefix_and_paginated(client, repos):
+    repos("script_search", ui=SEARCH_UI, main=SEARCH_SCRIPT)
+    client.get('/run_script/script_search')
+
+    first = client.get('/api/options/script_search/epgs?q=EPG-01&per_page=40').get_json()
+    second = client.get('/api/options/script_search/epgs?q=epg-01&per_page=40&page=3').get_json()
+    web = client.get('/api/options/script_search/epgs?q=web').get_json()
+
+    assert first['total'] == 100 and first['more']
+    assert first['options'] == ['epg-%04d' % i for i in range(100, 140)]
+    assert second['options'] == ['epg-%04d' % i for i in range(180, 200)] and not second['more']
+    assert web['options'] == ['Web', 'web-2']
+    # The form load filled the cache, the searches did not call pre() again
+    assert catalog.load_module("script_search").calls == [1]
+
+
+def test_options_for_unknown_lists_are_not_found(client, repos):
+    repos("script_search", ui=SEARCH_UI, main=SEARCH_SCRIPT)
+
+    assert client.get('/api/options/script_search/nothing').status_code == 404
+    assert client.get('/api/options/no_script/epgs').status_code == 404
+    assert client.get('/api/options/script_search/epgs?page=x').status_code == 400
+    assert 'no_script' not in pre_cache._locks
+
+
+def test_option_searches_that_run_pre_are_admission_controlled(client, repos, monkeypatch):
+    repos("script_search", ui=SEARCH_UI, main=SEARCH_SCRIPT)
+    monkeypatch.setattr(routes.admission.global_gate, "limit", 0)
+    monkeypatch.setattr(routes.admission.global_gate, "max_queue", 0)
+
+    rv = client.get('/api/options/script_search/epgs?q=web')
+
+    assert rv.status_code == 429
+    assert catalog.load_module("script_search").calls == []
+
+
+def test_bulk_rows_are_checked_against_searchable_options(client, repos):
+    repos("script_search", ui=SEARCH_UI, main=SEARCH_SCRIPT)
+    csv_file = "epg\nepg-0001\nmissing\n"
+
+    rv = client.post('/run_script/script_search', data={'__bulk_file': (io.BytesIO(csv_file.encode()), 'rows.csv')},
+                     content_type='multipart/form-data')
+
+    assert rv.status_code == 400
+    assert "Row 2: &#39;missing&#39; is not one of the choices for epg" in rv.data.decode()
+
+
+UI_API_UI = """epg:
+  type: dropdown
+  options: {{ epgs }}
+name:
+  type: text
+  default: web
+  regex: '[a-z]+'
+note:
+  type: paragraph
+  default: <b>Careful</b>
+"""
+
+
+def test_ui_spec_api_returns_fields_in_order(client, repos):
+    repos("script_ui", ui=UI_API_UI, main="def pre():\n    return {'epgs': ['a', 'b']}\n\n\ndef main(**kwargs):\n    return {}\n")
+
+    rv = client.get('/api/ui/script_ui')
+    spec = rv.get_json()
+
+    assert rv.status_code == 200 and rv.content_type == 'application/json'
+    assert b': ' not in rv.data
+    assert [field['name'] for field in spec['fields']] == ['epg', 'name', 'note']
+    assert spec['fields'][0]['options'] == ['a', 'b']
+    assert spec['fields'][1] == {'type': 'text', 'default': 'web', 'regex': '[a-z]+', 'name': 'name'}
+    assert spec['bulk_field'] == '__bulk_file' and spec['fabrics'] == {}
+
+
+def test_ui_spec_api_revalidates_by_etag(client, repos):
+    repos("script_ui", ui=UI_API_UI, main="def pre():\n    return {'epgs': ['a', 'b']}\n\n\ndef main(**kwargs):\n    return {}\n")
+
+    rv = client.get('/api/ui/script_ui')
+    etag = rv.headers['ETag']
+    cached = client.get('/api/ui/script_ui', headers={'If-None-Match': etag})
+
+    assert 'no-cache' in rv.headers['Cache-Control']
+    assert cached.status_code == 304 and cached.data == b''
+
+    pre_cache.put("script_ui", {'epgs': ['a', 'b', 'c']})
+    changed = client.get('/api/ui/script_ui', headers={'If-None-Match': etag})
+
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_ui_spec_api_answers_304_before_doing_any_work(client, repos, monkeypatch):
+    gui = repos("script_ui", ui=UI_API_UI, main="def pre():\n    return {'epgs': ['a', 'b']}\n\n\ndef main(**kwargs):\n    return {}\n")
+    etag = client.get('/api/ui/script_ui').headers['ETag']
+
+    def no_work(*args, **kwargs):
+        raise AssertionError("the ui spec was built again")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(routes, "ui_spec", no_work)
+        patched.setattr(routes.admission.global_gate, "limit", 0)
+        patched.setattr(routes.admission.global_gate, "max_queue", 0)
+        cached = client.get('/api/ui/script_ui', headers={'If-None-Match': etag})
+
+    assert cached.status_code == 304 and cached.headers['ETag'] == etag
+
+    os.utime(gui / "ui.yml", ns=(0, 0))
+    changed = client.get('/api/ui/script_ui', headers={'If-None-Match': etag})
+
+    assert changed.status_code == 200 and changed.headers['ETag'] != etag
+
+
+def test_pre_cache_refills_take_admission_inside_the_refill_lock(client, repos, monkeypatch):
+    repos("script_search", ui=SEARCH_UI, main=SEARCH_SCRIPT)
+    held = []
+
+    def loader_for(original):
+        def watched(script, *args):
+            # No admission slot may be held while waiting for the refill lock
+            held.append(routes.admission.global_gate.stats()['running'])
+            return original(script, *args)
+        return watched
+
+    monkeypatch.setattr(pre_cache, "lookup", loader_for(pre_cache.lookup))
+    monkeypatch.setattr(pre_cache, "options", loader_for(pre_cache.options))
+
+    assert client.get('/api/options/script_search/epgs?q=web').status_code == 200
+    assert client.get('/api/ui/script_search').status_code == 200
+    assert held == [0, 0]
+
+
+def test_ui_spec_api_for_unknown_script(client, repos):
+    assert client.get('/api/ui/no_script').status_code == 404
+
+
+DICT_UI_SCRIPT = """
+def pre():
+    return {'epgs': ['web', 'db']}
+
+
+def ui(epgs):
+    return {'epg': {'type': 'dropdown', 'options': epgs}, 'name': {'type': 'text', 'default': '{{ not a template }}'}}
+
+
+def main(**kwargs):
+    return {}
+"""
+
+
+def test_script_ui_function_builds_the_form(client, repos):
+    repos("script_dict", ui="this: [is not: used", main=DICT_UI_SCRIPT)
+
+    body = client.get('/run_script/script_dict').data.decode()
+    spec = client.get('/api/ui/script_dict').get_json()
+
+    assert '<option value="db">db</option>' in body
+    assert 'value="{{ not a template }}"' in body
+    assert [field['name'] for field in spec['fields']] == ['epg', 'name']
+
+
+def test_static_ui_spec_with_bindings(client, repos):
+    gui = repos("script_static", main="def pre():\n    return {'epgs': ['web', 'db']}\n\n\ndef main(**kwargs):\n    return {}\n")
+    (gui / "ui_spec.yml").write_text("epg:\n  type: dropdown\n  bind:\n    options: epgs\n")
+
+    body = client.get('/run_script/script_static').data.decode()
+
+    assert '<option value="web">web</option>' in body and '<option value="db">db</option>' in body
+
+
+TABLE_SCRIPT = """
+def pre():
+    return {}
+
+
+def main(**kwargs):
+    return {'table': {'title': 'Endpoints', 'rows': [{'mac': '00:00:%04d' % i, 'ip': '<10.0.0.1>'} for i in range(250)]}}
+"""
+
+
+def test_table_output_is_paged_from_the_server(client, repos):
+    repos("script_table", main=TABLE_SCRIPT)
+
+    body = client.post('/run_script/script_table', data={}).data.decode()
+    result_id = body.split('id="result-')[1].split('"')[0]
+
+    assert "Rows 1 to 100 of 250" in body
+    assert "00:00:0099" in body and "00:00:0100" not in body
+    assert "&lt;10.0.0.1&gt;" in body
+
+    last = client.get(f'/results/{result_id}?page=3').data.decode()
+    assert "Rows 201 to 250 of 250" in last and "00:00:0249" in last and "Next" not in last
+
+    csv_file = client.get(f'/results/{result_id}/download/csv')
+    assert csv_file.mimetype == 'text/csv' and csv_file.data.decode().count("\n") == 251
+
+    ndjson = client.get(f'/results/{result_id}/download/ndjson').data.decode().splitlines()
+    assert len(ndjson) == 250
+
+    assert client.get('/results/unknown').status_code == 404
+    assert client.get(f'/results/{result_id}/download/xml').status_code == 404
+
+
+def test_runs_are_recorded_in_the_history(client, repos):
+    repos("script_iso", main=ISOLATION_SCRIPT.format(name="script_iso"), ui="marker:\n  type: text\n")
+
+    client.get('/run_script/script_iso')
+    client.post('/run_script/script_iso', data={'marker': 'https://github.com/o/r/pull/5'})
+    routes.history.flush()
+
+    runs = client.get('/api/history?script=script_iso').get_json()
+    assert [run['kind'] for run in runs] == ['single', 'form']
+    assert runs[0]['status'] == 'ok' and runs[0]['pr_url'] == 'https://github.com/o/r/pull/5'
+    assert set(runs[0]['phases']) == {'queue', 'main', 'render'}
+    assert set(runs[1]['phases']) == {'queue', 'pre', 'render'}
+
+    page = client.get('/history?since=today').data.decode()
+    assert page.count('class="history-link"') == 2
+    assert client.get('/api/history?since=yesterday').status_code == 400
+
+
+def test_identical_submissions_share_one_run(client, repos):
+    repos("script_slow", main="import threading\nimport time\n\ncalls = []\n\n\ndef pre():\n    return {}\n\n\n"
+                              "def main(**kwargs):\n    calls.append(kwargs)\n    time.sleep(0.2)\n"
+                              "    return {'data': {'createPullRequest': {'pullRequest': {'number': len(calls), 'url': 'https://pr/' + kwargs['name']}}}}\n")
+
+    def submit(name):
+        return app.test_client().post('/run_script/script_slow', data={'name': name, 'vlan': '10'}).data.decode()
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        bodies = list(pool.map(submit, ['web', 'web', 'web', 'db']))
+
+    assert len(catalog.load_module("script_slow").calls) == 2
+    assert bodies[0] == bodies[1] == bodies[2]
+    assert bodies[0] != bodies[3]
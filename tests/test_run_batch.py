@@ -0,0 +1,105 @@
+import run_batch
+
+import io
+import json
+import pytest
+
+
+SCRIPT = """
+import os
+
+
+def pre():
+    return {'tenants': ['common', 'mgmt']}
+
+
+def main(**kwargs):
+    if kwargs['name'] == 'bad':
+        raise ValueError('bad record')
+    if kwargs['name'] == 'unpicklable':
+        return {'created': lambda: None}
+    if kwargs['name'] == 'crash':
+        os._exit(1)
+    return {'created': kwargs['name']}
+"""
+
+
+@pytest.fixture
+def repos(tmp_path, make_script):
+    make_script("batch_script", main=SCRIPT)
+
+    yield tmp_path
+
+
+def run(repos, lines, *args):
+    stdout = io.StringIO()
+    rv = run_batch.main(['batch_script', '--repos', str(repos), *args], stdin=io.StringIO("\n".join(lines)), stdout=stdout)
+    results = sorted((json.loads(line) for line in stdout.getvalue().splitlines()), key=lambda r: r['index'])
+    return rv, results
+
+
+def test_runs_main_for_every_record(repos):
+    lines = [json.dumps({'name': f'epg{i}'}) for i in range(30)]
+
+    rv, results = run(repos, lines, '--workers', '3')
+
+    assert rv == 0
+    assert [r['result'] for r in results] == [{'created': f'epg{i}'} for i in range(30)]
+    assert all(r['error'] is None and r['duration'] >= 0 for r in results)
+
+
+def test_reports_errors_per_record(repos):
+    lines = [json.dumps({'name': 'good'}), 'not json', json.dumps({'name': 'bad'}), '', json.dumps(['a list'])]
+
+    rv, results = run(repos, lines)
+
+    assert rv == 1
+    assert [(r['index'], r['error']) for r in results] == [
+        (0, None),
+        (1, "Invalid input line: Expecting value: line 1 column 1 (char 0)"),
+        (2, "ValueError: bad record"),
+        (4, "Invalid input line: each line must be a JSON object"),
+    ]
+
+
+def test_pre_phase_runs_pre_once_without_inputs(repos):
+    rv, results = run(repos, [json.dumps({'name': 'epg1'}), json.dumps({'name': 'epg2'})], '--phase', 'pre')
+
+    assert rv == 0
+    assert [(r['input'], r['result']) for r in results] == [(None, {'tenants': ['common', 'mgmt']})]
+
+
+def test_process_pool(repos):
+    lines = [json.dumps({'name': f'epg{i}'}) for i in range(10)]
+
+    rv, results = run(repos, lines, '--pool', 'process', '--workers', '2')
+
+    assert rv == 0
+    assert [r['result'] for r in results] == [{'created': f'epg{i}'} for i in range(10)]
+
+
+def test_process_pool_failures_are_per_record_errors(repos):
+    lines = [json.dumps({'name': 'epg1'}), json.dumps({'name': 'unpicklable'})]
+
+    rv, results = run(repos, lines, '--pool', 'process', '--workers', '1')
+
+    assert rv == 1
+    assert results[0]['result'] == {'created': 'epg1'}
+    assert results[1]['input'] == {'name': 'unpicklable'}
+    assert results[1]['error'].startswith("Result could not be returned:")
+
+    rv, results = run(repos, [json.dumps({'name': 'crash'}), json.dumps({'name': 'epg2'})], '--pool', 'process', '--workers', '1')
+
+    assert rv == 1
+    assert results[0]['input'] == {'name': 'crash'}
+    assert results[0]['error'].startswith("Worker process failed:")
+    assert len(results) == 2
+
+
+def test_reads_input_file(repos, tmp_path):
+    input_file = tmp_path / "records.ndjson"
+    input_file.write_text(json.dumps({'name': 'epg1'}) + "\n")
+
+    rv, results = run(repos, [], '--input', str(input_file))
+
+    assert results[0]['result'] == {'created': 'epg1'}
@@ -0,0 +1,104 @@
+from ScriptCatalog.ScriptCatalog import ScriptCatalog, ScriptCatalogError, bind_spec, call_script
+
+import os
+import pytest
+
+
+@pytest.fixture
+def repos(tmp_path, make_script):
+    make_script("script_a", config={'display_name': 'Script A', 'description': 'First script'}, ui="name:\n  type: text\n")
+    make_script("script_b")
+
+    yield tmp_path
+
+
+def test_scripts_as_list(repos):
+    catalog = ScriptCatalog(repos)
+    scripts = catalog.scripts()
+
+    assert [s['id'] for s in scripts] == ['script_a', 'script_b']
+    assert scripts[0]['name'] == 'Script A'
+    assert scripts[0]['description'] == 'First script'
+    assert scripts[1]['name'] == 'script_b'
+
+
+def test_scripts_as_dict(repos):
+    catalog = ScriptCatalog(repos)
+    scripts = catalog.scripts(as_dict=True)
+
+    assert set(scripts) == {'script_a', 'script_b'}
+    assert scripts['script_a']['name'] == 'Script A'
+
+
+def test_refresh_only_rescans_on_change(repos, make_script):
+    catalog = ScriptCatalog(repos)
+
+    assert catalog.refresh() is True
+    version = catalog.version
+    assert catalog.refresh() is False
+    assert catalog.version == version
+
+    make_script("script_c", config={'display_name': 'Script C'})
+
+    assert catalog.refresh() is True
+    assert catalog.version != version
+    assert catalog.scripts(as_dict=True)['script_c']['name'] == 'Script C'
+
+
+def test_malformed_config(repos, make_script):
+    make_script("script_bad")
+    (repos / "script_bad" / "gui" / "config.yml").write_text("display_name: bad: yaml\n")
+
+    with pytest.raises(ScriptCatalogError) as e:
+        ScriptCatalog(repos).scripts()
+
+    assert "The config file for 'script_bad' is malformed" in str(e.value)
+
+
+def test_ui_environment_is_reused(repos):
+    catalog = ScriptCatalog(repos)
+
+    assert catalog.ui_environment('script_a') is catalog.ui_environment('script_a')
+
+
+def test_precompile_ui(repos):
+    catalog = ScriptCatalog(repos)
+
+    assert catalog.precompile_ui() == ['script_a']
+
+
+def test_static_ui_spec_is_parsed_once_per_change(repos):
+    catalog = ScriptCatalog(repos)
+    spec_file = repos / "script_a" / "gui" / "ui_spec.yml"
+
+    assert catalog.static_ui_spec("script_a") is None
+
+    spec_file.write_text("name:\n  type: text\n")
+    first = catalog.static_ui_spec("script_a")
+    assert first == {'name': {'type': 'text'}}
+    assert catalog.static_ui_spec("script_a") is first
+
+    spec_file.write_text("name:\n  type: password\n")
+    os.utime(spec_file, ns=(1, 1))
+    assert catalog.static_ui_spec("script_a") == {'name': {'type': 'password'}}
+
+    spec_file.write_text("- name\n")
+    os.utime(spec_file, ns=(2, 2))
+    with pytest.raises(ScriptCatalogError):
+        catalog.static_ui_spec("script_a")
+
+
+def test_bind_spec_fills_fields_without_changing_the_static_spec():
+    spec = {'epg': {'type': 'dropdown', 'bind': {'options': 'epgs', 'default': 'current'}}, 'note': {'type': 'paragraph'}}
+
+    bound = bind_spec(spec, {'epgs': ['web', 'db'], 'current': 'db'})
+
+    assert bound == {'epg': {'type': 'dropdown', 'options': ['web', 'db'], 'default': 'db'}, 'note': {'type': 'paragraph'}}
+    assert spec['epg']['bind'] == {'options': 'epgs', 'default': 'current'}
+
+
+def test_services_replace_form_fields_of_the_same_name():
+    def main(apic, epg_name):
+        return apic, epg_name
+
+    assert call_script(main, {'apic': lambda: 'client'}, apic='from the form', epg_name='web') == ('client', 'web')
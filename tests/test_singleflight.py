@@ -0,0 +1,149 @@
+from app.singleflight import SingleFlight, SharedRunError
+from concurrent.futures import ThreadPoolExecutor
+
+import json
+import os
+import pytest
+import threading
+import time
+
+
+def test_concurrent_calls_share_one_run():
+    flight = SingleFlight()
+    calls = []
+    release = threading.Event()
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return {'pr': 1}
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        futures = [pool.submit(flight.do, 'key', work) for _ in range(8)]
+        while flight.stats()['shared'] < 7:
+            time.sleep(0.001)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert calls == [1]
+    assert all(result is results[0][0] for result, _ in results)
+    assert sorted(shared for _, shared in results) == [False] + [True] * 7
+    assert flight.stats() == {'started': 1, 'shared': 7, 'in_flight': 0}
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+
+    assert flight.do('a', lambda: 1) == (1, False)
+    assert flight.do('b', lambda: 2) == (2, False)
+    assert flight.do('a', lambda: 3) == (3, False)
+
+
+def test_reuse_window_after_completion(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr("app.singleflight.time.monotonic", lambda: now[0])
+    flight = SingleFlight(reuse_window=10)
+
+    assert flight.do('a', lambda: 1) == (1, False)
+    now[0] += 9
+    assert flight.do('a', lambda: 2) == (1, True)
+    now[0] += 2
+    assert flight.do('a', lambda: 3) == (3, False)
+
+
+def test_waiters_get_the_error_and_failures_are_not_reused():
+    flight = SingleFlight(reuse_window=60)
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("push rejected")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(flight.do, 'a', fail)
+        started.wait(5)
+        follower = pool.submit(flight.do, 'a', lambda: 'not run')
+        while flight.stats()['shared'] < 1:
+            time.sleep(0.001)
+        release.set()
+
+        for future in (leader, follower):
+            with pytest.raises(RuntimeError, match="push rejected"):
+                future.result()
+
+    assert flight.do('a', lambda: 'ok') == ('ok', False)
+
+
+def in_worker(func):
+    """
+    Run func in a forked worker process, returning its pid
+    """
+    pid = os.fork()
+    if pid == 0:
+        try:
+            func()
+        finally:
+            os._exit(0)
+    return pid
+
+
+def test_workers_share_one_run_through_the_directory(tmp_path):
+    runs = tmp_path / "runs"
+    started = tmp_path / "started"
+
+    def work():
+        with open(runs, "a") as runs_file:
+            runs_file.write("run\n")
+        started.touch()
+        time.sleep(0.5)
+        return {'pr': 7}
+
+    leader = in_worker(lambda: SingleFlight(directory=tmp_path / "claims").do('key', work))
+    while not started.exists():
+        time.sleep(0.01)
+
+    result = SingleFlight(directory=tmp_path / "claims").do('key', work)
+    os.waitpid(leader, 0)
+
+    assert result == ({'pr': 7}, True)
+    assert runs.read_text() == "run\n"
+
+
+def test_workers_waiting_on_a_failed_run_get_its_error(tmp_path):
+    started = tmp_path / "started"
+
+    def fail():
+        started.touch()
+        time.sleep(0.5)
+        raise RuntimeError("push rejected")
+
+    leader = in_worker(lambda: SingleFlight(directory=tmp_path / "claims").do('key', fail))
+    while not started.exists():
+        time.sleep(0.01)
+
+    with pytest.raises(SharedRunError, match="RuntimeError: push rejected"):
+        SingleFlight(directory=tmp_path / "claims").do('key', lambda: 'not run')
+    os.waitpid(leader, 0)
+
+    # The failure is not reused once it finished
+    assert SingleFlight(reuse_window=60, directory=tmp_path / "claims").do('key', lambda: 'ok') == ('ok', False)
+
+
+def test_reuse_window_across_workers_and_sweep(tmp_path):
+    first = SingleFlight(reuse_window=10, directory=tmp_path / "claims")
+    second = SingleFlight(reuse_window=10, directory=tmp_path / "claims")
+
+    assert first.do('key', lambda: [1, 2]) == ([1, 2], False)
+    assert second.do('key', lambda: 'not run') == ([1, 2], True)
+
+    old = time.time() - 3600
+    for path in (tmp_path / "claims").iterdir():
+        os.utime(path, (old, old))
+        if path.suffix == '.json':
+            path.write_text(json.dumps(dict(json.loads(path.read_text()), finished=old)))
+            os.utime(path, (old, old))
+
+    assert second.do('other', lambda: 3) == (3, False)
+    assert sorted(path.suffix for path in (tmp_path / "claims").iterdir()) == ['.json', '.lock']
@@ -2,6 +2,7 @@ from SourceControlMgmt import SourceControlMgmt
 from SourceControlMgmt.SourceControlMgmt import (SCMCredentialValidationError, SCMCloneRepoError,
                                                  SCMCreateBranchError, SCMWriteFileError,
                                                  SCMPushDataError, SCMDeleteRepoError, SCMGraphQLError)
+from concurrent.futures import ThreadPoolExecutor
 
 import pytest
 import subprocess
@@ -10,6 +11,13 @@ import pathlib
 import requests
 
 
+@pytest.fixture(autouse=True)
+def budget_dir(tmp_path, monkeypatch):
+    # Importing the app points the GitHub budgets at the shared directory, keep these tests' budgets to themselves
+    monkeypatch.setattr(SourceControlMgmt, "_budgets", {})
+    monkeypatch.setattr(SourceControlMgmt, "_budget_dir", str(tmp_path / "budget"))
+
+
 @pytest.fixture
 def mock_requests():
     class Mock_Requests_Return():
@@ -133,6 +141,7 @@ def setup(tmp_path):
 @pytest.fixture
 def scm(setup, monkeypatch, mock_requests):
     monkeypatch.setattr(requests, "post", mock_requests.mock_post)
+    SourceControlMgmt.credential_cache.clear()
     scm = SourceControlMgmt.SourceControlMgmt(username=setup.user,
                                               friendly_name=setup.friendly,
                                               email=setup.email,
@@ -184,6 +193,37 @@ def test_validate_scm_creds_with_valid_creds(setup, monkeypatch, scm):
     assert rv is True
 
 
+def test_validate_scm_creds_is_cached(setup, monkeypatch, scm):
+    calls = []
+
+    def count_calls(*args, **kwargs):
+        calls.append(args)
+        return setup.mock_success_return_clone_repo(*args, **kwargs)
+
+    monkeypatch.setattr(subprocess, "run", count_calls)
+
+    assert scm.validate_scm_creds() is True
+    assert scm.validate_scm_creds() is True
+    assert len(calls) == 1
+    assert all(setup.pwd not in str(key) for key in SourceControlMgmt.credential_cache._results)
+
+
+def test_validate_scm_creds_caches_failures_for_less_time(setup, monkeypatch, scm):
+    now = [1000.0]
+    monkeypatch.setattr(SourceControlMgmt.time, "monotonic", lambda: now[0])
+    monkeypatch.setattr(subprocess, "run", setup.mock_fail_return)
+
+    with pytest.raises(SCMCredentialValidationError):
+        scm.validate_scm_creds()
+
+    monkeypatch.setattr(subprocess, "run", setup.mock_success_return_clone_repo)
+    with pytest.raises(SCMCredentialValidationError):
+        scm.validate_scm_creds()
+
+    now[0] += SourceControlMgmt.credential_cache.negative_ttl + 1
+    assert scm.validate_scm_creds() is True
+
+
 def test_clone_private_repo(setup, monkeypatch, scm):
     monkeypatch.setattr(subprocess, "run", setup.mock_success_clone_repo)
 
@@ -323,6 +363,39 @@ def test_write_data_to_file_in_repo_invalid_directory(setup, scm):
     assert str(e.value) == "The path provided to save the file in does not exist"
 
 
+def test_write_data_to_file_in_repo_timestamps_never_collide(setup, scm):
+    scm.repo_path = setup.make_repo_directory()
+
+    names = []
+    for _ in range(50):
+        scm.write_data_to_file_in_repo(setup.valid_data, "test_file", file_name="epg.yml", append_timestamp=True, as_yaml=True)
+        names.append(scm.filename)
+
+    assert len(set(names)) == 50
+    assert names == sorted(names)
+    assert all(name.startswith("epg-") and name.endswith(".yml") for name in names)
+
+
+def test_unique_timestamp_across_threads():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        stamps = list(pool.map(lambda _: SourceControlMgmt.unique_timestamp(), range(2000)))
+
+    assert len(set(stamps)) == 2000
+
+
+@pytest.mark.parametrize("shard", ['date', 'hash'])
+def test_write_data_to_file_in_repo_sharded(setup, scm, shard):
+    scm.repo_path = setup.make_repo_directory()
+
+    rv = scm.write_data_to_file_in_repo(setup.valid_data, "test_file", file_name="epg.yml", as_yaml=True, shard=shard)
+
+    shard_dir = SourceControlMgmt.shard_directory("epg.yml", shard)
+    assert rv is True
+    assert scm.full_file_path == scm.repo_path / "test_file" / shard_dir / "epg.yml"
+    assert scm.relative_file_path == f"test_file/{shard_dir}/epg.yml"
+    assert len(shard_dir.split('/')) == (3 if shard == 'date' else 1)
+
+
 def test_push_data_to_remote_repo(setup, monkeypatch, scm):
     monkeypatch.setattr(subprocess, "run", setup.mock_success_return)
     setup.make_repo_directory()
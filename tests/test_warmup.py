@@ -0,0 +1,50 @@
+from app.warmup import WarmUp
+from flask import Flask
+from ScriptCatalog.ScriptCatalog import ScriptCatalog
+
+import pytest
+
+
+@pytest.fixture
+def repos(tmp_path, make_script):
+    for name in ('script_a', 'script_b'):
+        make_script(name, ui="name:\n  type: text\n", main="def pre():\n    return {}\n")
+
+    yield tmp_path
+
+
+@pytest.fixture
+def flask_app(tmp_path):
+    templates = tmp_path / "templates"
+    templates.mkdir()
+    (templates / "page.j2").write_text("{{ value }}")
+
+    yield Flask(__name__, template_folder=str(templates))
+
+
+def test_warm_up_loads_everything(repos, flask_app):
+    catalog = ScriptCatalog(repos)
+    warm_up = WarmUp(flask_app, catalog, threads=2)
+
+    assert warm_up.ready is False
+    warm_up.run()
+
+    status = warm_up.status()
+    assert status['ready'] is True
+    assert status['total'] == 5
+    assert status['done'] == 5
+    assert status['errors'] == []
+    assert catalog.load_module('script_a') is catalog.load_module('script_a')
+
+
+def test_warm_up_reports_errors(repos, flask_app):
+    (repos / "script_b" / "gui" / "main.py").write_text("raise RuntimeError('broken script')\n")
+    warm_up = WarmUp(flask_app, ScriptCatalog(repos))
+
+    warm_up.start()
+    assert warm_up.wait(timeout=10)
+
+    status = warm_up.status()
+    assert status['ready'] is True
+    assert status['done'] == status['total']
+    assert status['errors'] == ["module script_b: RuntimeError broken script"]
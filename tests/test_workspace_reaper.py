@@ -0,0 +1,104 @@
+from SourceControlMgmt import SourceControlMgmt
+from SourceControlMgmt.WorkspaceReaper import WorkspaceReaper
+
+import os
+import pytest
+import time
+
+
+def workspace(path, files=20):
+    path.mkdir(parents=True)
+    (path / ".git").mkdir()
+    for i in range(files):
+        (path / ".git" / f"object{i}").write_text("x" * 100)
+    return path
+
+
+@pytest.fixture
+def reaper(tmp_path):
+    return WorkspaceReaper(tmp_path / "trash")
+
+
+def test_discard_moves_out_of_the_way_and_deletes_in_background(reaper, tmp_path):
+    repo = workspace(tmp_path / "clones" / "repo")
+
+    reaper.discard(repo)
+
+    assert not repo.exists()
+    assert reaper.wait()
+    assert reaper.stats() == {'pending': 0, 'deleted': 1, 'deleted_in_caller': 0}
+
+
+def test_same_name_can_be_discarded_again_while_pending(reaper, tmp_path):
+    repo = tmp_path / "clones" / "repo"
+    for _ in range(3):
+        workspace(repo)
+        reaper.discard(repo)
+        assert not repo.exists()
+
+    assert reaper.wait()
+    assert reaper.deleted == 3
+
+
+def test_full_trash_deletes_in_caller(tmp_path):
+    reaper = WorkspaceReaper(tmp_path / "trash", max_pending=1)
+    (tmp_path / "trash" / "stuck").mkdir()
+
+    repo = workspace(tmp_path / "clones" / "repo")
+    reaper.discard(repo)
+
+    assert not repo.exists()
+    assert reaper.deleted_in_caller == 1
+
+
+def test_low_disk_deletes_in_caller(tmp_path):
+    reaper = WorkspaceReaper(tmp_path / "trash", min_free_bytes=2 ** 62)
+
+    repo = workspace(tmp_path / "clones" / "repo")
+    reaper.discard(repo)
+
+    assert not repo.exists()
+    assert reaper.deleted_in_caller == 1
+    assert reaper.pending() == 0
+
+
+def test_missing_workspace_is_ignored(reaper, tmp_path):
+    reaper.discard(tmp_path / "never-cloned")
+
+    assert reaper.stats() == {'pending': 0, 'deleted': 0, 'deleted_in_caller': 0}
+
+
+def test_cleanup_orphans_only_takes_old_workspaces(reaper, tmp_path):
+    old = workspace(tmp_path / "clones" / "old")
+    new = workspace(tmp_path / "clones" / "new")
+    an_hour_ago = time.time() - 3700
+    os.utime(old, (an_hour_ago, an_hour_ago))
+    # Left in the trash by a process that crashed before deleting it
+    workspace(tmp_path / "trash" / "crashed-1234")
+
+    discarded = reaper.cleanup_orphans([tmp_path / "clones", tmp_path / "missing"], max_age=3600)
+
+    assert discarded == [old]
+    assert not old.exists()
+    assert new.exists()
+    assert reaper.wait()
+    assert reaper.deleted == 2
+
+
+def test_scm_delete_uses_reaper(reaper, tmp_path, monkeypatch):
+    monkeypatch.setattr(SourceControlMgmt, "_workspace_reaper", reaper)
+    repo = workspace(tmp_path / "clones" / "repo")
+
+    SourceControlMgmt.remove_workspace(repo)
+
+    assert not repo.exists()
+    assert reaper.wait()
+    assert reaper.deleted == 1
+
+
+def test_scm_delete_without_reaper(tmp_path):
+    repo = workspace(tmp_path / "clones" / "repo")
+
+    SourceControlMgmt.remove_workspace(repo)
+
+    assert not repo.exists()